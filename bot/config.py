@@ -175,7 +175,8 @@ DATA_STORAGE = {
         "reports": "reports",
         "logs": "logs",
         "debug": "debug",
-        "raw": "raw_html"
+        "raw": "raw_html",
+        "cache": "cache"
     },
     "file_formats": {
         "csv": {
@@ -196,6 +197,187 @@ CSV_DIR = os.path.join(BASE_DIR, DATA_STORAGE["subdirs"]["csv"])
 REPORTS_DIR = os.path.join(BASE_DIR, DATA_STORAGE["subdirs"]["reports"])
 IMAGES_DIR = os.path.join(BASE_DIR, DATA_STORAGE["subdirs"]["images"])
 RAW_HTML_DIR = os.path.join(BASE_DIR, DATA_STORAGE["subdirs"]["raw"])
+CACHE_DIR = os.path.join(BASE_DIR, DATA_STORAGE["subdirs"]["cache"])
+DB_PATH = os.path.join(BASE_DIR, "bot.sqlite3")
+
+# -------------------------------------------------------------------
+# Кэш разобранных датасетов для команд анализа
+# -------------------------------------------------------------------
+DATASET_CACHE = {
+    # предел памяти под декодированные DataFrame (LRU), байт
+    "max_memory_bytes": 512 * 1024 * 1024,
+    # текстовая колонка становится category, если уникальных значений меньше этой доли
+    "category_ratio": 0.5,
+    # сколько хэшей файлов помнить (LRU), чтобы не перечитывать файл ради хэша
+    "max_hashes": 1024,
+    # CSV крупнее порога не грузится целиком, а читается чанками по chunksize строк
+    "streaming_min_bytes": 100 * 1024 * 1024,
+    "chunksize": 100_000,
+}
+
+
+# -------------------------------------------------------------------
+# Кэш готовых отчётов (графиков) в REPORTS_DIR
+# -------------------------------------------------------------------
+REPORT_CACHE = {
+    # суммарный объём закэшированных PNG, байт; старые вытесняются первыми
+    "max_bytes": 200 * 1024 * 1024,
+}
+
+
+# -------------------------------------------------------------------
+# Хранение файлов на диске: пределы по возрасту и объёму на папку
+# -------------------------------------------------------------------
+RETENTION = {
+    # как часто запускать очистку, сек
+    "interval": 3600,
+    # недокачанные загрузки (.part) старше этого удаляются, сек
+    "part_grace": 6 * 3600,
+    "dirs": {
+        CSV_DIR: {"max_age_days": 30, "max_bytes": 2 * 1024 ** 3},
+        REPORTS_DIR: {"max_age_days": 14, "max_bytes": REPORT_CACHE["max_bytes"]},
+        CACHE_DIR: {"max_age_days": 30, "max_bytes": 2 * 1024 ** 3},
+        get_selenium_config()["screenshots_dir"]: {"max_age_days": 7, "max_bytes": 200 * 1024 * 1024},
+        os.path.join(BASE_DIR, "html_dumps"): {"max_age_days": 7, "max_bytes": 500 * 1024 * 1024},
+    },
+}
+
+
+# -------------------------------------------------------------------
+# Выгрузка результатов парсинга
+# -------------------------------------------------------------------
+EXPORT = {
+    "formats": ("xlsx", "csv", "jsonl"),
+    "default_format": "xlsx",
+    # лимит Telegram на загрузку ботом — 50 МБ; части режутся с запасом
+    "max_part_bytes": 45 * 1024 * 1024,
+}
+
+
+# -------------------------------------------------------------------
+# Очередь задач парсинга
+# -------------------------------------------------------------------
+def _parse_weights(value: str) -> dict[int, float]:
+    weights = {}
+    for item in value.split(","):
+        chat_id, _, weight = item.partition(":")
+        if chat_id.strip() and weight.strip():
+            weights[int(chat_id)] = float(weight)
+    return weights
+
+
+CRAWL_QUEUE = {
+    # воркеров внутри процесса бота; 0 — только отдельные `python -m bot.worker`
+    "bot_workers": int(os.getenv("CRAWL_BOT_WORKERS", 1)),
+    # воркеров (одновременных парсингов) в каждом процессе bot.worker
+    "workers_per_process": 2,
+    "poll_interval": 2,
+    # задача без пульса дольше этого времени считается брошенной и берётся заново
+    "heartbeat_interval": 30,
+    "stale_after": 120,
+    # как часто обновлять сообщение с прогрессом, сек
+    "progress_interval": 15,
+    "max_attempts": 3,
+    # воркеры процесса бота только для коротких задач (карточка товара),
+    # чтобы они не ждали многочасовых парсингов категорий
+    "interactive_workers": 1,
+    # одновременных задач одного пользователя
+    "max_per_user": 2,
+    # веса пользователей в справедливой очереди: CRAWL_USER_WEIGHTS="123:3,456:2",
+    # остальные — 1; вес 2 — вдвое больше одновременных задач при конкуренции
+    "weights": _parse_weights(os.getenv("CRAWL_USER_WEIGHTS", "")),
+    # оценка ожидания, пока нет истории: секунд на товар категории и на карточку
+    "default_item_seconds": 8,
+    "product_seconds": 20,
+}
+
+
+# -------------------------------------------------------------------
+# Парсинг с ограничением по времени («сколько успеешь за 2 минуты»)
+# -------------------------------------------------------------------
+CRAWL_BUDGET = {
+    # доля бюджета, после которой выдача больше не листается — остальное на детали
+    "listing_share": 0.5,
+    # запас на выгрузку и отправку файла, сек
+    "reserve": 15,
+    # сколько товаров собирать, если задано только время
+    "max_items": 5000,
+}
+
+
+# -------------------------------------------------------------------
+# Выборочный парсинг для картины цен (см. services/sampling.py)
+# -------------------------------------------------------------------
+CRAWL_SAMPLE = {
+    # страт — равных диапазонов страниц выдачи — и случайных страниц в каждой
+    # (не меньше 2, иначе для страты нет оценки разброса)
+    "strata": 5,
+    "pages_per_stratum": 2,
+    # верхняя граница поиска последней страницы
+    "max_pages": 100,
+    # товаров с деталями, если в запросе не указано число
+    "details": 40,
+    "bootstrap": 300,
+    # сортировка выдачи, например {"wb": "priceup", "ozon": "price"}: страты
+    # страниц тогда совпадают с ценовыми диапазонами, но маркетплейс может
+    # отдавать не все страницы
+    "sort": {},
+    # ценовые диапазоны (руб.) отдельными стратами через фильтр выдачи, например
+    # ((0, 1000), (1000, 5000), (5000, 1_000_000))
+    "price_bands": (),
+    # параметры ссылки выдачи; цены в фильтре WB — в копейках
+    "params": {
+        "wb": {"sort": "sort", "price": "priceU", "price_scale": 100},
+        "ozon": {"sort": "sorting", "price": "currency_price", "price_scale": 1},
+    },
+}
+
+
+# -------------------------------------------------------------------
+# Шарды больших категорий по цене (см. services/sharding.py)
+# -------------------------------------------------------------------
+CRAWL_SHARD = {
+    # с такого числа товаров полный парсинг идёт шардами параллельно
+    "min_target": 2000,
+    # сколько страниц отдаёт пагинация маркетплейса
+    "page_cap": 100,
+    "max_shards": 32,
+    # сортировки «цена по возрастанию / по убыванию» для границ диапазона
+    "price_sorts": {"wb": ("priceup", "pricedown"), "ozon": ("price", "price_desc")},
+}
+
+
+# -------------------------------------------------------------------
+# Повторный парсинг категории (см. services/checkpoints.py)
+# -------------------------------------------------------------------
+CRAWL_SEEN = {
+    # детали товара категории, собранные не раньше стольких секунд назад,
+    # берутся из базы без открытия страницы товара (цены в них — того времени);
+    # 0 — детали всегда собираются заново
+    "details_max_age": 6 * 3600,
+}
+
+
+# -------------------------------------------------------------------
+# Параллельное чтение страниц выдачи Ozon (см. marketplace/ozon.py)
+# -------------------------------------------------------------------
+CRAWL_PAGES = {
+    # браузеров на задачу: столько страниц выдачи читается одновременно
+    "workers": int(os.getenv("CRAWL_PAGE_WORKERS", "3")),
+}
+
+
+# -------------------------------------------------------------------
+# Подгрузка карточек выдачи скроллом (см. selenium_utils.load_cards)
+# -------------------------------------------------------------------
+CRAWL_SCROLL = {
+    # нет новых узлов в DOM столько секунд после прокрутки вниз — выдача кончилась
+    "idle": 1.5,
+    # страница без карточек: столько ждём первую порцию, потом считаем её пустой
+    "empty_grace": 6,
+    # предел на одну страницу выдачи, сек
+    "timeout": 60,
+}
 
 
 # -------------------------------------------------------------------
@@ -235,7 +417,9 @@ ANALYSIS_CONFIG = {
         "dpi": 300,
         "figure_size": (15, 10),
         "style": "seaborn",
-        "colors": ["#2196F3", "#4CAF50", "#FFC107", "#F44336"]
+        "colors": ["#2196F3", "#4CAF50", "#FFC107", "#F44336"],
+        # процессы отрисовки графиков (вне event loop бота)
+        "render_workers": 2
     },
     "price_analysis": {
         "bins": 30,
@@ -244,6 +428,25 @@ ANALYSIS_CONFIG = {
     },
     "time_analysis": {
         "rolling_window": 7,
-        "min_periods": 1
+        "min_periods": 1,
+        # окно по умолчанию для запросов истории цен, дней
+        "default_range_days": 30,
+        # максимум точек в ответе: по нему выбирается разрешение rollup'а
+        "max_points": 400,
+        # сколько хранить сырые наблюдения и часовые агрегаты, дней
+        "raw_retention_days": 14,
+        "hourly_retention_days": 90,
+        # период фоновой очистки, секунд
+        "retention_interval": 3600
+    },
+    "price_alerts": {
+        # падение цены к предыдущему дню, % (порог по умолчанию для подписки)
+        "drop_pct": 10,
+        # отклонение от скользящего среднего в стандартных отклонениях
+        "zscore": 3.0,
+        # сколько строк алертов в одном сообщении и пауза между пачками отправок
+        "lines_per_message": 30,
+        "send_batch": 20,
+        "send_pause": 1.0
     }
 }
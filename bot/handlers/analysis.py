@@ -1,16 +1,28 @@
 # bot/handlers/analysis.py
 
+import asyncio
+import hashlib
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
 from pathlib import Path
-from collections import Counter
 
 from aiogram import types
-from aiogram.filters.command import Command
-from aiogram.types import ContentType, FSInputFile
+from aiogram.filters.command import Command, CommandObject
+from aiogram.types import ContentType
 
 from .commands import dp
+from ..services.aggregates import PartialAggregates, SUMMARY_COLUMNS, load_aggregates
+from ..services.charts import shutdown_renderer, warm_up_renderer
+from ..services.datasets import file_hash
+from ..services.file_ids import send_file
+from ..services.report_cache import NoReportData, cached_report
+from ..services.sketches import PriceSketch
+from ..services.ingest import ingest_dataset
+from ..services.retention import retention_loop
+from ..services.sessions import active_dataset, get_session, use_dataset
+from ..services.uploads import known_upload, store_upload
 
 # -------------------------------------------------------------------
 # Пути к папкам с данными
@@ -21,64 +33,75 @@ REPORTS_DIR = PROJECT_ROOT / "marketplace_data" / "reports"
 CSV_DIR.mkdir(parents=True, exist_ok=True)
 REPORTS_DIR.mkdir(parents=True, exist_ok=True)
 
-# Путь к последнему загруженному файлу
-_last_uploaded: Path | None = None
-
-
-def load_last_dataframe() -> pd.DataFrame | None:
-    """Загружает DataFrame из последнего присланного или самого свежего файла."""
-    global _last_uploaded
-    if _last_uploaded and _last_uploaded.exists():
-        try:
-            return (
-                pd.read_excel(_last_uploaded, sheet_name=0)
-                if _last_uploaded.suffix.lower() in (".xlsx", ".xls")
-                else pd.read_csv(_last_uploaded)
-            )
-        except Exception:
-            return None
-
-    # fallback: самый свежий файл в папке
-    files = list(CSV_DIR.glob("*.xlsx")) + list(CSV_DIR.glob("*.xls")) + list(CSV_DIR.glob("*.csv"))
-    if not files:
+def load_last_aggregates(chat_id: int) -> PartialAggregates | None:
+    """
+    Профиль активного датасета: строится при приёме файла (services.ingest)
+    и хранится на диске, так что команды анализа не трогают сами данные.
+    """
+    path = active_dataset(chat_id)
+    if path is None:
         return None
-    last = max(files, key=lambda f: f.stat().st_mtime)
     try:
-        return (
-            pd.read_excel(last, sheet_name=0)
-            if last.suffix.lower() in (".xlsx", ".xls")
-            else pd.read_csv(last)
-        )
+        return load_aggregates(path)
     except Exception:
         return None
 
 
+_background_tasks: set[asyncio.Task] = set()
+
+
+@dp.startup()
+async def start_chart_renderer():
+    warm_up_renderer()
+
+
+@dp.startup()
+async def start_file_retention():
+    """Периодическая очистка загрузок, отчётов, кэша, скриншотов и HTML-дампов."""
+    task = asyncio.create_task(retention_loop())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@dp.shutdown()
+async def stop_chart_renderer():
+    shutdown_renderer()
+
+
 @dp.callback_query(lambda c: c.data == 'analyze_prices')
 async def handle_analyze_prices(callback_query: types.CallbackQuery):
     await callback_query.message.answer(
         "🛠 Пришлите CSV/XLS/XLSX и, если хотите, сразу укажите в подписи команду:\n"
         "  /summary   — заполненность полей\n"
-        "  /price_hist— распределение цен\n"
+        "  /price_hist— распределение цен (/price_hist all — по всем вашим файлам)\n"
         "  /discount  — распределение скидок\n"
         "  /chars     — топ-15 характеристик\n"
         "  /compare   — сравнение по категориям\n"
         "  /margin    — маржинальность\n"
-        "  /flow      — динамика отзывов"
+        "  /flow      — динамика отзывов\n\n"
+        "  /datasets  — ваши последние файлы, /use N — выбрать активный"
     )
     await callback_query.answer()
 
 
 @dp.message(lambda m: m.content_type == ContentType.DOCUMENT)
 async def handle_file_upload(message: types.Message):
-    global _last_uploaded
     doc = message.document
     ext = Path(doc.file_name or "").suffix.lower()
     if ext not in (".csv", ".xlsx", ".xls"):
         return await message.reply("❌ Поддерживаются только файлы .csv, .xls и .xlsx")
-    dest = CSV_DIR / f"{doc.file_id}{ext}"
-    tg_file = await message.bot.get_file(doc.file_id)
-    await message.bot.download_file(tg_file.file_path, destination=dest)
-    _last_uploaded = dest
+    # повторная загрузка того же файла не скачивается: сразу к готовому кэшу
+    dest = await asyncio.to_thread(known_upload, doc.file_unique_id)
+    if dest is None:
+        tmp = CSV_DIR / f"{doc.file_unique_id}{ext}.part"
+        tg_file = await message.bot.get_file(doc.file_id)
+        await message.bot.download_file(tg_file.file_path, destination=tmp)
+        dest = await asyncio.to_thread(store_upload, tmp, doc.file_unique_id, CSV_DIR, ext)
+    # разбираем файл и строим профиль сразу, чтобы команды анализа отвечали по готовому
+    try:
+        await asyncio.to_thread(ingest_dataset, message.chat.id, dest, None, doc.file_name)
+    except Exception:
+        return await message.reply("❌ Не удалось прочитать файл.")
     await message.reply(f"✅ Сохранено как `{dest.name}`", parse_mode="Markdown")
 
     # если сразу в подписи команда — выполняем
@@ -97,75 +120,132 @@ async def handle_file_upload(message: types.Message):
             await mapping[cmd](message)
 
 
+@dp.message(Command("datasets"))
+async def cmd_datasets(message: types.Message):
+    session = await asyncio.to_thread(get_session, message.chat.id)
+    if not session.recent:
+        return await message.reply("❌ Нет данных. Пришлите CSV/XLS/XLSX.")
+    lines = [
+        f"{'▶' if entry is session.active else ' '} {i}. {entry.name}"
+        for i, entry in enumerate(session.recent, 1)
+    ]
+    await message.reply("🗂 Ваши датасеты:\n\n" + "\n".join(lines) + "\n\nВыбрать: /use N")
+
+
+@dp.message(Command("use"))
+async def cmd_use_dataset(message: types.Message, command: CommandObject):
+    arg = (command.args or "").strip()
+    entry = await asyncio.to_thread(use_dataset, message.chat.id, int(arg)) if arg.isdigit() else None
+    if entry is None:
+        return await message.reply("❌ Укажите номер из /datasets, например /use 2")
+    await message.reply(f"✅ Активный датасет: {entry.name}")
+
+
 @dp.message(Command("summary"))
 async def cmd_summary_report(message: types.Message):
-    df = load_last_dataframe()
-    if df is None:
+    agg = await asyncio.to_thread(load_last_aggregates, message.chat.id)
+    if agg is None:
         return await message.reply("❌ Нет данных. Пришлите CSV/XLS/XLSX.")
-    total = len(df)
-    miss = lambda col: df[col].isna().sum() / total * 100 if col in df else 0
-    stats = {
-        "Всего строк": total,
-        "% без final_price": miss("final_price"),
-        "% без wallet_price": miss("wallet_price"),
-        "% без old_price": miss("old_price"),
-        "% без price_history": miss("price_history"),
-        "% без rating": miss("rating"),
-        "% без reviews": miss("reviews"),
-    }
+    stats = {"Всего строк": agg.rows}
+    stats.update({f"% без {col}": agg.null_pct(col) for col in SUMMARY_COLUMNS})
     text = "\n".join(f"{k}: {v:.1f} %" for k, v in stats.items())
     await message.reply(f"📊 *Сводка по данным*\n\n{text}", parse_mode="Markdown")
 
 
+def _hist_spec(counts: np.ndarray, edges: np.ndarray, title: str, xlabel: str) -> dict:
+    """Гистограмма из скетча профиля: в процесс отрисовки уходят только 30 чисел."""
+    return {
+        "kind": "bars", "counts": counts, "edges": edges,
+        "title": title, "xlabel": xlabel, "ylabel": "Частота",
+    }
+
+
+def _dataset_hash(chat_id: int, merged: bool = False) -> str | None:
+    """Хэш активного датасета или, для merged, набора всех недавних датасетов чата."""
+    if merged:
+        hashes = [e.content_hash for e in get_session(chat_id).recent if e.path.exists()]
+        return hashlib.sha256("|".join(hashes).encode()).hexdigest() if hashes else None
+    path = active_dataset(chat_id)
+    return file_hash(path) if path else None
+
+
+async def _send_report(message: types.Message, command: str, build, params: dict | None = None,
+                       merged: bool = False):
+    """Отправляет график из кэша отчётов, при промахе строит его через build()."""
+    dataset_hash = await asyncio.to_thread(_dataset_hash, message.chat.id, merged)
+    if dataset_hash is None:
+        return await message.reply("❌ Нет данных. Пришлите CSV/XLS/XLSX.")
+    try:
+        path, caption = await cached_report(dataset_hash, command, params, build)
+    except NoReportData as e:
+        return await message.reply(str(e))
+    await send_file(message, "photo", path=path, caption=caption)
+
+
+def load_merged_price_sketch(chat_id: int) -> PriceSketch | None:
+    """Скетч цен, слитый по всем недавним датасетам чата (без пересканирования данных)."""
+    merged = PriceSketch()
+    for entry in get_session(chat_id).recent:
+        if entry.path.exists():
+            try:
+                merged.merge(load_aggregates(entry.path).price)
+            except Exception:
+                continue
+    return merged if merged.count else None
+
+
 @dp.message(Command("price_hist"))
 async def cmd_price_distribution(message: types.Message):
-    df = load_last_dataframe()
-    if df is None or "price_clean" not in df:
-        return await message.reply("❌ Нет поля price_clean.")
-    df["price_clean"].dropna().hist(bins=30)
-    plt.title("Распределение цен")
-    plt.xlabel("Цена"); plt.ylabel("Частота"); plt.grid(alpha=0.3)
-    out = REPORTS_DIR / "price_hist.png"
-    plt.tight_layout(); plt.savefig(out); plt.close()
-    await message.reply_photo(FSInputFile(path=out), caption="📈 Распределение цен")
+    """/price_hist [all] — по активному датасету или по всем недавним сразу."""
+    merged = "all" in (message.text or "").split()[1:]
+
+    async def build():
+        if merged:
+            sketch = await asyncio.to_thread(load_merged_price_sketch, message.chat.id)
+        else:
+            agg = await asyncio.to_thread(load_last_aggregates, message.chat.id)
+            sketch = agg.price if agg is not None and agg.price.count else None
+        if sketch is None:
+            raise NoReportData("❌ Нет поля price_clean.")
+        counts, edges = sketch.histogram(bins=30)
+        p25, p50, p75, p90 = sketch.kll.quantiles([0.25, 0.5, 0.75, 0.9])
+        caption = (
+            f"📈 Распределение цен ({sketch.count} шт.)\n"
+            f"Медиана: {p50:.0f}, P25–P75: {p25:.0f}–{p75:.0f}, P90: {p90:.0f}"
+        )
+        return _hist_spec(counts, edges, "Распределение цен", "Цена"), caption
+
+    await _send_report(message, "price_hist", build, {"bins": 30}, merged=merged)
 
 
 @dp.message(Command("discount"))
 async def cmd_discount_analysis(message: types.Message):
-    df = load_last_dataframe()
-    if df is None:
-        return await message.reply("❌ Нет данных.")
-    df = df.copy()
-    df["old_num"]   = pd.to_numeric(df.get("old_price", ""), errors="coerce")
-    df["final_num"] = pd.to_numeric(df.get("final_price", ""), errors="coerce")
-    df["discount_pct"] = (df["old_num"] - df["final_num"]) / df["old_num"] * 100
-    df["discount_pct"].dropna().hist(bins=30)
-    plt.title("Распределение скидок (%)")
-    plt.xlabel("Скидка, %"); plt.ylabel("Частота"); plt.grid(alpha=0.3)
-    out = REPORTS_DIR / "discounts.png"
-    plt.tight_layout(); plt.savefig(out); plt.close()
-    await message.reply_photo(FSInputFile(path=out), caption="💸 Распределение скидок")
+    async def build():
+        agg = await asyncio.to_thread(load_last_aggregates, message.chat.id)
+        if agg is None or not agg.discount.count:
+            raise NoReportData("❌ Требуются поля old_price и final_price.")
+        counts, edges = agg.discount.histogram(bins=30)
+        caption = f"💸 Распределение скидок\nМедиана: {agg.discount.median:.1f} %"
+        return _hist_spec(counts, edges, "Распределение скидок (%)", "Скидка, %"), caption
+
+    await _send_report(message, "discounts", build, {"bins": 30})
 
 
 @dp.message(Command("chars"))
 async def cmd_characteristics_freq(message: types.Message):
-    df = load_last_dataframe()
-    if df is None or "characteristics_parsed" not in df:
+    agg = await asyncio.to_thread(load_last_aggregates, message.chat.id)
+    if agg is None or not agg.char_keys:
         return await message.reply("❌ Нет поля characteristics_parsed.")
-    counter = Counter()
-    for props in df["characteristics_parsed"].dropna():
-        if isinstance(props, dict):
-            counter.update(props.keys())
-    text = "\n".join(f"{k}: {v}" for k, v in counter.most_common(15))
+    text = "\n".join(f"{k}: {v}" for k, v in agg.char_keys.most_common(15))
     await message.reply(f"📋 *Топ-15 характеристик*\n\n{text}", parse_mode="Markdown")
 
 
 @dp.message(Command("compare"))
 async def cmd_compare(message: types.Message):
-    df = load_last_dataframe()
-    if df is None or "category" not in df or "price_clean" not in df:
+    agg = await asyncio.to_thread(load_last_aggregates, message.chat.id)
+    if agg is None or not agg.group_count:
         return await message.reply("❌ Требуются поля category и price_clean.")
-    top5 = df.groupby("category")["price_clean"].mean().nlargest(5)
+    top5 = agg.group_means().nlargest(5)
     lines = [f"{i+1}. {cat[:30]}… — {val:.2f}" for i, (cat, val) in enumerate(top5.items())]
     await message.reply(
         "🏷 *Топ-5 категорий по средней цене:*\n\n" + "\n".join(lines),
@@ -175,34 +255,29 @@ async def cmd_compare(message: types.Message):
 
 @dp.message(Command("margin"))
 async def cmd_margin(message: types.Message):
-    df = load_last_dataframe()
-    if df is None or "cost" not in df or "price_clean" not in df:
-        return await message.reply("❌ Требуются поля cost и price_clean.")
-    df = df.copy()
-    df["margin_pct"] = (
-        df["price_clean"] -
-        pd.to_numeric(df["cost"], errors="coerce")
-    ) / df["price_clean"] * 100
-    df["margin_pct"].dropna().hist(bins=30)
-    plt.title("Маржинальность (%)")
-    plt.xlabel("Маржа %"); plt.ylabel("Частота"); plt.grid(alpha=0.3)
-    out = REPORTS_DIR / "margin.png"
-    plt.tight_layout(); plt.savefig(out); plt.close()
-    await message.reply_photo(FSInputFile(path=out), caption="📊 Маржинальность")
+    async def build():
+        agg = await asyncio.to_thread(load_last_aggregates, message.chat.id)
+        if agg is None or not agg.margin.count:
+            raise NoReportData("❌ Требуются поля cost и price_clean.")
+        counts, edges = agg.margin.histogram(bins=30)
+        caption = f"📊 Маржинальность\nМедиана: {agg.margin.median:.1f} %"
+        return _hist_spec(counts, edges, "Маржинальность (%)", "Маржа %"), caption
+
+    await _send_report(message, "margin", build, {"bins": 30})
 
 
 @dp.message(Command("flow"))
 async def cmd_flow(message: types.Message):
-    df = load_last_dataframe()
-    if df is None or "reviews" not in df or "parsed_at" not in df:
-        return await message.reply("❌ Требуются поля reviews и parsed_at.")
-    df = df.copy()
-    df["date"] = pd.to_datetime(df["parsed_at"], errors="coerce").dt.date
-    daily = df.groupby("date")["reviews"].sum()
-    plt.figure(figsize=(8, 4))
-    daily.plot(marker="o")
-    plt.title("Динамика отзывов")
-    plt.xlabel("Дата"); plt.ylabel("Сумма reviews"); plt.grid(alpha=0.3)
-    out = REPORTS_DIR / "flow.png"
-    plt.tight_layout(); plt.savefig(out); plt.close()
-    await message.reply_photo(FSInputFile(path=out), caption="📈 Динамика отзывов")
+    async def build():
+        agg = await asyncio.to_thread(load_last_aggregates, message.chat.id)
+        if agg is None or not agg.daily_reviews:
+            raise NoReportData("❌ Требуются поля reviews и parsed_at.")
+        daily = pd.Series(agg.daily_reviews).sort_index()
+        spec = {
+            "kind": "line", "figsize": (8, 4),
+            "x": list(daily.index), "y": daily.to_numpy(),
+            "title": "Динамика отзывов", "xlabel": "Дата", "ylabel": "Сумма reviews",
+        }
+        return spec, "📈 Динамика отзывов"
+
+    await _send_report(message, "flow", build)
@@ -1,6 +1,7 @@
 from bot.handlers.commands import dp
 
 # Импорт всех обработчиков
+from bot.handlers.category.jobs import start_crawl_workers
 from bot.handlers.category.wb_category import *
 from bot.handlers.category.ozon_category import *
 from bot.handlers.product.wb_product import *
@@ -1,2 +1,5 @@
+# /cancel регистрируется раньше хэндлеров состояний: иначе в диалоге
+# (ждём ссылку или число) его перехватит хэндлер шага
+from .jobs import *
 from .wb_category import *
-from .ozon_category import *
\ No newline at end of file
+from .ozon_category import *
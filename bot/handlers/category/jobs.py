@@ -0,0 +1,58 @@
+import asyncio
+import logging
+
+from aiogram import Bot, types
+from aiogram.filters.command import Command
+from aiogram.fsm.context import FSMContext
+
+from ..commands import dp
+from ...config import CRAWL_QUEUE
+from ...services.crawl_jobs import cancel_crawl, start_workers
+from ...services.job_queue import active_jobs
+
+logger = logging.getLogger(__name__)
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+@dp.startup()
+async def start_crawl_workers(bot: Bot):
+    """
+    Воркеры очереди парсинга внутри процесса бота, плюс отдельные для карточек
+    товаров. Брошенные задачи (перезапуск, падение) они тоже подхватывают —
+    по истёкшему пульсу.
+    """
+    workers = start_workers(bot, CRAWL_QUEUE["bot_workers"], interactive=CRAWL_QUEUE["interactive_workers"])
+    for task in workers:
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+_STATUS = {"queued": "в очереди", "running": "выполняется", "waiting": "выполняется шардами"}
+
+
+@dp.message(Command("cancel"))
+async def cmd_cancel(message: types.Message, state: FSMContext):
+    """/cancel — активные задачи чата с кнопками отмены (и сброс незаконченного диалога)."""
+    await state.clear()
+    jobs = await asyncio.to_thread(active_jobs, message.chat.id)
+    if not jobs:
+        return await message.reply("Активных задач нет.")
+    lines, rows = [], []
+    for job in jobs:
+        lines.append(f"#{job['job_id']} {job['marketplace']}: {job['target']} товаров, {_STATUS[job['status']]}")
+        rows.append([types.InlineKeyboardButton(text=f"🛑 #{job['job_id']}",
+                                                callback_data=f"cancel_job:{job['job_id']}:0")])
+        if job["kind"] == "category" and job["status"] == "running":
+            rows[-1].append(types.InlineKeyboardButton(text=f"📦 #{job['job_id']} и прислать собранное",
+                                                       callback_data=f"cancel_job:{job['job_id']}:1"))
+    await message.reply("Какую задачу отменить?\n" + "\n".join(lines),
+                        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=rows))
+
+
+@dp.callback_query(lambda c: c.data.startswith("cancel_job:"))
+async def handle_cancel_job(callback_query: types.CallbackQuery):
+    _, job_id, partial = callback_query.data.split(":")
+    text = await cancel_crawl(callback_query.bot, callback_query.message.chat.id,
+                              int(job_id), partial == "1")
+    await callback_query.answer(text)
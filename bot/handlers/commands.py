@@ -24,7 +24,7 @@ def marketplace_keyboard() -> types.InlineKeyboardMarkup:
         #[types.InlineKeyboardButton(text="Информация о товаре WB",      callback_data="parse_wb_product")],
         #[types.InlineKeyboardButton(text="Информация о товаре Ozon",    callback_data="parse_ozon_product")],
         [types.InlineKeyboardButton(text="Анализ цен из CSV",          callback_data="analyze_prices")],
-        #[types.InlineKeyboardButton(text="Мониторинг цен",             callback_data="price_monitoring")],
+        [types.InlineKeyboardButton(text="Мониторинг цен",             callback_data="price_monitoring")],
         #[types.InlineKeyboardButton(text="Помощь",                      callback_data="help")],
     ])
 
@@ -47,7 +47,8 @@ async def handle_help(message: types.Message):
         "Бот позволяет парсить данные с маркетплейсов Wildberries и Ozon.\n\n"
         "**Основные команды:**\n"
         "/start – Главное меню\n"
-        "/help  – Эта справка\n\n"
+        "/help  – Эта справка\n"
+        "/cancel – Отменить парсинг\n\n"
         "**Функции меню:**\n"
         "• Парсинг категории Wildberries\n"
         "• Парсинг категории Ozon\n"
@@ -1,15 +1,82 @@
+import asyncio
 import logging
+import time
+from datetime import datetime
+
 from aiogram import types
+from aiogram.filters.command import Command, CommandObject
 
 from bot.handlers.commands import dp
+from bot.services.price_alerts import subscribe, unsubscribe
+from bot.services.price_history import get_price_history, price_history_maintenance
 
 logger = logging.getLogger(__name__)
 
+_background_tasks: set[asyncio.Task] = set()
+
+
+@dp.startup()
+async def start_price_history_maintenance():
+    """Запускает фоновую очистку истории цен вместе с поллингом."""
+    task = asyncio.create_task(price_history_maintenance())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 @dp.callback_query(lambda c: c.data == 'price_monitoring')
 async def handle_price_monitoring(callback_query: types.CallbackQuery):
     """
     Обработчик кнопки 'Мониторинг цен'.
-    Пока просто отвечает заглушкой.
+    Подсказывает команды подписки на алерты.
     """
-    await callback_query.message.answer("🔄 Настройка мониторинга пока не реализована.")
+    await callback_query.message.answer(
+        "🔔 Алерты по ценам отслеживаемых товаров:\n"
+        "  /alerts [порог %] [артикул] — подписаться (по умолчанию на все товары)\n"
+        "  /alerts_off — отписаться\n"
+        "  /history <артикул> [дней] — история цены"
+    )
     await callback_query.answer()
+
+
+@dp.message(Command("alerts"))
+async def cmd_alerts(message: types.Message, command: CommandObject):
+    """/alerts [порог %] [артикул] — подписка на падения цен и аномалии."""
+    args = (command.args or "").split()
+    try:
+        drop_pct = float(args[0].rstrip("%")) if args else None
+    except ValueError:
+        return await message.reply("❌ Порог — число процентов, например /alerts 15")
+    sku = args[1] if len(args) > 1 else "*"
+    await asyncio.to_thread(subscribe, message.chat.id, sku, drop_pct)
+    target = "всем отслеживаемым товарам" if sku == "*" else f"товару {sku}"
+    await message.reply(f"✅ Подписка на алерты по {target} оформлена.")
+
+
+@dp.message(Command("alerts_off"))
+async def cmd_alerts_off(message: types.Message):
+    removed = await asyncio.to_thread(unsubscribe, message.chat.id)
+    await message.reply("✅ Подписки отключены." if removed else "ℹ️ Активных подписок нет.")
+
+
+@dp.message(Command("history"))
+async def cmd_price_history(message: types.Message, command: CommandObject):
+    """/history <артикул> [дней] — история цены из накопленных агрегатов."""
+    args = (command.args or "").split()
+    if not args:
+        return await message.reply("❌ Укажите артикул: /history 12345678 [дней]")
+    sku = args[0]
+    start = None
+    if len(args) > 1 and args[1].isdigit():
+        start = int(time.time()) - int(args[1]) * 86400
+    hist = await asyncio.to_thread(get_price_history, sku, start)
+    if hist.empty:
+        return await message.reply("❌ По этому артикулу нет наблюдений.")
+    lines = [
+        f"{datetime.fromtimestamp(r.ts):%Y-%m-%d %H:%M}: "
+        f"min {r.min:.0f} / max {r.max:.0f} / посл. {r.last:.0f}"
+        for r in hist.tail(20).itertuples()
+    ]
+    await message.reply(
+        f"📈 История цены {sku} (разрешение: {hist['resolution'].iat[0]}, точек: {len(hist)})\n\n"
+        + "\n".join(lines)
+    )
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from aiogram import types
@@ -6,7 +5,7 @@ from aiogram.fsm.context import FSMContext
 
 from ..commands import dp
 from ...states import MarketplaceForm
-from ...marketplace.ozon import get_full_product_info
+from ...services.crawl_jobs import enqueue_crawl
 
 logger = logging.getLogger(__name__)
 
@@ -19,12 +18,6 @@ async def handle_parse_ozon_product(callback_query: types.CallbackQuery, state:
 @dp.message(MarketplaceForm.waiting_for_ozon_product_url)
 async def process_ozon_product_url(message: types.Message, state: FSMContext):
     url = message.text.strip()
-    await message.reply("⏳ Получаю информацию...")
-    try:
-        info = await asyncio.to_thread(get_full_product_info, url, "ozon")
-        await message.reply(f"```json\n{info}\n```", parse_mode="Markdown")
-    except Exception as e:
-        logger.error(e)
-        await message.reply("❌ Ошибка при получении информации.")
-    finally:
-        await state.clear()
+    # браузер выдаёт очередь: карточки идут раньше парсингов категорий
+    await enqueue_crawl(message, "ozon", url, 1, kind="product")
+    await state.clear()
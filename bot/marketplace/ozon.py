@@ -1,7 +1,10 @@
 import asyncio
+import contextvars
 import logging
+import math
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from selenium import webdriver
@@ -13,14 +16,21 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 
 from ..services.parsers import parse_characteristics, normalize_characteristics, parse_product_parameters
+from ..services.cancellation import CrawlCancelled, check_cancelled
+from ..services.checkpoints import Checkpoint
+from ..services.job_queue import set_browsers
+from ..services.records import ProductRecord
+from ..services.sampling import CategorySample, crawl_sample, with_query
+from ..services.sharding import estimate_listing_size, plan_price_shards
 from ..services.selenium_utils import (
+    DriverPool,
     capture_screenshot,
     save_page_html,
     analyze_page_structure,
     get_webdriver,
-    scroll_page                
+    load_cards,
 )
-from ..config import get_marketplace_config
+from ..config import CRAWL_PAGES, CRAWL_SHARD, get_marketplace_config
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +65,8 @@ def get_full_product_info(product_url: str, marketplace: str) -> dict:
                 continue
             break
         except Exception as e:
+            # браузер закрыт отменой задачи — не ждать повторов
+            check_cancelled()
             logger.error(f'Ошибка при загрузке страницы: {e}')
             time.sleep(5)
     else:
@@ -100,7 +112,8 @@ def get_full_product_info(product_url: str, marketplace: str) -> dict:
     except:
         info['detail_images'] = []
 
-    # Характеристики: парсинг, нормализация, распаковка
+    # Характеристики: парсинг и нормализация. Отдельными колонками они
+    # становятся только в выгрузке (services.characteristics.export_frame)
     try:
         raw = driver.find_element(By.CSS_SELECTOR, details.get('characteristics','')).text
         parsed = parse_characteristics(raw)
@@ -109,10 +122,6 @@ def get_full_product_info(product_url: str, marketplace: str) -> dict:
         flat_chars = flatten_dict(normalized)
         info['characteristics_parsed'] = normalized
         info['extracted_characteristics'] = flat_chars
-        # Добавляем каждую характеристику как отдельное поле
-        for header, value in flat_chars.items():
-            key = re.sub(r"\W+", "_", header).strip('_').lower()
-            info[key] = value
     except Exception:
         info['characteristics_parsed'] = {}
         info['extracted_characteristics'] = {}
@@ -132,9 +141,6 @@ def get_full_product_info(product_url: str, marketplace: str) -> dict:
             flat_params = flatten_dict(params)
             info['parameters'] = params
             info['extracted_parameters'] = flat_params
-            for header, value in flat_params.items():
-                key = re.sub(r"\W+", "_", header).strip('_').lower()
-                info[key] = value
         except Exception:
             info['parameters'] = {}
             info['extracted_parameters'] = {}
@@ -143,45 +149,136 @@ def get_full_product_info(product_url: str, marketplace: str) -> dict:
     return info
 
 
-def parse_ozon_category(category_url: str, target_count: int) -> list:
-    cfg = get_marketplace_config('ozon')
-    driver = get_webdriver()
-    products = []
+def _card_record(card, cfg: dict) -> ProductRecord:
+    """Товар из карточки выдачи."""
     try:
-        driver.get(category_url)
-        time.sleep(5)
-        capture_screenshot(driver,'ozon_category')
-        html_path = save_page_html(driver,'ozon_category')
-        if html_path:
-            analyze_page_structure(html_path,'ozon')
-        asyncio.run(scroll_page(driver))
-        cards = driver.find_elements(By.CSS_SELECTOR,cfg['product_card_selector'])
-        for card in cards[:target_count]:
-            try:
-                title = card.find_element(By.CSS_SELECTOR,cfg['title_selector']).text
-            except:
-                title = ''
-            try:
-                price_txt = card.find_element(By.CSS_SELECTOR,cfg['price_selector']).text
-                price_clean = float(re.sub(r'[^\d.]','',price_txt) or 0)
-            except:
-                price_txt, price_clean = '',''
+        title = card.find_element(By.CSS_SELECTOR,cfg['title_selector']).text
+    except:
+        title = ''
+    # строку цены в число переводит normalize_prices() по всему DataFrame
+    try:
+        price_txt = card.find_element(By.CSS_SELECTOR,cfg['price_selector']).text
+    except:
+        price_txt = ''
+    try:
+        url = card.find_element(By.CSS_SELECTOR,cfg['link_selector']).get_attribute('href')
+    except:
+        url = ''
+    return ProductRecord(title, price_txt, url)
+
+
+def _read_listing_page(driver, url: str) -> list[ProductRecord]:
+    """Все товары одной страницы выдачи (?page=N) для выборочного парсинга."""
+    cfg = get_marketplace_config('ozon')
+    driver.get(url)
+    load_cards(driver, cfg)
+    cards = driver.find_elements(By.CSS_SELECTOR,cfg['product_card_selector'])
+    return [_card_record(card, cfg) for card in cards]
+
+
+def sample_ozon_category(category_url: str, detail_size: int,
+                         job_id: int | None = None) -> CategorySample:
+    """Выборка страниц категории и деталей части товаров (см. services/sampling.py)."""
+    return crawl_sample(category_url, 'ozon', detail_size, _read_listing_page,
+                        lambda url: get_full_product_info(url, 'ozon'), job_id)
+
+
+def plan_ozon_shards(category_url: str) -> list[str]:
+    """Ценовые шарды категории, каждый в пределах пагинации (см. services/sharding.py)."""
+    return plan_price_shards(category_url, 'ozon', _read_listing_page)
+
+
+def size_ozon_shard(shard_url: str) -> int:
+    """Оценка числа товаров в шарде — по ней делится target задачи."""
+    return estimate_listing_size(shard_url, _read_listing_page)
+
+
+def _read_pages(pool: DriverPool, executor: ThreadPoolExecutor, category_url: str,
+                pages: range) -> list[list[ProductRecord]]:
+    """
+    Страницы выдачи параллельно, браузерами пула; результат — по порядку
+    страниц. Сбойная страница читается ещё раз новым браузером, при повторном
+    сбое считается пустой (как при сбое пагинации WB — выдача на ней кончается).
+    """
+    def read(page: int) -> list[ProductRecord]:
+        url = with_query(category_url, page=page)
+        for attempt in (1, 2):
+            check_cancelled()
             try:
-                url = card.find_element(By.CSS_SELECTOR,cfg['link_selector']).get_attribute('href')
-            except:
-                url = ''
-            products.append({
-                'title': title,
-                'price': price_txt,
-                'price_clean': price_clean,
-                'url': url,
-            })
-    finally:
-        driver.quit()
+                return _read_listing_page(pool.get(), url)
+            except CrawlCancelled:
+                raise
+            except Exception as e:
+                check_cancelled()
+                logger.warning(f"Ozon, страница {page}: сбой (попытка {attempt}): {e}")
+                pool.discard()
+        return []
+
+    # потоки пула не наследуют контекст: без копии отмена не закроет их браузеры
+    futures = [executor.submit(contextvars.copy_context().run, read, page) for page in pages]
+    return [f.result() for f in futures]
+
+
+def parse_ozon_category(category_url: str, target_count: int,
+                        job_id: int | None = None) -> list[ProductRecord]:
+    """
+    Собирает товары категории постранично (?page=N), по несколько страниц
+    параллельно, затем детали каждого товара. С job_id выдача и каждый
+    товар сохраняются в контрольную точку (см. WB-парсер), бюджет времени
+    задачи ограничивает листание и сбор деталей.
+    """
+    checkpoint = Checkpoint(job_id)
+    budget = checkpoint.budget
+    products = checkpoint.records
+    if not checkpoint.listing_done and len(products) < target_count:
+        # браузеров столько, сколько задаче выдала очередь (см. job_queue)
+        workers = checkpoint.browsers or CRAWL_PAGES["workers"]
+        cap = CRAWL_SHARD["page_cap"]
+        page = checkpoint.pages_done + 1
+        pool = DriverPool()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                done = False
+                while not done and page <= cap and len(products) < target_count and budget.listing_open():
+                    # страниц в пачке — не больше, чем нужно на недостающие товары
+                    per_page = len(products) / checkpoint.pages_done if checkpoint.pages_done else 0
+                    need = math.ceil((target_count - len(products)) / per_page) if per_page else workers
+                    batch = range(page, min(page + min(workers, need), cap + 1))
+                    for page, cards in zip(batch, _read_pages(pool, executor, category_url, batch)):
+                        added = 0
+                        for record in cards:
+                            if len(products) >= target_count:
+                                break
+                            added += checkpoint.add(record)
+                        # пустая страница или одни повторы (за последней Ozon отдаёт
+                        # её же или первую) — выдача кончилась
+                        if not added and len(products) < target_count:
+                            done = True
+                            break
+                        logger.info(f"Ozon, страница {page}: карточек {len(cards)}, новых {added}, "
+                                    f"всего {len(products)}")
+                        checkpoint.listing(products, page)
+                        if len(products) >= target_count:
+                            break
+                    page += 1
+        finally:
+            pool.close()
+        checkpoint.listing(products, checkpoint.pages_done, done=True)
+        # детали собираются одним браузером — остальные возвращаем очереди
+        if job_id and workers > 1:
+            set_browsers(job_id, 1)
     detailed = []
-    for p in products:
-        if p.get('url'):
-            info = asyncio.run(asyncio.to_thread(get_full_product_info,p['url'],'ozon'))
-            p.update(info)
+    for pos, p in enumerate(products):
+        if p.url and pos not in checkpoint.details_done:
+            info = checkpoint.recent_details(p)
+            if info is not None:
+                p.update(info)
+                checkpoint.details(pos, info, fetched=False)
+            elif budget.allow_detail():
+                started = time.monotonic()
+                info = asyncio.run(asyncio.to_thread(get_full_product_info,p.url,'ozon'))
+                budget.record_detail(time.monotonic() - started)
+                p.update(info)
+                checkpoint.details(pos, info)
         detailed.append(p)
     return detailed
@@ -3,6 +3,7 @@ import logging
 import re
 import time
 from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -13,14 +14,19 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 
 from ..services.parsers import parse_characteristics, normalize_characteristics, parse_product_parameters
+from ..services.cancellation import check_cancelled
+from ..services.checkpoints import Checkpoint
+from ..services.records import ProductRecord
+from ..services.sampling import CategorySample, crawl_sample
+from ..services.sharding import estimate_listing_size, plan_price_shards
 from ..services.selenium_utils import (
     capture_screenshot,
     save_page_html,
     analyze_page_structure,
     get_webdriver,
-    scroll_page                
+    load_cards,
 )
-from ..config import get_marketplace_config
+from ..config import CRAWL_SCROLL, get_marketplace_config
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +46,8 @@ def get_full_product_info(product_url: str, marketplace: str) -> dict:
                 continue
             break
         except Exception as e:
+            # браузер закрыт отменой задачи — не ждать повторов
+            check_cancelled()
             logger.error(f"Ошибка при загрузке страницы: {e}")
             time.sleep(5)
     else:
@@ -143,77 +151,133 @@ def get_full_product_info(product_url: str, marketplace: str) -> dict:
     return info
 
 
-def parse_wb_category_by_pagination(category_url: str, target_count: int) -> list:
-    cfg = get_marketplace_config("wb")
-    driver = get_webdriver()
-    products = []
+def _page_url(category_url: str, page: int) -> str:
+    """Ссылка на страницу выдачи с номером page (параметр ?page=)."""
+    parts = urlsplit(category_url)
+    query = dict(parse_qsl(parts.query))
+    query["page"] = str(page)
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
+
+def _card_record(card, cfg: dict) -> ProductRecord:
+    """Товар из карточки выдачи."""
+    try:
+        title = card.find_element(By.CSS_SELECTOR, cfg["title_selector"]).text
+    except:
+        title = "Без названия"
+    try:
+        url = card.find_element(By.CSS_SELECTOR, cfg["link_selector"]).get_attribute("href")
+    except:
+        url = ""
+    # строку цены в число переводит normalize_prices() по всему DataFrame
     try:
-        driver.get(category_url)
-        time.sleep(5)
-        # дождаться lazy‑load первой порции карточек
+        price_txt = card.find_element(By.CSS_SELECTOR, cfg["price_selector"]).text
+    except:
+        price_txt = ""
+    return ProductRecord(title, price_txt, url)
+
+
+def _read_listing_page(driver, url: str) -> list[ProductRecord]:
+    """Все товары одной страницы выдачи (для выборочного парсинга)."""
+    cfg = get_marketplace_config("wb")
+    driver.get(url)
+    load_cards(driver, cfg)
+    cards = driver.find_elements(By.CSS_SELECTOR, cfg["product_card_selector"])
+    return [_card_record(card, cfg) for card in cards]
+
+
+def sample_wb_category(category_url: str, detail_size: int,
+                       job_id: int | None = None) -> CategorySample:
+    """Выборка страниц категории и деталей части товаров (см. services/sampling.py)."""
+    return crawl_sample(category_url, "wb", detail_size, _read_listing_page,
+                        lambda url: get_full_product_info(url, "wb"), job_id)
+
+
+def plan_wb_shards(category_url: str) -> list[str]:
+    """Ценовые шарды категории, каждый в пределах пагинации (см. services/sharding.py)."""
+    return plan_price_shards(category_url, "wb", _read_listing_page)
+
+
+def size_wb_shard(shard_url: str) -> int:
+    """Оценка числа товаров в шарде — по ней делится target задачи."""
+    return estimate_listing_size(shard_url, _read_listing_page)
+
+
+def parse_wb_category_by_pagination(category_url: str, target_count: int,
+                                    job_id: int | None = None) -> list[ProductRecord]:
+    """
+    Собирает товары категории постранично, затем детали каждого товара.
+    С job_id прогресс пишется в контрольную точку после каждой страницы и
+    каждого товара, а повторный запуск продолжает с того же места. Если у
+    задачи есть бюджет времени, выдача и детали обрываются к сроку (см. budget.py).
+    """
+    cfg = get_marketplace_config("wb")
+    checkpoint = Checkpoint(job_id)
+    budget = checkpoint.budget
+    products = checkpoint.records
+
+    if not checkpoint.listing_done and len(products) < target_count:
+        driver = get_webdriver()
+        page = checkpoint.pages_done + 1
         try:
-            asyncio.run(scroll_page(driver))
-        except Exception as e:
-            logger.debug(f"Не удалось дождаться подгрузки на первой странице: {e}")
+            # после перезапуска открываем сразу первую непройденную страницу
+            driver.get(_page_url(category_url, page) if page > 1 else category_url)
 
-        while len(products) < target_count:
-            # скроллим скриптом из конфига
-            try:
-                driver.execute_script(cfg.get("scroll_script", ""))
-            except Exception as e:
-                logger.debug(f"scroll_script таймаут: {e}")
-
-            # собираем все карточки на странице
-            cards = driver.find_elements(By.CSS_SELECTOR, cfg["product_card_selector"])
-            logger.info(f"Обработано страниц, собрано товаров: {len(products)} + новых {len(cards)}")
-            for card in cards:
+            while len(products) < target_count and budget.listing_open():
+                # скроллим, пока на странице не наберётся недостающее число карточек;
+                # если часть оказалась повторами с прошлых страниц — догружаем ещё
+                read, cards = 0, []
+                before = len(products)
+                while True:
+                    _, reached = load_cards(driver, cfg, read + target_count - len(products),
+                                            timeout=budget.listing_left())
+                    cards = driver.find_elements(By.CSS_SELECTOR, cfg["product_card_selector"])
+                    for card in cards[read:]:
+                        if len(products) >= target_count:
+                            break
+                        checkpoint.add(_card_record(card, cfg))
+                        read += 1
+                    if len(products) >= target_count or not reached:
+                        break
+                logger.info(f"Страница {page}: карточек {len(cards)}, новых {len(products) - before}, "
+                            f"всего {len(products)}")
+                checkpoint.listing(products, page)
                 if len(products) >= target_count:
                     break
 
+                # Пагинация: кликаем «Следующая страница»
                 try:
-                    title = card.find_element(By.CSS_SELECTOR, cfg["title_selector"]).text
-                except:
-                    title = "Без названия"
-                try:
-                    url = card.find_element(By.CSS_SELECTOR, cfg["link_selector"]).get_attribute("href")
-                except:
-                    url = ""
-                try:
-                    price_txt = card.find_element(By.CSS_SELECTOR, cfg["price_selector"]).text
-                    price_clean = float(re.sub(r"[^\d.]", "", price_txt) or 0)
-                except:
-                    price_txt, price_clean = "", 0.0
-
-                products.append({
-                    "title": title,
-                    "price": price_txt,
-                    "price_clean": price_clean,
-                    "url": url,
-                })
-
-            # Пагинация: кликаем «Следующая страница»
-            try:
-                nxt = driver.find_element(By.CSS_SELECTOR, cfg.get("pagination_next_selector", "a.j-next-page"))
-                nxt.click()
-                time.sleep(5)
-                # подождать подгрузку новых карточек
-                try:
-                    asyncio.run(scroll_page(driver))
-                except Exception as e:
-                    logger.debug(f"Не удалось дождаться подгрузки после клика «Следующая»: {e}")
-            except Exception:
-                break
-
-    finally:
-        driver.quit()
+                    nxt = driver.find_element(By.CSS_SELECTOR, cfg.get("pagination_next_selector", "a.j-next-page"))
+                    nxt.click()
+                    page += 1
+                except Exception:
+                    break
+                # карточки прошлой страницы должны смениться новыми
+                if cards:
+                    try:
+                        WebDriverWait(driver, CRAWL_SCROLL["timeout"]).until(EC.staleness_of(cards[0]))
+                    except Exception as e:
+                        logger.debug(f"Страница {page} не сменилась после клика «Следующая»: {e}")
 
+        finally:
+            driver.quit()
+        checkpoint.listing(products, checkpoint.pages_done, done=True)
 
     detailed = []
-    for p in products:
-        if p["url"]:
-            info = asyncio.run(asyncio.to_thread(get_full_product_info, p["url"], "wb"))
-            p.update(info)
+    for pos, p in enumerate(products):
+        # по бюджету первыми отбрасываются детали: товар из выдачи остаётся
+        if p.url and pos not in checkpoint.details_done:
+            # недавно собранные для этой категории детали — без открытия страницы
+            info = checkpoint.recent_details(p)
+            if info is not None:
+                p.update(info)
+                checkpoint.details(pos, info, fetched=False)
+            elif budget.allow_detail():
+                started = time.monotonic()
+                info = asyncio.run(asyncio.to_thread(get_full_product_info, p.url, "wb"))
+                budget.record_detail(time.monotonic() - started)
+                p.update(info)
+                checkpoint.details(pos, info)
         detailed.append(p)
 
     return detailed
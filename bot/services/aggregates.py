@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+from ..config import CACHE_DIR, DATASET_CACHE
+from .characteristics import CHAR_COLUMNS, characteristics_long, key_counts, load_characteristics
+from .datasets import file_hash, load_dataset
+from .prices import normalize_prices
+from .sketches import PriceSketch
+
+logger = logging.getLogger(__name__)
+
+# Поля, заполненность которых показывает /summary
+SUMMARY_COLUMNS = ("final_price", "wallet_price", "old_price", "price_history", "rating", "reviews")
+# Числовые поля, по которым в профиле хранятся скетчи
+NUMERIC_COLUMNS = ("final_price", "wallet_price", "old_price", "rating", "reviews", "cost")
+# Всё, что нужно читать из CSV в потоковом режиме (usecols)
+STREAM_COLUMNS = (
+    set(SUMMARY_COLUMNS) | set(NUMERIC_COLUMNS)
+    | set(CHAR_COLUMNS) | {"price", "price_clean", "category", "parsed_at"}
+)
+
+# Версия формата агрегатов в дисковом кэше: меняется вместе с полями класса
+AGG_VERSION = 4
+
+def _numeric(df: pd.DataFrame, col: str) -> pd.Series:
+    return pd.to_numeric(df[col], errors="coerce")
+
+
+@dataclass
+class PartialAggregates:
+    """
+    Профиль датасета из сливаемых частичных агрегатов: каждый чанк CSV даёт
+    свой экземпляр, merge() складывает их. Строится один раз при загрузке
+    (см. services.ingest), объём не зависит от числа строк, и все команды
+    анализа отвечают по нему без повторного прохода по данным.
+    """
+    rows: int = 0
+    # пропуски по каждой колонке (для SUMMARY_COLUMNS — и при её отсутствии)
+    nulls: Counter = field(default_factory=Counter)
+    # скетч price_clean: min/max/mean, гистограмма и квантили без исходных данных
+    price: PriceSketch = field(default_factory=PriceSketch)
+    numeric: dict[str, PriceSketch] = field(default_factory=dict)
+    # скидка (old_price → final_price) и маржа (cost → price_clean), %
+    discount: PriceSketch = field(default_factory=PriceSketch)
+    margin: PriceSketch = field(default_factory=PriceSketch)
+    group_sum: Counter = field(default_factory=Counter)
+    group_count: Counter = field(default_factory=Counter)
+    char_keys: Counter = field(default_factory=Counter)
+    # сумма reviews по дате parsed_at (YYYY-MM-DD)
+    daily_reviews: Counter = field(default_factory=Counter)
+
+    def update(self, df: pd.DataFrame) -> "PartialAggregates":
+        self.rows += len(df)
+        for col in df.columns:
+            self.nulls[col] += int(df[col].isna().sum())
+        for col in SUMMARY_COLUMNS:
+            if col not in df:
+                self.nulls[col] += len(df)
+        for col in NUMERIC_COLUMNS:
+            if col in df:
+                self.numeric.setdefault(col, PriceSketch()).update(_numeric(df, col).to_numpy())
+        if "price_clean" in df:
+            price = pd.to_numeric(df["price_clean"], errors="coerce").dropna()
+            self.price.update(price.to_numpy())
+            if "category" in df:
+                grouped = price.groupby(df.loc[price.index, "category"].astype(str))
+                self.group_sum.update(grouped.sum().to_dict())
+                self.group_count.update(grouped.size().to_dict())
+            if "cost" in df:
+                price_all = _numeric(df, "price_clean")
+                self.margin.update(((price_all - _numeric(df, "cost")) / price_all * 100).to_numpy())
+        if "old_price" in df and "final_price" in df:
+            old = _numeric(df, "old_price")
+            self.discount.update(((old - _numeric(df, "final_price")) / old * 100).to_numpy())
+        if any(col in df for col in CHAR_COLUMNS):
+            # частоты характеристик — group-by по длинной таблице
+            self.char_keys.update(key_counts(characteristics_long(df)))
+        if "reviews" in df and "parsed_at" in df:
+            date = pd.to_datetime(df["parsed_at"], errors="coerce").dt.strftime("%Y-%m-%d")
+            self.daily_reviews.update(_numeric(df, "reviews").groupby(date).sum().to_dict())
+        return self
+
+    def merge(self, other: "PartialAggregates") -> "PartialAggregates":
+        self.rows += other.rows
+        for name in ("price", "discount", "margin"):
+            getattr(self, name).merge(getattr(other, name))
+        for col, sketch in other.numeric.items():
+            self.numeric.setdefault(col, PriceSketch()).merge(sketch)
+        for name in ("nulls", "group_sum", "group_count", "char_keys", "daily_reviews"):
+            getattr(self, name).update(getattr(other, name))
+        return self
+
+    # --- ответы команд ---
+
+    def null_pct(self, col: str) -> float:
+        return self.nulls[col] / self.rows * 100 if self.rows else 0.0
+
+    def group_means(self) -> pd.Series:
+        sums = pd.Series(self.group_sum, dtype=float)
+        return sums / pd.Series(self.group_count, dtype=float)[sums.index]
+
+
+def is_streaming(path: Path) -> bool:
+    """Большие CSV не загружаются целиком, а агрегируются чанками."""
+    path = Path(path)
+    return path.suffix.lower() == ".csv" and path.stat().st_size >= DATASET_CACHE["streaming_min_bytes"]
+
+
+def stream_csv_aggregates(path: Path, chunksize: int | None = None) -> PartialAggregates:
+    """
+    Один проход по CSV чанками: читаются только нужные колонки, все как
+    строки (числа приводятся в чанке), пиковая память — один чанк.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in STREAM_COLUMNS]
+    total = PartialAggregates()
+    reader = pd.read_csv(
+        path,
+        usecols=usecols,
+        dtype={c: "string" for c in usecols},
+        chunksize=chunksize or DATASET_CACHE["chunksize"],
+    )
+    for i, chunk in enumerate(reader):
+        part = PartialAggregates()
+        # заполненность считаем по сырым колонкам, price_history дальше не нужен
+        part.update(normalize_prices(chunk.drop(columns=["price_history"], errors="ignore")))
+        if "price_history" in chunk:
+            part.nulls["price_history"] = int(chunk["price_history"].isna().sum())
+        total.merge(part)
+        logger.debug(f"{path.name}: обработан чанк {i}, строк {total.rows}")
+    return total
+
+
+_aggregates: dict[str, PartialAggregates] = {}
+_lock = threading.Lock()
+
+
+def load_aggregates(path: Path) -> PartialAggregates:
+    """
+    Агрегаты датасета по хэшу содержимого: из памяти, из кэша на диске,
+    потоковым проходом (большой CSV) или по загруженному DataFrame.
+    """
+    path = Path(path)
+    key = file_hash(path)
+    with _lock:
+        if key in _aggregates:
+            return _aggregates[key]
+    cached = Path(CACHE_DIR) / f"{key}.agg{AGG_VERSION}.pkl"
+    if cached.exists():
+        agg = pd.read_pickle(cached)
+    else:
+        if is_streaming(path):
+            agg = stream_csv_aggregates(path)
+        else:
+            df = load_dataset(path)
+            agg = PartialAggregates().update(df)
+            # выгрузки парсеров хранят характеристики отдельной длинной таблицей
+            chars = load_characteristics(path)
+            if chars is not None and not any(col in df for col in CHAR_COLUMNS):
+                agg.char_keys.update(key_counts(chars))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        pd.to_pickle(agg, cached)
+    with _lock:
+        _aggregates[key] = agg
+    return agg
@@ -0,0 +1,114 @@
+"""
+Парсинг с бюджетом времени: собрать сколько успеем к сроку.
+
+Выдача листается, пока не набрано нужное число товаров или не истекла
+доля бюджета listing_share; детали собираются, пока до срока (минус запас
+на выгрузку) успевает пройти ещё одна карточка. Детали отбрасываются
+первыми: товары из выдачи попадают в выгрузку в любом случае.
+"""
+import logging
+import re
+import time
+
+from ..config import CRAWL_BUDGET, CRAWL_QUEUE, CRAWL_SAMPLE, EXPORT
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_WORDS = ("sample", "выборка")
+
+_DURATION_RE = re.compile(r"^(\d+)(s|с|сек|m|м|мин)$")
+
+
+def parse_duration(token: str) -> int | None:
+    """'90s', '90с', '2m', '2мин' -> секунды; не длительность — None."""
+    m = _DURATION_RE.match(token)
+    if not m:
+        return None
+    return int(m.group(1)) * (1 if m.group(2) in ("s", "с", "сек") else 60)
+
+
+def parse_crawl_request(text: str) -> tuple[int, str, int | None, str]:
+    """
+    '1300', '1300 csv', '2m', '1300 2m csv', 'sample', '60 выборка' ->
+    (число товаров, формат, бюджет сек, режим 'full' | 'sample').
+    Без числа (только время) собирается до max_items; в режиме выборки
+    число — сколько товаров выборки дополнить деталями; срок к выборке не
+    применяется, поэтому вместе с ней не принимается. ValueError при ошибке.
+    """
+    count, fmt, budget, mode = None, EXPORT["default_format"], None, "full"
+    for token in (text or "").lower().split():
+        if token.isdigit() and count is None:
+            count = int(token)
+        elif token in EXPORT["formats"]:
+            fmt = token
+        elif token in SAMPLE_WORDS:
+            mode = "sample"
+        elif parse_duration(token) and budget is None:
+            budget = parse_duration(token)
+        else:
+            raise ValueError(token)
+    if mode == "sample" and budget is not None:
+        raise ValueError(text)
+    if count is None and mode == "sample":
+        count = CRAWL_SAMPLE["details"]
+    elif count is None and budget is not None:
+        count = CRAWL_BUDGET["max_items"]
+    if not count:
+        raise ValueError(text)
+    return count, fmt, budget, mode
+
+
+class CrawlBudget:
+    """Срок задачи для парсера; без бюджета все проверки разрешают работу."""
+
+    def __init__(self, seconds: float | None = None, started_at: float | None = None):
+        self.seconds = seconds
+        self.started_at = started_at or time.time()
+        self.detail_seconds = CRAWL_QUEUE["default_item_seconds"]
+        self._details = 0
+        self._shed_logged = False
+
+    @property
+    def active(self) -> bool:
+        return bool(self.seconds)
+
+    def remaining(self) -> float:
+        return self.seconds - (time.time() - self.started_at)
+
+    def listing_open(self) -> bool:
+        if not self.active:
+            return True
+        elapsed = time.time() - self.started_at
+        return (elapsed < self.seconds * CRAWL_BUDGET["listing_share"]
+                and self.remaining() > CRAWL_BUDGET["reserve"])
+
+    def listing_left(self) -> float | None:
+        """Сколько ещё можно листать выдачу, сек; None — без бюджета."""
+        if not self.active:
+            return None
+        left = min(self.seconds * CRAWL_BUDGET["listing_share"] - (time.time() - self.started_at),
+                   self.remaining() - CRAWL_BUDGET["reserve"])
+        return max(left, 0)
+
+    def allow_detail(self) -> bool:
+        if not self.active:
+            return True
+        if self.remaining() - CRAWL_BUDGET["reserve"] >= self.detail_seconds:
+            return True
+        if not self._shed_logged:
+            logger.info(f"Бюджет {self.seconds} с: детали дальше не собираются")
+            self._shed_logged = True
+        return False
+
+    def record_detail(self, seconds: float):
+        """Среднее время карточки: по нему решается, успеет ли следующая."""
+        self._details += 1
+        self.detail_seconds += (seconds - self.detail_seconds) / self._details
+
+
+def coverage_text(budget: int, target: int, listed: int, detailed: int, elapsed: float) -> str:
+    share = detailed / listed if listed else 0
+    return (
+        f"⏱ Бюджет {budget} с, ушло {elapsed:.0f} с: в выдаче {listed} из {target}, "
+        f"с деталями {detailed} ({share:.0%})"
+    )
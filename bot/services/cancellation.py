@@ -0,0 +1,94 @@
+"""
+Отмена задач парсинга.
+
+Флаг отмены лежит в crawl_jobs (его ставит процесс бота, а задача может
+идти в отдельном воркере); воркер замечает флаг и отменяет CancelToken
+задачи. Токен виден парсеру через contextvar (asyncio.to_thread копирует
+контекст), поэтому get_webdriver регистрирует в нём каждый браузер:
+при отмене браузеры закрываются сразу, а висящий вызов Selenium в потоке
+парсера падает, не дожидаясь таймаута страницы.
+"""
+import contextvars
+import logging
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlCancelled(Exception):
+    """Задачу отменил пользователь."""
+
+
+class CancelToken:
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        # partial — прислать собранное до отмены
+        self.partial = False
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._drivers = weakref.WeakSet()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, partial: bool = False):
+        if self.cancelled:
+            return
+        self.partial = partial
+        self._event.set()
+        with self._lock:
+            drivers = list(self._drivers)
+        for driver in drivers:
+            _quit(driver)
+        logger.info(f"Задача {self.job_id} отменена, закрыто браузеров: {len(drivers)}")
+
+    def check(self):
+        if self.cancelled:
+            raise CrawlCancelled(self.job_id)
+
+    def add_driver(self, driver):
+        with self._lock:
+            self._drivers.add(driver)
+        # отмена пришла, пока браузер запускался
+        if self.cancelled:
+            _quit(driver)
+            raise CrawlCancelled(self.job_id)
+
+
+def _quit(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.debug(f"Браузер уже закрыт: {e}")
+
+
+_current: contextvars.ContextVar[CancelToken | None] = contextvars.ContextVar("crawl_cancel", default=None)
+
+
+def current_token() -> CancelToken | None:
+    return _current.get()
+
+
+def bind_token(token: CancelToken | None) -> contextvars.Token:
+    return _current.set(token)
+
+
+def unbind_token(reset: contextvars.Token):
+    _current.reset(reset)
+
+
+def check_cancelled():
+    """Для парсеров: выйти, если текущую задачу отменили (вне задачи — ничего)."""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def register_driver(driver):
+    """Вызывается при создании браузера: отмена задачи закроет и его."""
+    token = _current.get()
+    if token is not None:
+        token.add_driver(driver)
+    return driver
@@ -0,0 +1,130 @@
+"""
+Характеристики товаров в длинном формате: одна строка на (sku, group, key, value).
+
+Вместо сотен почти пустых колонок (по одной на каждую встреченную
+характеристику) датасет хранит компактную таблицу с категориальными
+(интернированными) group/key. В широкий вид она разворачивается один раз —
+при выгрузке в Excel.
+"""
+import os
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+
+from ..config import CACHE_DIR
+from .datasets import file_hash
+from .parsers import extract_sku
+
+# Колонки со словарями характеристик, которые парсеры кладут в товар:
+# characteristics_parsed — {ключ: значение}, parameters — {"группа.ключ": значение}
+CHAR_COLUMNS = ("characteristics_parsed", "parameters")
+LONG_COLUMNS = ["sku", "group", "key", "value"]
+
+# Ключи словаря в его строковом представлении: {'Цвет': ..., "Тип 'A'": ...}
+_DICT_KEY_RE = r"""[{,]\s*(?:'([^']*)'|"([^"]*)")\s*:"""
+
+
+def _value(v) -> str:
+    return "; ".join(map(str, v)) if isinstance(v, list) else str(v)
+
+
+def _row_skus(df: pd.DataFrame) -> pd.Series:
+    """Артикул строки: колонка sku, артикул из url или (для файлов без них) номер строки."""
+    if "sku" in df:
+        return df["sku"].astype(str)
+    if "url" in df:
+        return df["url"].map(extract_sku).where(lambda s: s != "", df.index.astype(str))
+    return pd.Series(df.index.astype(str), index=df.index)
+
+
+def characteristics_long(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Длинная таблица характеристик из колонок CHAR_COLUMNS. Словари из парсеров
+    дают ключи и значения; их строковое представление из загруженного файла
+    разбирается регуляркой целиком по колонке и даёт только ключи.
+    """
+    skus = _row_skus(df)
+    sku_col, group_col, key_col, value_col = [], [], [], []
+    for col in CHAR_COLUMNS:
+        if col not in df:
+            continue
+        s = df[col].dropna()
+        is_dict = s.map(type).eq(dict)
+        for idx, props in s[is_dict].items():
+            sku = skus[idx]
+            for k, v in props.items():
+                group, key = k.split(".", 1) if col == "parameters" and "." in k else ("", k)
+                sku_col.append(sku)
+                group_col.append(group)
+                key_col.append(key)
+                value_col.append(_value(v))
+        text = s[~is_dict].astype("string")
+        if not text.empty:
+            keys = text.str.extractall(_DICT_KEY_RE)
+            keys = keys[0].fillna(keys[1])
+            rows = keys.index.get_level_values(0)
+            sku_col.extend(skus[rows])
+            group_col.extend([""] * len(keys))
+            key_col.extend(keys)
+            value_col.extend([None] * len(keys))
+    return pd.DataFrame({
+        "sku": pd.Categorical(sku_col),
+        "group": pd.Categorical(group_col),
+        "key": pd.Categorical(key_col),
+        "value": pd.array(value_col, dtype="string"),
+    }, columns=LONG_COLUMNS)
+
+
+def key_counts(long: pd.DataFrame) -> Counter:
+    """Сколько раз встречается каждая характеристика (для /chars)."""
+    if long.empty:
+        return Counter()
+    counts = long.groupby("key", observed=True).size()
+    return Counter(counts[counts > 0].to_dict())
+
+
+def pivot_wide(long: pd.DataFrame) -> pd.DataFrame:
+    """
+    Широкий вид: строка на sku, колонка на "группа.ключ". Один unstack по
+    всей таблице вместо Series на каждый товар.
+    """
+    if long.empty:
+        return pd.DataFrame(index=pd.Index([], name="sku"))
+    column = long["key"].astype(str)
+    has_group = long["group"].astype(str) != ""
+    column = column.where(~has_group, long["group"].astype(str) + "." + column)
+    wide = (
+        pd.DataFrame({"sku": long["sku"].astype(str), "column": column, "value": long["value"]})
+        .drop_duplicates(["sku", "column"])
+        .set_index(["sku", "column"])["value"]
+        .unstack("column")
+    )
+    wide.columns.name = None
+    return wide
+
+
+def export_frame(df: pd.DataFrame, long: pd.DataFrame) -> pd.DataFrame:
+    """Датасет для выгрузки: основные поля плюс развёрнутые характеристики."""
+    base = df.drop(columns=[c for c in CHAR_COLUMNS if c in df])
+    wide = pivot_wide(long)
+    if wide.empty:
+        return base
+    wide = wide.drop(columns=[c for c in wide.columns if c in base.columns])
+    base = base.assign(_sku=_row_skus(df))
+    return base.join(wide, on="_sku").drop(columns="_sku")
+
+
+def _chars_path(path: Path) -> Path:
+    return Path(CACHE_DIR) / f"{file_hash(Path(path))}.chars.pkl"
+
+
+def save_characteristics(path: Path, long: pd.DataFrame):
+    """Сохраняет длинную таблицу рядом с кэшем датасета (ключ — хэш файла выгрузки)."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    long.to_pickle(_chars_path(path))
+
+
+def load_characteristics(path: Path) -> pd.DataFrame | None:
+    cached = _chars_path(path)
+    return pd.read_pickle(cached) if cached.exists() else None
@@ -0,0 +1,108 @@
+"""
+Отрисовка графиков в отдельных процессах.
+
+Хэндлеры собирают спецификацию графика (тип, подписи и минимальные массивы)
+и ждут PNG-байты, не блокируя event loop. В воркерах — бэкенд Agg и
+объектный API Figure без глобального состояния pyplot.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ..config import ANALYSIS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+CHART_CFG = ANALYSIS_CONFIG["charts"]
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def _init_worker():
+    # импортируем matplotlib заранее, чтобы первый график не платил за загрузку
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.figure  # noqa: F401
+
+
+def _draw_bars(ax, spec: dict):
+    edges = np.asarray(spec["edges"])
+    ax.bar(edges[:-1], spec["counts"], width=np.diff(edges), align="edge",
+           alpha=spec.get("alpha", 1.0))
+
+
+def _draw_line(ax, spec: dict):
+    ax.plot(spec["x"], spec["y"], marker="o")
+    ax.tick_params(axis="x", labelrotation=30)
+
+
+def _draw_scatter(ax, spec: dict):
+    ax.scatter(spec["x"], spec["y"], alpha=spec.get("alpha", 0.5))
+
+
+_DRAWERS = {
+    "bars": _draw_bars,
+    "line": _draw_line,
+    "scatter": _draw_scatter,
+}
+
+
+def render_png(spec: dict) -> bytes:
+    """
+    Рисует спецификацию в PNG. spec: {"panels": [{"kind", "title", "xlabel",
+    "ylabel", "text", ...данные}], "figsize", "dpi"}; одиночная панель может
+    быть передана прямо в spec.
+    """
+    from matplotlib.figure import Figure
+
+    panels = spec.get("panels") or [spec]
+    fig = Figure(figsize=spec.get("figsize", (6.4, 4.8)))
+    axes = fig.subplots(len(panels), 1, squeeze=False)[:, 0]
+    for ax, panel in zip(axes, panels):
+        _DRAWERS[panel["kind"]](ax, panel)
+        ax.set(title=panel.get("title", ""), xlabel=panel.get("xlabel", ""),
+               ylabel=panel.get("ylabel", ""))
+        ax.grid(alpha=0.3)
+        if panel.get("text"):
+            ax.text(0.95, 0.95, panel["text"], transform=ax.transAxes, va="top", ha="right",
+                    bbox=dict(boxstyle="round", facecolor="white", alpha=0.8))
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=spec.get("dpi", 100), bbox_inches="tight")
+    return buf.getvalue()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: не форкаем процесс с работающим event loop и потоками
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_CFG["render_workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _executor
+
+
+async def render_chart(spec: dict) -> bytes:
+    """Отдаёт спецификацию в пул процессов и ждёт PNG-байты."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), render_png, spec)
+
+
+def warm_up_renderer():
+    """Поднимает процессы пула заранее, чтобы первый график не ждал их старта."""
+    executor = get_executor()
+    for _ in range(CHART_CFG["render_workers"]):
+        executor.submit(_init_worker)
+
+
+def shutdown_renderer():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
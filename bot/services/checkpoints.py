@@ -0,0 +1,193 @@
+import json
+import logging
+import time
+from urllib.parse import urlsplit
+
+from ..config import CRAWL_SEEN
+from .budget import CrawlBudget
+from .cancellation import check_cancelled
+from .job_queue import get_job, set_progress
+from .records import ProductRecord, record_key
+from .storage import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Состояние парсинга категории: пройденные страницы выдачи (в crawl_jobs,
+# см. job_queue) и товары — сначала из выдачи, затем с деталями со страницы
+# товара. Пишется по ходу работы, чтобы после перезапуска продолжить с того же места.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_items (
+    job_id  INTEGER NOT NULL,
+    pos     INTEGER NOT NULL,
+    title   TEXT,
+    price   TEXT,
+    url     TEXT,
+    details TEXT,
+    PRIMARY KEY (job_id, pos)
+);
+-- детали товаров по категории (ссылка без параметров, общая для шардов):
+-- переживают задачу, повторный парсинг категории берёт свежие отсюда
+CREATE TABLE IF NOT EXISTS crawl_seen (
+    category   TEXT NOT NULL,
+    sku        TEXT NOT NULL,
+    details    TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (category, sku)
+);
+"""
+
+# Плоские копии, которые ProductRecord всё равно не хранит
+_SKIP_DETAILS = ("characteristics", "extracted_characteristics", "extracted_parameters")
+
+
+def _db():
+    return ensure_schema("checkpoints", _SCHEMA)
+
+
+def clear_items(job_id: int):
+    """Результат выгружен — промежуточные товары задачи больше не нужны."""
+    conn = _db()
+    with conn:
+        conn.execute("DELETE FROM crawl_items WHERE job_id = ?", (job_id,))
+
+
+def save_listing(job_id: int, records: list[ProductRecord], pages_done: int,
+                 listing_done: bool = False):
+    """Дописывает новые товары выдачи (позиции после уже сохранённых) и номер страницы."""
+    conn = _db()
+    with conn:
+        start = conn.execute(
+            "SELECT COUNT(*) FROM crawl_items WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT OR IGNORE INTO crawl_items (job_id, pos, title, price, url) VALUES (?, ?, ?, ?, ?)",
+            [(job_id, pos, r.title, r.price, r.url) for pos, r in enumerate(records[start:], start)],
+        )
+        conn.execute(
+            "UPDATE crawl_jobs SET pages_done = ?, listing_done = ?, updated_at = ? WHERE job_id = ?",
+            (pages_done, int(listing_done), time.time(), job_id),
+        )
+
+
+def _details_json(info: dict) -> str:
+    details = {k: v for k, v in info.items() if k not in _SKIP_DETAILS}
+    return json.dumps(details, ensure_ascii=False, default=str)
+
+
+def save_details(job_id: int, pos: int, info: dict):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "UPDATE crawl_items SET details = ? WHERE job_id = ? AND pos = ?",
+            (_details_json(info), job_id, pos),
+        )
+
+
+def category_key(url: str) -> str:
+    """Категория без параметров выдачи: шарды и сортировки одной категории совпадают."""
+    return urlsplit(url)._replace(query="", fragment="").geturl()
+
+
+def remember_details(category: str, sku: str, info: dict):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO crawl_seen (category, sku, details, fetched_at) VALUES (?, ?, ?, ?)",
+            (category, sku, _details_json(info), time.time()),
+        )
+
+
+def recent_details(category: str, sku: str) -> dict | None:
+    """Детали товара категории не старше details_max_age; иначе None."""
+    row = _db().execute(
+        "SELECT details FROM crawl_seen WHERE category = ? AND sku = ? AND fetched_at >= ?",
+        (category, sku, time.time() - CRAWL_SEEN["details_max_age"]),
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def prune_seen():
+    conn = _db()
+    with conn:
+        conn.execute("DELETE FROM crawl_seen WHERE fetched_at < ?",
+                     (time.time() - CRAWL_SEEN["details_max_age"],))
+
+
+def load_items(job_id: int) -> tuple[list[ProductRecord], set[int]]:
+    """Сохранённые товары задачи и позиции, для которых детали уже собраны."""
+    rows = _db().execute(
+        "SELECT pos, title, price, url, details FROM crawl_items WHERE job_id = ? ORDER BY pos",
+        (job_id,),
+    ).fetchall()
+    records, done = [], set()
+    for pos, title, price, url, details in rows:
+        record = ProductRecord(title or "", price or "", url or "")
+        if details is not None:
+            record.update(json.loads(details))
+            done.add(pos)
+        records.append(record)
+    return records, done
+
+
+class Checkpoint:
+    """
+    Точка сохранения одной задачи для парсера. Без job_id ничего не пишет —
+    так парсеры работают и вне задач (например, из старого кода).
+    """
+
+    def __init__(self, job_id: int | None = None):
+        self.job_id = job_id
+        job = get_job(job_id) if job_id else None
+        self.target = job["target"] if job else 0
+        self.budget = CrawlBudget(job["budget"], job["started_at"]) if job else CrawlBudget()
+        # браузеров, выданных задаче очередью (вне задачи — None, решает парсер)
+        self.browsers = job["browsers"] if job else None
+        self.pages_done = job["pages_done"] if job else 0
+        self.listing_done = bool(job["listing_done"]) if job else False
+        self.records, self.details_done = load_items(job_id) if job else ([], set())
+        # уже собранные товары: карточки, оставшиеся в DOM после скролла или
+        # повторённые на следующей странице, не попадают в выдачу второй раз
+        self.seen = {record_key(r) for r in self.records} - {""}
+        # детали, собранные прошлыми задачами той же категории (см. recent_details)
+        self.category = category_key(job["url"]) if job and CRAWL_SEEN["details_max_age"] else None
+        if self.category:
+            prune_seen()
+        if self.records:
+            logger.info(
+                f"Задача {job_id}: продолжаю с {len(self.records)} товаров, "
+                f"страниц {self.pages_done}, с деталями {len(self.details_done)}"
+            )
+
+    def add(self, record: ProductRecord) -> bool:
+        """Добавляет товар выдачи, если его ещё не было; False — повтор."""
+        key = record_key(record)
+        if key:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+        self.records.append(record)
+        return True
+
+    def listing(self, records: list[ProductRecord], pages_done: int, done: bool = False):
+        # после отмены страница могла дочитаться закрытым браузером — не сохраняем
+        check_cancelled()
+        self.pages_done, self.listing_done = pages_done, done
+        if self.job_id:
+            save_listing(self.job_id, records, pages_done, done)
+            set_progress(self.job_id, "listing", len(records), self.target)
+
+    def recent_details(self, record: ProductRecord) -> dict | None:
+        """Свежие детали товара из прошлых парсингов категории; None — собирать заново."""
+        if not self.category or not record.sku:
+            return None
+        return recent_details(self.category, record.sku)
+
+    def details(self, pos: int, info: dict, fetched: bool = True):
+        """fetched=False — детали взяты из recent_details, срок их свежести не продлевается."""
+        check_cancelled()
+        self.details_done.add(pos)
+        if self.job_id:
+            save_details(self.job_id, pos, info)
+            if fetched and self.category and self.records[pos].sku:
+                remember_details(self.category, self.records[pos].sku, info)
+            set_progress(self.job_id, "details", len(self.details_done), len(self.records))
@@ -0,0 +1,487 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from datetime import datetime
+
+from aiogram import Bot, types
+
+from ..config import CRAWL_QUEUE, CRAWL_SHARD, CSV_DIR
+from ..marketplace import ozon, wildberries
+from .budget import coverage_text
+from .cancellation import CancelToken, bind_token, current_token, unbind_token
+from .checkpoints import clear_items, load_items
+from .exporter import export_records
+from .file_ids import send_file_to
+from .ingest import ingest_dataset
+from .job_queue import (
+    CANCEL_PARTIAL, PRIORITY_INTERACTIVE, claim_job, create_shards, enqueue, estimate_wait, finish_job,
+    finish_shard, get_job, heartbeat, request_cancel, set_estimate, set_progress_message, shards,
+    start_shards,
+)
+from .price_alerts import check_price_alerts
+from .price_analysis import create_price_analysis
+from .prices import normalize_prices
+from .records import ProductRecord, records_characteristics, records_to_frame
+from .sampling import CategorySample
+from .sharding import merge_shards, shard_targets
+
+logger = logging.getLogger(__name__)
+
+PARSERS = {
+    "wb": wildberries.parse_wb_category_by_pagination,
+    "ozon": ozon.parse_ozon_category,
+}
+
+SAMPLERS = {
+    "wb": wildberries.sample_wb_category,
+    "ozon": ozon.sample_ozon_category,
+}
+
+# большие категории — параллельно, ценовыми шардами
+SHARD_PLANNERS = {
+    "wb": wildberries.plan_wb_shards,
+    "ozon": ozon.plan_ozon_shards,
+}
+SHARD_SIZERS = {
+    "wb": wildberries.size_wb_shard,
+    "ozon": ozon.size_ozon_shard,
+}
+
+PRODUCT_PARSERS = {
+    "wb": wildberries.get_full_product_info,
+    "ozon": ozon.get_full_product_info,
+}
+
+
+async def deliver_results(bot: Bot, chat_id: int, marketplace: str, url: str,
+                          products: list[ProductRecord], fmt: str, partial: bool = False,
+                          note: str | None = None, sample: CategorySample | None = None):
+    """
+    Выгрузка, приём датасета, проверка алертов и отправка файлов пользователю.
+    partial — собранное до отмены задачи; note — строка в подпись (покрытие и т.п.);
+    sample — выборка, по которой анализ цен строит оценки с интервалами.
+    """
+    name = url.rstrip("/").split("/")[-1]
+    ts   = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # отдельный процесс воркера не импортирует хэндлеры, создающие каталог
+    os.makedirs(CSV_DIR, exist_ok=True)
+    base = os.path.join(CSV_DIR, f"{marketplace}_{name}_{ts}")
+    df   = normalize_prices(records_to_frame(products))
+    # строки пишутся потоково; большие выгрузки режутся на части до 45 МБ
+    parts = await asyncio.to_thread(export_records, df, products, base, fmt)
+    chars = await asyncio.to_thread(records_characteristics, products)
+    since = int(time.time())
+    # кэш, профиль для команд анализа, активный датасет и история цен — за один приём;
+    # датасет числится по первой части, перечитывание с диска склеит все (export_parts)
+    profile = await asyncio.to_thread(ingest_dataset, chat_id, parts[0], df, None, marketplace, chars)
+    try:
+        await check_price_alerts(bot, since)
+    except Exception as e:
+        logger.warning(f"Проверка ценовых алертов не удалась: {e}")
+    for n, part in enumerate(parts, 1):
+        caption = f"📊 Собрано {len(products)} товаров"
+        if partial:
+            caption += " до отмены"
+        if len(parts) > 1:
+            caption += f" (часть {n}/{len(parts)})"
+        if note:
+            caption += f"\n{note}"
+        await send_file_to(bot, chat_id, "document", path=part, caption=caption)
+    # файлы уже у пользователя: анализ цен — дополнение, его ошибка доставку не отменяет
+    try:
+        if sample is not None:
+            estimate = await asyncio.to_thread(sample.estimate, df["price_clean"].to_numpy())
+            # без единой разобранной цены оценивать и рисовать нечего
+            if not estimate.empty:
+                await create_price_analysis(bot, chat_id, df, name, estimate=estimate)
+        elif marketplace == "ozon":
+            await create_price_analysis(bot, chat_id, df, name, profile.price)
+    except Exception as e:
+        logger.warning(f"Анализ цен для {name} не построен: {e}")
+
+
+_RESULT_TEXT = {
+    "done": "✅ Задача #{} выполнена.",
+    "cancelled": "🛑 Задача #{} отменена.",
+    "failed": "❌ Задача #{}: не удалось отправить результат.",
+}
+
+
+async def _deliver(bot: Bot, job: dict, products: list[ProductRecord], **kwargs) -> str | None:
+    """
+    deliver_results для задачи из очереди. Доставку не повторяют (приём
+    датасета и алерты не идемпотентны, часть файлов могла уже уйти), поэтому
+    ошибка не оставляет задачу на повтор, а возвращает её итоговый статус:
+    'cancelled' при отмене, иначе 'failed'. None — доставлено.
+    """
+    try:
+        await deliver_results(bot, job["chat_id"], job["marketplace"], job["url"], products, job["fmt"],
+                              **kwargs)
+        return None
+    except Exception as e:
+        token = current_token()
+        status = "cancelled" if token is not None and token.cancelled else "failed"
+        logger.error(f"Задача {job['job_id']}: результат не доставлен ({status}): {e}")
+        return status
+
+
+_STAGES = {"listing": "выдача", "details": "детали"}
+
+
+def _progress_text(job: dict) -> str:
+    stage = _STAGES.get(job.get("stage"), "запуск")
+    text = f"⏳ Задача #{job['job_id']}: {stage}"
+    if job.get("total"):
+        text += f" {job['done']}/{job['total']}"
+    if job.get("budget") and job.get("started_at"):
+        left = job["budget"] - (time.time() - job["started_at"])
+        text += f", до срока {max(0, left):.0f} с"
+    return text
+
+
+def cancel_keyboard(job_id: int) -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(inline_keyboard=[[
+        types.InlineKeyboardButton(text="🛑 Отменить", callback_data=f"cancel_job:{job_id}:0"),
+        types.InlineKeyboardButton(text="📦 Отменить и прислать собранное",
+                                   callback_data=f"cancel_job:{job_id}:1"),
+    ]])
+
+
+async def _edit_progress(bot: Bot, job: dict, text: str, keyboard: bool = False):
+    """Обновляет сообщение задачи; без keyboard кнопки отмены убираются."""
+    if not job["progress_message_id"]:
+        return
+    try:
+        await bot.edit_message_text(
+            text, chat_id=job["chat_id"], message_id=job["progress_message_id"],
+            reply_markup=cancel_keyboard(job["job_id"]) if keyboard else None,
+        )
+    except Exception as e:
+        logger.debug(f"Сообщение задачи {job['job_id']} не обновлено: {e}")
+
+
+async def _watch_job(bot: Bot, job_id: int, token: CancelToken, edit: bool = True):
+    """
+    Пока задача идёт: раз в poll_interval проверяет флаг отмены (отмена
+    закрывает браузеры задачи), шлёт пульс и обновляет сообщение с прогрессом.
+    """
+    last_text, last_beat, last_edit = None, time.monotonic(), 0.0
+    while True:
+        await asyncio.sleep(CRAWL_QUEUE["poll_interval"])
+        job = await asyncio.to_thread(get_job, job_id)
+        if job["cancel"] and not token.cancelled:
+            await asyncio.to_thread(token.cancel, job["cancel"] == CANCEL_PARTIAL)
+            await _edit_progress(bot, job, f"🛑 Задача #{job_id}: останавливаю...")
+            edit = False
+        now = time.monotonic()
+        if now - last_beat >= CRAWL_QUEUE["heartbeat_interval"]:
+            await asyncio.to_thread(heartbeat, job_id)
+            last_beat = now
+        if not edit or now - last_edit < CRAWL_QUEUE["progress_interval"]:
+            continue
+        text = _progress_text(job)
+        if text != last_text:
+            await _edit_progress(bot, job, text, keyboard=True)
+            last_text = text
+        last_edit = now
+
+
+async def _finish_cancelled(bot: Bot, job: dict, partial: bool):
+    """Закрывает отменённую задачу; partial — выгрузить то, что успели собрать."""
+    job_id, chat_id = job["job_id"], job["chat_id"]
+    text = f"🛑 Задача #{job_id} отменена."
+    if partial:
+        products, _ = await asyncio.to_thread(load_items, job_id)
+        if products:
+            # собранное выгружается уже без токена отменённой задачи
+            reset = bind_token(None)
+            try:
+                if await _deliver(bot, job, products, partial=True):
+                    text += " Собранное отправить не удалось."
+            finally:
+                unbind_token(reset)
+        else:
+            text += " Товаров собрать не успели."
+    await asyncio.to_thread(finish_job, job_id, "cancelled")
+    await asyncio.to_thread(clear_items, job_id)
+    await _edit_progress(bot, job, text)
+
+
+def _coverage(job_id: int) -> str:
+    """Покрытие задачи с бюджетом по её контрольной точке."""
+    job = get_job(job_id)
+    products, detailed = load_items(job_id)
+    return coverage_text(int(job["budget"]), job["target"], len(products), len(detailed),
+                         time.time() - job["started_at"])
+
+
+@contextlib.asynccontextmanager
+async def _running(bot: Bot, job: dict, edit: bool = True):
+    """
+    Токен отмены задачи в контексте (to_thread копирует его в поток парсера
+    и выгрузки) и наблюдатель: пульс, флаг отмены, сообщение с прогрессом.
+    """
+    token = CancelToken(job["job_id"])
+    if job["cancel"]:
+        # отменили, пока задача была брошена: парсер сразу выйдет
+        token.cancel(job["cancel"] == CANCEL_PARTIAL)
+    reset = bind_token(token)
+    watcher = asyncio.create_task(_watch_job(bot, job["job_id"], token, edit))
+    try:
+        yield token
+    finally:
+        watcher.cancel()
+        unbind_token(reset)
+
+
+async def run_crawl_job(bot: Bot, job: dict):
+    """Парсинг по взятой из очереди задаче (с контрольными точками) и доставка результата."""
+    job_id, chat_id, marketplace = job["job_id"], job["chat_id"], job["marketplace"]
+    if job["attempts"] > 1 and not job["cancel"]:
+        await bot.send_message(chat_id, f"♻️ Продолжаю прерванную задачу #{job_id}...")
+    status = "done"
+    async with _running(bot, job) as token:
+        try:
+            sample, note = None, None
+            if job["mode"] == "sample":
+                sample = await asyncio.to_thread(SAMPLERS[marketplace], job["url"], job["target"], job_id)
+                products = sample.records
+                note = f"🎯 Выборка страниц, с деталями {sample.detailed}"
+            else:
+                products = await asyncio.to_thread(PARSERS[marketplace], job["url"], job["target"], job_id)
+                if job["budget"]:
+                    note = await asyncio.to_thread(_coverage, job_id)
+        except Exception as e:
+            if not token.cancelled:
+                # задача остаётся running: без пульса её заберёт воркер и продолжит с контрольной точки
+                logger.error(f"Задача парсинга {job_id} прервана: {e}")
+                await bot.send_message(chat_id, f"❌ Задача #{job_id} прервана, попробую продолжить позже.")
+                return
+            logger.info(f"Задача парсинга {job_id} остановлена по отмене")
+            await _finish_cancelled(bot, job, token.partial)
+            return
+        if not products:
+            await bot.send_message(chat_id, "❌ Не удалось собрать товары.")
+        else:
+            status = await _deliver(bot, job, products, note=note, sample=sample) or "done"
+    await asyncio.to_thread(finish_job, job_id, status)
+    await asyncio.to_thread(clear_items, job_id)
+    await _edit_progress(bot, job, _RESULT_TEXT[status].format(job_id))
+
+
+# -------------------------------------------------------------------
+# Шарды (см. services/sharding.py)
+# -------------------------------------------------------------------
+_SHARD_STAGES = {"sizing": "оценка шардов", "shards": "шарды"}
+
+
+async def run_shard(bot: Bot, job: dict):
+    """
+    Шард: сначала оценка размера выдачи (mode size), затем обычный парсинг
+    своей доли, но без выгрузки — её делает родитель.
+    """
+    async with _running(bot, job, edit=False) as token:
+        try:
+            if job["mode"] == "size":
+                size = await asyncio.to_thread(SHARD_SIZERS[job["marketplace"]], job["url"])
+                await asyncio.to_thread(set_estimate, job["job_id"], size)
+            else:
+                await asyncio.to_thread(PARSERS[job["marketplace"]], job["url"], job["target"], job["job_id"])
+            status = "done"
+        except Exception as e:
+            if not token.cancelled:
+                logger.error(f"Шард {job['job_id']} задачи {job['parent_id']} прерван: {e}")
+                return
+            status = "cancelled"
+    parent = await asyncio.to_thread(finish_shard, job["job_id"], status)
+    if parent["status"] == "waiting" and not parent["cancel"]:
+        stage = _SHARD_STAGES.get(parent["stage"], "шарды")
+        await _edit_progress(bot, parent, f"⏳ Задача #{parent['job_id']}: {stage} {parent['done']}/{parent['total']}",
+                             keyboard=True)
+
+
+async def _allocate_shards(bot: Bot, job: dict) -> bool:
+    """Делит target между шардами по оценкам размера и запускает сбор; False — собирать нечего."""
+    job_id = job["job_id"]
+    children = [c for c in await asyncio.to_thread(shards, job_id) if c["status"] == "done"]
+    targets = shard_targets([c["estimate"] or 0 for c in children], job["target"])
+    logger.info(f"Задача {job_id}: размеры шардов {[c['estimate'] for c in children]}, доли {targets}")
+    started = await asyncio.to_thread(
+        start_shards, job_id, {c["job_id"]: t for c, t in zip(children, targets)}
+    )
+    if started:
+        await _edit_progress(bot, job, f"⏳ Задача #{job_id}: шарды 0/{started}", keyboard=True)
+    return bool(started)
+
+
+async def _merge_shards(bot: Bot, job: dict, token: CancelToken):
+    job_id = job["job_id"]
+    children = await asyncio.to_thread(shards, job_id)
+    parts = [(await asyncio.to_thread(load_items, child["job_id"]))[0] for child in children]
+    products, duplicates = merge_shards(parts, job["target"])
+    logger.info(f"Задача {job_id}: из {len(children)} шардов {len(products)} товаров, повторов {duplicates}")
+    status = "cancelled" if job["cancel"] else "done"
+    if job["cancel"] and not token.partial:
+        text = _RESULT_TEXT[status].format(job_id)
+    elif not products:
+        text = f"❌ Задача #{job_id}: не удалось собрать товары."
+    else:
+        note = f"🧩 Шардов по цене: {len(children)}, повторов убрано: {duplicates}"
+        status = await _deliver(bot, job, products, partial=bool(job["cancel"]), note=note) or status
+        text = _RESULT_TEXT[status].format(job_id)
+    await asyncio.to_thread(finish_job, job_id, status)
+    for child in children:
+        await asyncio.to_thread(clear_items, child["job_id"])
+    await _edit_progress(bot, job, text)
+
+
+async def run_sharded_job(bot: Bot, job: dict):
+    """
+    Первый запуск — делит категорию на ценовые шарды и ставит их в очередь
+    на оценку размера (параллельно их берут свободные воркеры); следующий —
+    делит target между шардами и запускает сбор; последний — собирает их товары.
+    """
+    job_id = job["job_id"]
+    async with _running(bot, job) as token:
+        try:
+            # отменённая задача сразу собирает то, что успела
+            if job["stage"] == "allocate" and not job["cancel"] and await _allocate_shards(bot, job):
+                return
+            if job["stage"] in ("allocate", "merge"):
+                # собранное уже есть: отмена здесь означает «прислать собранное»
+                reset = bind_token(None)
+                try:
+                    await _merge_shards(bot, job, token)
+                finally:
+                    unbind_token(reset)
+                return
+            urls = await asyncio.to_thread(SHARD_PLANNERS[job["marketplace"]], job["url"])
+        except Exception as e:
+            if not token.cancelled:
+                logger.error(f"Задача парсинга {job_id} прервана: {e}")
+                return
+            await asyncio.to_thread(finish_job, job_id, "cancelled")
+            await _edit_progress(bot, job, f"🛑 Задача #{job_id} отменена.")
+            return
+    await asyncio.to_thread(create_shards, job_id, urls)
+    await _edit_progress(bot, job, f"⏳ Задача #{job_id}: шардов по цене {len(urls)}, в очереди",
+                         keyboard=True)
+
+
+async def run_job(bot: Bot, job: dict):
+    """Задача из очереди — по её виду и режиму."""
+    if job["kind"] == "product":
+        return await run_product_job(bot, job)
+    if job["attempts"] > CRAWL_QUEUE["max_attempts"]:
+        if job["kind"] == "shard":
+            await asyncio.to_thread(finish_shard, job["job_id"], "failed")
+            return
+        await asyncio.to_thread(finish_job, job["job_id"], "failed")
+        await _edit_progress(bot, job, f"❌ Задачу #{job['job_id']} не удалось завершить за несколько попыток.")
+        return
+    if job["kind"] == "shard":
+        return await run_shard(bot, job)
+    if job["mode"] == "sharded":
+        return await run_sharded_job(bot, job)
+    return await run_crawl_job(bot, job)
+
+
+async def run_product_job(bot: Bot, job: dict):
+    """Карточка одного товара: короткая задача, без контрольных точек и повторов."""
+    job_id, chat_id = job["job_id"], job["chat_id"]
+    async with _running(bot, job, edit=False) as token:
+        try:
+            info = await asyncio.to_thread(PRODUCT_PARSERS[job["marketplace"]], job["url"], job["marketplace"])
+            # страница могла дочитаться уже закрытым браузером
+            token.check()
+            await bot.send_message(chat_id, f"```json\n{info}\n```", parse_mode="Markdown")
+        except Exception as e:
+            if token.cancelled:
+                await asyncio.to_thread(finish_job, job_id, "cancelled")
+                await _edit_progress(bot, job, f"🛑 Задача #{job_id} отменена.")
+                return
+            logger.error(f"Задача {job_id} (товар): {e}")
+            await asyncio.to_thread(finish_job, job_id, "failed")
+            await bot.send_message(chat_id, "❌ Ошибка при получении информации.")
+            return
+    await asyncio.to_thread(finish_job, job_id)
+
+
+def _format_wait(seconds: float) -> str:
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return "меньше минуты"
+    if minutes < 60:
+        return f"~{minutes} мин"
+    return f"~{minutes // 60} ч {minutes % 60} мин"
+
+
+async def enqueue_crawl(message: types.Message, marketplace: str, url: str,
+                        target: int, fmt: str = "", kind: str = "category",
+                        budget: int | None = None, mode: str = "full") -> int:
+    """
+    Ставит задачу в очередь и отвечает сообщением с оценкой ожидания,
+    в котором потом идёт прогресс.
+    """
+    if (mode == "full" and budget is None and marketplace in SHARD_PLANNERS
+            and target >= CRAWL_SHARD["min_target"]):
+        mode = "sharded"
+    job_id = await asyncio.to_thread(enqueue, message.chat.id, marketplace, url, target, fmt, kind,
+                                     budget, mode)
+    ahead, wait = await asyncio.to_thread(estimate_wait, job_id)
+    text = f"✅ Задача #{job_id} поставлена в очередь"
+    if ahead:
+        text += f" (впереди {ahead}, ожидание {_format_wait(wait)})"
+    reply = await message.reply(text, reply_markup=cancel_keyboard(job_id) if kind == "category" else None)
+    await asyncio.to_thread(set_progress_message, job_id, reply.message_id)
+    return job_id
+
+
+async def cancel_crawl(bot: Bot, chat_id: int, job_id: int, partial: bool = False) -> str:
+    """Отмена по /cancel или кнопке; возвращает ответ для пользователя."""
+    result = await asyncio.to_thread(request_cancel, job_id, chat_id, partial)
+    if result is None:
+        return f"Задача #{job_id} уже завершена."
+    if result == "cancelled":
+        job = await asyncio.to_thread(get_job, job_id)
+        await _edit_progress(bot, job, f"🛑 Задача #{job_id} отменена.")
+        return f"Задача #{job_id} снята с очереди."
+    if partial:
+        return f"Останавливаю задачу #{job_id}, пришлю собранное."
+    return f"Останавливаю задачу #{job_id}."
+
+
+async def worker_loop(bot: Bot, worker: str, max_priority: int | None = None):
+    """
+    Берёт задачи из очереди одну за другой; пустая очередь — ждёт poll_interval.
+    max_priority — только задачи этого приоритета и выше (см. claim_job).
+    """
+    logger.info(f"Воркер парсинга {worker} запущен")
+    while True:
+        try:
+            job = await asyncio.to_thread(claim_job, worker, max_priority)
+        except Exception as e:
+            logger.error(f"Воркер {worker}: ошибка очереди: {e}")
+            job = None
+        if job is None:
+            await asyncio.sleep(CRAWL_QUEUE["poll_interval"])
+            continue
+        logger.info(f"Воркер {worker} взял задачу {job['job_id']} ({job['marketplace']}, {job['url']})")
+        try:
+            await run_job(bot, job)
+        except Exception as e:
+            logger.error(f"Воркер {worker}: задача {job['job_id']}: {e}")
+
+
+def start_workers(bot: Bot, count: int, prefix: str = "bot",
+                  interactive: int = 0) -> list[asyncio.Task]:
+    """count общих воркеров и interactive — только для карточек товаров."""
+    host = f"{prefix}-{os.getpid()}"
+    tasks = [asyncio.create_task(worker_loop(bot, f"{host}-{n}")) for n in range(count)]
+    tasks += [
+        asyncio.create_task(worker_loop(bot, f"{host}-i{n}", PRIORITY_INTERACTIVE))
+        for n in range(interactive)
+    ]
+    return tasks
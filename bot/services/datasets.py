@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+from ..config import CACHE_DIR, DATASET_CACHE
+from .prices import normalize_prices
+
+logger = logging.getLogger(__name__)
+
+
+class DataFrameCache:
+    """LRU декодированных DataFrame, ограниченный суммарным объёмом в байтах."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._items: OrderedDict[str, tuple[pd.DataFrame, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: str, df: pd.DataFrame):
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._items:
+                self.used -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                logger.info(f"Датасет {key[:12]} ({size} байт) больше лимита кэша, не кэшируем")
+                return
+            self._items[key] = (df, size)
+            self.used += size
+            while self.used > self.max_bytes:
+                old_key, (_, old_size) = self._items.popitem(last=False)
+                self.used -= old_size
+                logger.info(f"Вытеснен из кэша датасет {old_key[:12]}")
+
+
+_cache = DataFrameCache(DATASET_CACHE["max_memory_bytes"])
+# (путь, размер, mtime) -> sha256, чтобы не перечитывать большой файл ради хэша (LRU)
+_hashes: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+_hashes_lock = threading.Lock()
+
+
+def file_hash(path: Path) -> str:
+    st = path.stat()
+    sig = (str(path), st.st_size, st.st_mtime_ns)
+    with _hashes_lock:
+        if sig in _hashes:
+            _hashes.move_to_end(sig)
+            return _hashes[sig]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    with _hashes_lock:
+        _hashes[sig] = h.hexdigest()
+        while len(_hashes) > DATASET_CACHE["max_hashes"]:
+            _hashes.popitem(last=False)
+    return h.hexdigest()
+
+
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Ужимает числовые колонки и переводит повторяющиеся строки в category."""
+    df = df.copy()
+    ratio = DATASET_CACHE["category_ratio"]
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_integer_dtype(s):
+            df[col] = pd.to_numeric(s, downcast="integer")
+        elif pd.api.types.is_float_dtype(s):
+            df[col] = pd.to_numeric(s, downcast="float")
+        elif s.dtype == object:
+            # словари/списки (характеристики) оставляем как есть
+            if not s.dropna().map(type).eq(str).all():
+                continue
+            if s.nunique(dropna=True) < len(s) * ratio:
+                df[col] = s.astype("category")
+    return df
+
+
+def _cache_path(key: str) -> Path:
+    return Path(CACHE_DIR) / f"{key}.pkl"
+
+
+def _read_source(path: Path) -> pd.DataFrame:
+    # выгрузка парсера могла быть разрезана на части — датасет это все части
+    # (exporter импортирует characteristics, а тот — этот модуль)
+    from .exporter import export_parts
+
+    parts = export_parts(path)
+    if len(parts) > 1:
+        return pd.concat([_read_file(p) for p in parts], ignore_index=True)
+    return _read_file(path)
+
+
+def _read_file(path: Path) -> pd.DataFrame:
+    if path.suffix.lower() in (".xlsx", ".xls"):
+        return pd.read_excel(path, sheet_name=0)
+    # .csv.gz / .jsonl.gz из выгрузок: сжатие pandas определяет по расширению
+    if path.name.lower().endswith((".jsonl", ".jsonl.gz")):
+        return pd.read_json(path, lines=True)
+    return pd.read_csv(path)
+
+
+def _store(key: str, df: pd.DataFrame) -> pd.DataFrame:
+    df = optimize_dtypes(normalize_prices(df))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = _cache_path(key).with_suffix(".tmp")
+    df.to_pickle(tmp, protocol=5)
+    os.replace(tmp, _cache_path(key))
+    _cache.put(key, df)
+    return df
+
+
+def load_dataset(path: Path) -> pd.DataFrame:
+    """
+    DataFrame выгрузки по пути: из памяти, из бинарного кэша на диске
+    или (один раз) разбором исходного CSV/Excel. Ключ — хэш содержимого.
+    Возвращаемый DataFrame общий для всех команд — менять его только через copy().
+    """
+    path = Path(path)
+    key = file_hash(path)
+    df = _cache.get(key)
+    if df is not None:
+        return df
+    cached = _cache_path(key)
+    if cached.exists():
+        try:
+            df = pd.read_pickle(cached)
+            _cache.put(key, df)
+            return df
+        except Exception as e:
+            logger.warning(f"Битый кэш {cached.name}, пересобираю: {e}")
+    return _store(key, _read_source(path))
+
+
+def register_dataset(path: Path, df: pd.DataFrame) -> pd.DataFrame:
+    """Кладёт в кэш уже собранный парсером DataFrame под хэшем выгруженного файла."""
+    return _store(file_hash(Path(path)), df)
@@ -0,0 +1,237 @@
+"""
+Потоковая выгрузка результатов парсинга: xlsx (openpyxl write_only),
+CSV или JSONL со сжатием gzip. Строки пишутся по одной, память писателя
+не зависит от размера выгрузки; по достижении лимита файл закрывается
+и начинается следующая часть, чтобы каждая влезла в лимит Telegram.
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import math
+import zlib
+from html import escape
+from pathlib import Path
+
+import pandas as pd
+
+from ..config import EXPORT
+from .cancellation import CrawlCancelled, check_cancelled
+from .characteristics import CHAR_COLUMNS
+from .records import GROUPS, KEYS, ProductRecord
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"xlsx": ".xlsx", "csv": ".csv.gz", "jsonl": ".jsonl.gz"}
+
+
+def _cell(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return None
+    if isinstance(v, (dict, list, tuple)):
+        return str(v)
+    if hasattr(v, "item"):
+        # numpy-скаляры -> обычные числа
+        return v.item()
+    return v
+
+
+class _CsvPart:
+    def __init__(self, path: Path, header: list[str]):
+        self._raw = open(path, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._text = io.TextIOWrapper(self._gz, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(header)
+
+    def write(self, row: list):
+        self._writer.writerow(["" if v is None else v for v in row])
+
+    def size(self) -> int:
+        # сжатые байты уже на диске; хвост в буфере компрессора — в запасе лимита
+        return self._raw.tell()
+
+    def close(self):
+        self._text.close()
+        self._raw.close()
+
+
+class _JsonlPart(_CsvPart):
+    def __init__(self, path: Path, header: list[str]):
+        self._header = header
+        self._raw = open(path, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._text = io.TextIOWrapper(self._gz, encoding="utf-8")
+
+    def write(self, row: list):
+        item = {k: v for k, v in zip(self._header, row) if v is not None}
+        self._text.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+
+
+class _XlsxPart:
+    # размер xlsx известен только после сохранения. Оценка: тот же XML строк
+    # (<row>/<c r=.. t=..><v>..</v></c>, текст прямо в ячейке), сжатый zlib
+    # пачками по _BATCH строк. На проверке выходит ±5% от настоящего файла
+    # (таблица строк и стили — отдельные части архива), поэтому сверху
+    # запас _MARGIN; несжатый хвост пачки считается как есть.
+    _BATCH = 1000
+    _MARGIN = 1.25
+
+    def __init__(self, path: Path, header: list[str]):
+        from openpyxl import Workbook
+        from openpyxl.utils import get_column_letter
+
+        self._path = path
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet()
+        self._letters = [get_column_letter(i) for i in range(1, len(header) + 1)]
+        self._row = 0
+        self._bytes = 0
+        self._pending: list[str] = []
+        self._pending_bytes = 0
+        self.write(header)
+
+    def _xml(self, row: list) -> str:
+        cells = "".join(
+            f'<c r="{col}{self._row}" t="{"n" if isinstance(v, (int, float)) else "s"}">'
+            f"<v>{escape(str(v))}</v></c>"
+            for col, v in zip(self._letters, row) if v is not None
+        )
+        return f'<row r="{self._row}">{cells}</row>'
+
+    def write(self, row: list):
+        self._ws.append(row)
+        self._row += 1
+        xml = self._xml(row)
+        self._pending.append(xml)
+        self._pending_bytes += len(xml.encode("utf-8"))
+        if len(self._pending) >= self._BATCH:
+            self._bytes += len(zlib.compress("".join(self._pending).encode("utf-8"), 6))
+            self._pending, self._pending_bytes = [], 0
+
+    def size(self) -> int:
+        return int(self._bytes * self._MARGIN) + self._pending_bytes
+
+    def close(self):
+        self._wb.save(self._path)
+
+
+_WRITERS = {"xlsx": _XlsxPart, "csv": _CsvPart, "jsonl": _JsonlPart}
+
+
+def _part_path(base_path: Path, n: int, ext: str) -> Path:
+    suffix = "" if n == 1 else f"_part{n}"
+    return base_path.with_name(base_path.name + suffix + ext)
+
+
+def export_parts(first: str | Path) -> list[Path]:
+    """Все части выгрузки по пути первой части (для одночастной — она одна)."""
+    first = Path(first)
+    ext = next((e for e in EXTENSIONS.values() if first.name.endswith(e)), None)
+    if ext is None:
+        return [first]
+    base = first.with_name(first.name[:-len(ext)])
+    parts, n = [first], 2
+    while (part := _part_path(base, n, ext)).exists():
+        parts.append(part)
+        n += 1
+    return parts
+
+
+class StreamingExporter:
+    """
+    Пишет строки в base_path + расширение формата; при превышении
+    max_part_bytes начинает base_path_part2 и т.д. (заголовок в каждой части).
+    """
+
+    def __init__(self, base_path: str | Path, header: list[str], fmt: str = "xlsx",
+                 max_part_bytes: int | None = None):
+        self.base_path = Path(base_path)
+        self.header = header
+        self.fmt = fmt
+        self.max_part_bytes = max_part_bytes or EXPORT["max_part_bytes"]
+        self.parts: list[Path] = []
+        self.rows = 0
+        self._part = None
+
+    def _open_part(self):
+        path = _part_path(self.base_path, len(self.parts) + 1, EXTENSIONS[self.fmt])
+        self._part = _WRITERS[self.fmt](path, self.header)
+        self.parts.append(path)
+
+    def write(self, row: list):
+        if self._part is None:
+            self._open_part()
+        self._part.write([_cell(v) for v in row])
+        self.rows += 1
+        if self._part.size() >= self.max_part_bytes:
+            self._part.close()
+            self._part = None
+
+    def close(self) -> list[Path]:
+        if self._part is not None:
+            self._part.close()
+            self._part = None
+        if not self.parts:
+            # пустая выгрузка — всё равно файл с заголовком
+            self._open_part()
+            self._part.close()
+            self._part = None
+        return self.parts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _char_columns(records: list[ProductRecord]) -> tuple[dict[int, int], dict[tuple[int, int], int], list[str]]:
+    """Колонки характеристик, встреченных в этих записях: ключ -> номер колонки."""
+    names: dict[str, int] = {}
+    chars: dict[int, int] = {}
+    params: dict[tuple[int, int], int] = {}
+    for r in records:
+        for key_id in r.char_ids:
+            if key_id not in chars:
+                chars[key_id] = names.setdefault(KEYS.keys[key_id], len(names))
+        for pair in zip(r.param_groups, r.param_ids):
+            if pair not in params:
+                group, key = GROUPS.keys[pair[0]], KEYS.keys[pair[1]]
+                params[pair] = names.setdefault(f"{group}.{key}" if group else key, len(names))
+    return chars, params, list(names)
+
+
+def export_records(df: pd.DataFrame, records: list[ProductRecord], base_path: str | Path,
+                   fmt: str = "xlsx") -> list[Path]:
+    """
+    Выгрузка результата парсинга: колонки df (нормализованные цены и т.п.)
+    плюс по колонке на характеристику. Строки собираются по одной из df и
+    записей — широкий DataFrame в памяти не строится. Отмена задачи
+    прерывает выгрузку (проверка раз в 1000 строк).
+    """
+    base_cols = [c for c in df.columns if c not in CHAR_COLUMNS]
+    chars, params, char_names = _char_columns(records)
+    # характеристика с именем основного поля не должна его затирать
+    header = base_cols + [f"{c} (хар.)" if c in base_cols else c for c in char_names]
+    width = len(header)
+    offset = len(base_cols)
+    with StreamingExporter(base_path, header, fmt) as exporter:
+        try:
+            for n, (base, r) in enumerate(zip(df[base_cols].itertuples(index=False, name=None), records)):
+                if n % 1000 == 0:
+                    check_cancelled()
+                row = list(base) + [None] * (width - offset)
+                for key_id, value in zip(r.char_ids, r.char_values):
+                    row[offset + chars[key_id]] = value
+                for pair, value in zip(zip(r.param_groups, r.param_ids), r.param_values):
+                    row[offset + params[pair]] = value
+                exporter.write(row)
+        except CrawlCancelled:
+            # недописанные части не нужны
+            for part in exporter.close():
+                part.unlink(missing_ok=True)
+            raise
+    logger.info(f"Выгрузка {fmt}: {exporter.rows} строк, частей {len(exporter.parts)}")
+    return exporter.parts
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import logging
+import time
+from pathlib import Path
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, FSInputFile
+
+from .datasets import file_hash
+from .storage import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Хэш содержимого -> file_id, который Telegram вернул при первой загрузке.
+# kind нужен потому, что file_id фото нельзя отправить как документ и наоборот.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS telegram_files (
+    content_hash TEXT NOT NULL,
+    kind         TEXT NOT NULL,
+    file_id      TEXT NOT NULL,
+    created_at   REAL NOT NULL,
+    PRIMARY KEY (content_hash, kind)
+);
+"""
+
+# Ответы Telegram, после которых сохранённый file_id больше не годится
+_STALE_ERRORS = ("wrong file identifier", "file not found", "wrong remote file", "file_id_invalid")
+
+
+def _db():
+    return ensure_schema("file_ids", _SCHEMA)
+
+
+def get_file_id(content_hash: str, kind: str) -> str | None:
+    row = _db().execute(
+        "SELECT file_id FROM telegram_files WHERE content_hash = ? AND kind = ?",
+        (content_hash, kind),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def remember_file_id(content_hash: str, kind: str, file_id: str):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO telegram_files (content_hash, kind, file_id, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (content_hash, kind, file_id, time.time()),
+        )
+
+
+def forget_file_id(content_hash: str, kind: str):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "DELETE FROM telegram_files WHERE content_hash = ? AND kind = ?",
+            (content_hash, kind),
+        )
+
+
+def _sent_file_id(sent: types.Message, kind: str) -> str | None:
+    if kind == "photo":
+        return sent.photo[-1].file_id if sent.photo else None
+    return sent.document.file_id if sent.document else None
+
+
+async def _send(bot: Bot, chat_id: int, kind: str, file, caption: str | None,
+                reply_to: int | None) -> types.Message:
+    if kind == "photo":
+        return await bot.send_photo(chat_id, file, caption=caption, reply_to_message_id=reply_to)
+    return await bot.send_document(chat_id, file, caption=caption, reply_to_message_id=reply_to)
+
+
+async def send_file(message: types.Message, kind: str, path: str | Path | None = None,
+                    data: bytes | None = None, filename: str | None = None,
+                    caption: str | None = None) -> types.Message:
+    """Ответ на сообщение фото или документом (см. send_file_to)."""
+    return await send_file_to(message.bot, message.chat.id, kind, path, data, filename, caption,
+                              reply_to=message.message_id)
+
+
+async def send_file_to(bot: Bot, chat_id: int, kind: str, path: str | Path | None = None,
+                       data: bytes | None = None, filename: str | None = None,
+                       caption: str | None = None, reply_to: int | None = None) -> types.Message:
+    """
+    Отправляет фото или документ (kind: "photo" | "document") из файла или байтов.
+    Если такое же содержимое уже загружалось — шлёт по file_id без повторной
+    загрузки; протухший file_id удаляется, и файл загружается заново.
+    """
+    if path is not None:
+        content_hash = await asyncio.to_thread(file_hash, Path(path))
+    else:
+        content_hash = hashlib.sha256(data).hexdigest()
+
+    file_id = await asyncio.to_thread(get_file_id, content_hash, kind)
+    if file_id:
+        try:
+            return await _send(bot, chat_id, kind, file_id, caption, reply_to)
+        except TelegramBadRequest as e:
+            if not any(err in str(e).lower() for err in _STALE_ERRORS):
+                raise
+            logger.info(f"file_id для {content_hash[:12]} недействителен, загружаем заново")
+            await asyncio.to_thread(forget_file_id, content_hash, kind)
+
+    if path is not None:
+        upload = FSInputFile(path, filename=filename)
+    else:
+        upload = BufferedInputFile(data, filename or f"{content_hash[:16]}.bin")
+    sent = await _send(bot, chat_id, kind, upload, caption, reply_to)
+    new_id = _sent_file_id(sent, kind)
+    if new_id:
+        await asyncio.to_thread(remember_file_id, content_hash, kind, new_id)
+    return sent
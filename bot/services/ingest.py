@@ -0,0 +1,38 @@
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from .aggregates import PartialAggregates, is_streaming, load_aggregates
+from .characteristics import save_characteristics
+from .datasets import load_dataset, register_dataset
+from .price_history import record_observations
+from .sessions import add_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_dataset(chat_id: int, path: Path, df: pd.DataFrame | None = None,
+                   name: str | None = None, marketplace: str | None = None,
+                   chars: pd.DataFrame | None = None) -> PartialAggregates:
+    """
+    Единая точка приёма датасета — после парсинга категории или загрузки файла.
+    Кэширует разобранный DataFrame (df от парсера или разбор файла), строит и
+    сохраняет профиль (см. PartialAggregates), делает датасет активным в чате;
+    для выгрузок парсеров (marketplace) ещё пишет цены в историю.
+    chars — длинная таблица характеристик, если парсер отдал её отдельно от df.
+    Вызывать из потока: всё здесь синхронное.
+    """
+    path = Path(path)
+    if chars is not None:
+        save_characteristics(path, chars)
+    if df is not None:
+        register_dataset(path, df)
+    elif not is_streaming(path):
+        df = load_dataset(path)
+    profile = load_aggregates(path)
+    add_dataset(chat_id, path, name)
+    if marketplace and df is not None:
+        record_observations(df, marketplace)
+    logger.info(f"Датасет {path.name} принят: {profile.rows} строк")
+    return profile
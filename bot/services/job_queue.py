@@ -0,0 +1,500 @@
+"""
+Очередь задач парсинга в SQLite.
+
+Хэндлеры ставят задачу и сразу отвечают; воркеры (задачи в процессе бота
+или отдельные процессы `python -m bot.worker`) забирают задачи атомарно,
+пишут прогресс и пульс. Задача, чей воркер перестал слать пульс
+(перезапуск, падение), снова становится доступной.
+
+Очередь справедливая: короткие интерактивные задачи (карточка товара) идут
+раньше парсингов категорий, а среди равных по приоритету первым получает
+браузер пользователь с наименьшей долей занятых браузеров относительно его
+веса; браузеров под парсинги у пользователя — не больше max_per_user
+(карточки товара под это ограничение не попадают).
+
+Браузеров всего столько, сколько живых воркеров. Обычно задача — один
+браузер, но парсинг Ozon читает страницы выдачи несколькими (CRAWL_PAGES):
+при взятии задача получает их столько, сколько свободно (колонка browsers),
+и пока они заняты, другие воркеры парсинги не берут.
+"""
+import logging
+import math
+import time
+
+from ..config import CRAWL_PAGES, CRAWL_QUEUE
+from .storage import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# status: queued -> running -> done | failed | cancelled;
+# разбитая на шарды задача ждёт их в waiting: оценку размеров (stage sizing),
+# затем сбор (stage shards); после каждого этапа она снова queued
+# (stage allocate — раздать доли, stage merge — собрать результат)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_jobs (
+    job_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id     INTEGER NOT NULL,
+    marketplace TEXT    NOT NULL,
+    url         TEXT    NOT NULL,
+    target      INTEGER NOT NULL,
+    fmt         TEXT    NOT NULL,
+    status      TEXT    NOT NULL DEFAULT 'queued',
+    pages_done  INTEGER NOT NULL DEFAULT 0,
+    listing_done INTEGER NOT NULL DEFAULT 0,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL    NOT NULL,
+    updated_at  REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_crawl_jobs_status ON crawl_jobs (status);
+CREATE TABLE IF NOT EXISTS crawl_workers (
+    worker      TEXT PRIMARY KEY,
+    interactive INTEGER NOT NULL DEFAULT 0,
+    seen        REAL    NOT NULL
+);
+"""
+
+# Приоритеты: меньше — раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Флаг отмены (колонка cancel): остановить или остановить и прислать собранное
+CANCEL = 1
+CANCEL_PARTIAL = 2
+
+# Колонки, появившиеся вместе с очередью
+_QUEUE_COLUMNS = {
+    "worker": "TEXT",
+    "heartbeat": "REAL",
+    "stage": "TEXT",
+    "done": "INTEGER NOT NULL DEFAULT 0",
+    "total": "INTEGER NOT NULL DEFAULT 0",
+    "progress_message_id": "INTEGER",
+    "kind": "TEXT NOT NULL DEFAULT 'category'",
+    "priority": f"INTEGER NOT NULL DEFAULT {PRIORITY_BULK}",
+    "started_at": "REAL",
+    "cancel": "INTEGER NOT NULL DEFAULT 0",
+    # бюджет времени парсинга, сек (см. budget.py); NULL — без ограничения
+    "budget": "REAL",
+    # full — вся выдача до target, sample — выборка страниц (см. sampling.py)
+    "mode": "TEXT NOT NULL DEFAULT 'full'",
+    # шард (kind shard) -> задача, которую он дополняет (см. sharding.py)
+    "parent_id": "INTEGER",
+    # оценка числа товаров в выдаче шарда
+    "estimate": "INTEGER",
+    # браузеров, выданных задаче при взятии (см. _browsers_wanted)
+    "browsers": "INTEGER NOT NULL DEFAULT 1",
+}
+
+_FINISHED = ("done", "failed", "cancelled")
+
+
+def _db():
+    return ensure_schema("job_queue", _SCHEMA, {"crawl_jobs": _QUEUE_COLUMNS})
+
+
+def _row(cur) -> dict | None:
+    row = cur.fetchone()
+    return dict(zip([c[0] for c in cur.description], row)) if row else None
+
+
+def _rows(cur) -> list[dict]:
+    columns = [c[0] for c in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def enqueue(chat_id: int, marketplace: str, url: str, target: int, fmt: str,
+            kind: str = "category", budget: int | None = None, mode: str = "full") -> int:
+    """kind: category — парсинг категории, product — карточка одного товара."""
+    now = time.time()
+    priority = PRIORITY_INTERACTIVE if kind == "product" else PRIORITY_BULK
+    conn = _db()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO crawl_jobs (chat_id, marketplace, url, target, fmt, kind, priority, budget, mode, "
+            "status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (chat_id, marketplace, url, target, fmt, kind, priority, budget, mode, now, now),
+        )
+    return cur.lastrowid
+
+
+def get_job(job_id: int) -> dict | None:
+    return _row(_db().execute("SELECT * FROM crawl_jobs WHERE job_id = ?", (job_id,)))
+
+
+def _weight(chat_id: int) -> float:
+    return CRAWL_QUEUE["weights"].get(chat_id, 1.0)
+
+
+def _browsers_wanted(job: dict) -> int:
+    """
+    Сколько браузеров задача может занять: выдачу Ozon читают несколько,
+    детали — один (задача, взятая заново после выдачи, лишних не получает).
+    """
+    if (job["marketplace"] == "ozon" and job["kind"] in ("category", "shard") and job["mode"] == "full"
+            and not job["listing_done"]):
+        return max(1, CRAWL_PAGES["workers"])
+    return 1
+
+
+def _running_by_chat(conn, stale: float) -> dict[int, int]:
+    """Занятые браузеры по чатам; каждый шард считается отдельно."""
+    return dict(conn.execute(
+        "SELECT chat_id, SUM(browsers) FROM crawl_jobs "
+        "WHERE status = 'running' AND COALESCE(heartbeat, updated_at) >= ? GROUP BY chat_id",
+        (stale,),
+    ).fetchall())
+
+
+def _pick(candidates: list[dict], running: dict[int, int]) -> dict | None:
+    """
+    Брошенные задачи — первыми (их уже начинали), дальше по приоритету и по
+    доле пользователя: занятые воркеры / вес; при равенстве — кто раньше.
+    """
+    best, best_key = None, None
+    for job in candidates:
+        chat_id = job["chat_id"]
+        # карточка товара — короткая, её не держат идущие парсинги пользователя
+        if job["priority"] != PRIORITY_INTERACTIVE and running.get(chat_id, 0) >= CRAWL_QUEUE["max_per_user"]:
+            continue
+        key = (job["status"] != "running", job["priority"],
+               running.get(chat_id, 0) / _weight(chat_id), job["job_id"])
+        if best_key is None or key < best_key:
+            best, best_key = job, key
+    return best
+
+
+def claim_job(worker: str, max_priority: int | None = None) -> dict | None:
+    """
+    Забирает следующую задачу по справедливой очереди (см. _pick) или брошенную
+    (без пульса). max_priority — только задачи не ниже этого приоритета
+    (воркеры для интерактивных запросов). BEGIN IMMEDIATE берёт блокировку
+    записи, поэтому одну задачу не заберут два воркера — ни в одном процессе,
+    ни в разных.
+    """
+    now = time.time()
+    stale = now - CRAWL_QUEUE["stale_after"]
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO crawl_workers (worker, interactive, seen) VALUES (?, ?, ?)",
+            (worker, int(max_priority is not None), now),
+        )
+        cur = conn.execute(
+            "SELECT * FROM crawl_jobs WHERE (status = 'queued' "
+            "OR (status = 'running' AND COALESCE(heartbeat, updated_at) < ?)) AND priority <= ?",
+            (stale, PRIORITY_BULK if max_priority is None else max_priority),
+        )
+        candidates = _rows(cur)
+        running = _running_by_chat(conn, stale)
+        job = _pick(candidates, running)
+        if job is not None:
+            browsers = 1
+            if job["priority"] != PRIORITY_INTERACTIVE:
+                busy = conn.execute(
+                    "SELECT COALESCE(SUM(browsers), 0) FROM crawl_jobs WHERE status = 'running' "
+                    "AND priority != ? AND COALESCE(heartbeat, updated_at) >= ?",
+                    (PRIORITY_INTERACTIVE, stale),
+                ).fetchone()[0]
+                free = _capacity(conn, stale, False) - busy
+                own = CRAWL_QUEUE["max_per_user"] - running.get(job["chat_id"], 0)
+                # браузеры заняты многобраузерными задачами — парсинг подождёт
+                if free < 1:
+                    job = None
+                else:
+                    browsers = max(1, min(_browsers_wanted(job), free, own))
+        if job is not None:
+            conn.execute(
+                "UPDATE crawl_jobs SET status = 'running', worker = ?, heartbeat = ?, browsers = ?, "
+                "attempts = attempts + 1, started_at = COALESCE(started_at, ?), updated_at = ? "
+                "WHERE job_id = ?",
+                (worker, now, browsers, now, now, job["job_id"]),
+            )
+            job["attempts"] += 1
+            job["browsers"] = browsers
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return job
+
+
+def heartbeat(job_id: int):
+    conn = _db()
+    with conn:
+        conn.execute("UPDATE crawl_jobs SET heartbeat = ? WHERE job_id = ?", (time.time(), job_id))
+
+
+def set_browsers(job_id: int, browsers: int):
+    """Задача отпускает лишние браузеры (например, выдача Ozon прочитана)."""
+    conn = _db()
+    with conn:
+        conn.execute("UPDATE crawl_jobs SET browsers = ? WHERE job_id = ?", (browsers, job_id))
+
+
+def set_progress(job_id: int, stage: str, done: int, total: int):
+    now = time.time()
+    conn = _db()
+    with conn:
+        conn.execute(
+            "UPDATE crawl_jobs SET stage = ?, done = ?, total = ?, heartbeat = ?, updated_at = ? "
+            "WHERE job_id = ?",
+            (stage, done, total, now, now, job_id),
+        )
+
+
+def set_progress_message(job_id: int, message_id: int):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "UPDATE crawl_jobs SET progress_message_id = ? WHERE job_id = ?", (message_id, job_id)
+        )
+
+
+def finish_job(job_id: int, status: str = "done"):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "UPDATE crawl_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+            (status, time.time(), job_id),
+        )
+
+
+def active_jobs(chat_id: int) -> list[dict]:
+    return _rows(_db().execute(
+        "SELECT * FROM crawl_jobs WHERE chat_id = ? AND kind != 'shard' "
+        "AND status IN ('queued', 'running', 'waiting') ORDER BY job_id",
+        (chat_id,),
+    ))
+
+
+# -------------------------------------------------------------------
+# Шарды
+# -------------------------------------------------------------------
+def create_shards(parent_id: int, urls: list[str]):
+    """
+    Ставит шарды задачи в очередь на оценку размера (mode size); сама задача
+    ждёт их в статусе waiting.
+    """
+    now = time.time()
+    conn = _db()
+    with conn:
+        parent = _row(conn.execute("SELECT * FROM crawl_jobs WHERE job_id = ?", (parent_id,)))
+        conn.executemany(
+            "INSERT INTO crawl_jobs (chat_id, marketplace, url, target, fmt, kind, priority, mode, "
+            "parent_id, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, 0, ?, 'shard', ?, 'size', ?, 'queued', ?, ?)",
+            [(parent["chat_id"], parent["marketplace"], url, parent["fmt"],
+              parent["priority"], parent_id, now, now) for url in urls],
+        )
+        conn.execute(
+            "UPDATE crawl_jobs SET status = 'waiting', stage = 'sizing', done = 0, total = ?, "
+            "updated_at = ? WHERE job_id = ?",
+            (len(urls), now, parent_id),
+        )
+
+
+def set_estimate(job_id: int, size: int):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "UPDATE crawl_jobs SET estimate = ?, updated_at = ? WHERE job_id = ?", (size, time.time(), job_id)
+        )
+
+
+def start_shards(parent_id: int, targets: dict[int, int]) -> int:
+    """
+    Второй этап: оценённые шарды снова в очередь, каждый со своей долей target
+    (шарды с нулевой долей остаются завершёнными). Возвращает число запущенных.
+    """
+    now = time.time()
+    conn = _db()
+    with conn:
+        started = 0
+        for job_id, target in targets.items():
+            if target <= 0:
+                continue
+            cur = conn.execute(
+                "UPDATE crawl_jobs SET status = 'queued', mode = 'full', target = ?, attempts = 0, "
+                "stage = NULL, done = 0, total = 0, worker = NULL, heartbeat = NULL, updated_at = ? "
+                "WHERE job_id = ? AND status = 'done'",
+                (target, now, job_id),
+            )
+            started += cur.rowcount
+        if started:
+            conn.execute(
+                "UPDATE crawl_jobs SET status = 'waiting', stage = 'shards', done = 0, total = ?, "
+                "updated_at = ? WHERE job_id = ?",
+                (started, now, parent_id),
+            )
+    return started
+
+
+def shards(parent_id: int) -> list[dict]:
+    return _rows(_db().execute(
+        "SELECT * FROM crawl_jobs WHERE parent_id = ? ORDER BY job_id", (parent_id,)
+    ))
+
+
+def _release_parent(conn, parent_id: int) -> dict:
+    """
+    Считает завершённые шарды этапа; когда завершены все — задача снова в
+    очереди: после оценки размеров — раздать доли, после сбора — на сборку.
+    """
+    stage = conn.execute("SELECT stage FROM crawl_jobs WHERE job_id = ?", (parent_id,)).fetchone()[0]
+    # на втором этапе считаются только шарды, получившие долю
+    phase = "AND mode = 'full'" if stage == "shards" else ""
+    left, finished = conn.execute(
+        f"SELECT SUM(status NOT IN {_FINISHED}), SUM(status IN {_FINISHED}) "
+        f"FROM crawl_jobs WHERE parent_id = ? {phase}",
+        (parent_id,),
+    ).fetchone()
+    now = time.time()
+    if not left:
+        conn.execute(
+            "UPDATE crawl_jobs SET status = 'queued', stage = ?, done = ?, updated_at = ? "
+            "WHERE job_id = ? AND status = 'waiting'",
+            ("merge" if stage == "shards" else "allocate", finished, now, parent_id),
+        )
+    else:
+        conn.execute(
+            "UPDATE crawl_jobs SET done = ?, updated_at = ? WHERE job_id = ?",
+            (finished, now, parent_id),
+        )
+    return _row(conn.execute("SELECT * FROM crawl_jobs WHERE job_id = ?", (parent_id,)))
+
+
+def finish_shard(job_id: int, status: str = "done") -> dict:
+    """Завершает шард (его товары остаются до сборки) и возвращает задачу-родителя."""
+    conn = _db()
+    with conn:
+        conn.execute(
+            "UPDATE crawl_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+            (status, time.time(), job_id),
+        )
+        parent_id = conn.execute(
+            "SELECT parent_id FROM crawl_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        return _release_parent(conn, parent_id)
+
+
+def request_cancel(job_id: int, chat_id: int, partial: bool = False) -> str | None:
+    """
+    Задача из очереди отменяется сразу ('cancelled'); у идущей ставится флаг,
+    который заметит её воркер ('stopping'). None — задачи нет или она завершена.
+    """
+    now = time.time()
+    conn = _db()
+    with conn:
+        cur = conn.execute(
+            "UPDATE crawl_jobs SET status = 'cancelled', updated_at = ? "
+            "WHERE job_id = ? AND chat_id = ? AND status = 'queued'",
+            (now, job_id, chat_id),
+        )
+        if cur.rowcount:
+            return "cancelled"
+        flag = CANCEL_PARTIAL if partial else CANCEL
+        cur = conn.execute(
+            "UPDATE crawl_jobs SET cancel = ?, updated_at = ? "
+            "WHERE job_id = ? AND chat_id = ? AND status IN ('running', 'waiting')",
+            (flag, now, job_id, chat_id),
+        )
+        if not cur.rowcount:
+            return None
+        # шарды: ещё не начатые снимаются, идущие останавливаются; если идущих
+        # нет, задача сразу уходит на сборку собранного
+        conn.execute(
+            "UPDATE crawl_jobs SET status = 'cancelled', updated_at = ? "
+            "WHERE parent_id = ? AND status = 'queued'",
+            (now, job_id),
+        )
+        conn.execute(
+            "UPDATE crawl_jobs SET cancel = ? WHERE parent_id = ? AND status = 'running'",
+            (flag, job_id),
+        )
+        if conn.execute(
+            "SELECT 1 FROM crawl_jobs WHERE parent_id = ? LIMIT 1", (job_id,)
+        ).fetchone():
+            _release_parent(conn, job_id)
+        return "stopping"
+
+
+# -------------------------------------------------------------------
+# Оценка ожидания
+# -------------------------------------------------------------------
+def _item_seconds(conn) -> float:
+    """Средняя длительность парсинга в пересчёте на товар по последним задачам."""
+    rows = conn.execute(
+        "SELECT updated_at - started_at, target FROM crawl_jobs "
+        "WHERE status = 'done' AND kind = 'category' AND mode = 'full' AND started_at IS NOT NULL "
+        "AND budget IS NULL "
+        "ORDER BY job_id DESC LIMIT 20"
+    ).fetchall()
+    total = sum(target for _, target in rows)
+    if not total:
+        return CRAWL_QUEUE["default_item_seconds"]
+    return sum(seconds for seconds, _ in rows) / total
+
+
+def _capacity(conn, stale: float, interactive: bool) -> int:
+    """Живые воркеры: опрашивали очередь недавно или держат задачу с пульсом."""
+    workers = conn.execute(
+        "SELECT worker FROM crawl_workers WHERE seen >= ? AND (interactive = 0 OR ?) "
+        "UNION SELECT worker FROM crawl_jobs "
+        "WHERE status = 'running' AND COALESCE(heartbeat, updated_at) >= ?",
+        (stale, int(interactive), stale),
+    ).fetchall()
+    return max(1, len(workers))
+
+
+def estimate_wait(job_id: int) -> tuple[int, float]:
+    """
+    (задач впереди, секунд до старта) для задачи в очереди. Порядок моделируется
+    как в _pick: до k-й задачи пользователя другой пользователь успевает
+    получить ~k·(его вес / вес этого) задач того же приоритета.
+    """
+    now = time.time()
+    stale = now - CRAWL_QUEUE["stale_after"]
+    conn = _db()
+    job = get_job(job_id)
+    per_item = _item_seconds(conn)
+
+    def duration(j: dict) -> float:
+        """Браузеро-секунды задачи: многобраузерная занимает несколько мест сразу."""
+        if j["kind"] == "product":
+            return CRAWL_QUEUE["product_seconds"]
+        browsers = j["browsers"] if j["status"] == "running" else _browsers_wanted(j)
+        if j["budget"]:
+            return min(j["target"] * per_item, j["budget"]) * browsers
+        return j["target"] * per_item * browsers
+
+    others = _rows(conn.execute(
+        "SELECT * FROM crawl_jobs WHERE status IN ('queued', 'running') AND job_id != ? "
+        "AND priority <= ? ORDER BY job_id",
+        (job_id, job["priority"]),
+    ))
+
+    work, ahead = 0.0, 0
+    queued_by_chat: dict[int, list[dict]] = {}
+    for j in others:
+        if j["status"] == "running" and (j["heartbeat"] or j["updated_at"]) >= stale:
+            # идёт сейчас: оставшаяся часть по прогрессу, иначе по времени
+            if j["total"]:
+                work += duration(j) * (1 - j["done"] / j["total"])
+            else:
+                work += max(0.0, duration(j) - (now - (j["started_at"] or now)))
+        elif j["priority"] < job["priority"]:
+            ahead += 1
+            work += duration(j)
+        else:
+            queued_by_chat.setdefault(j["chat_id"], []).append(j)
+
+    own = [j for j in queued_by_chat.pop(job["chat_id"], []) if j["job_id"] < job_id]
+    k = len(own) + 1
+    for chat_id, jobs in queued_by_chat.items():
+        share = math.ceil(k * _weight(chat_id) / _weight(job["chat_id"]))
+        own.extend(jobs[:share])
+    ahead += len(own)
+    work += sum(duration(j) for j in own)
+    capacity = _capacity(conn, stale, job["priority"] == PRIORITY_INTERACTIVE)
+    return ahead, work / capacity
@@ -1,6 +1,15 @@
 import re
 from bs4 import BeautifulSoup
 
+# Артикул из ссылки: WB — /catalog/<sku>/detail.aspx, Ozon — /product/<slug>-<sku>/
+SKU_RE = re.compile(r"/catalog/(\d+)/|/product/(?:[^/?#]*?-)?(\d+)/?(?:[?#]|$)")
+
+def extract_sku(url: str) -> str:
+    m = SKU_RE.search(url or "")
+    if not m:
+        return ""
+    return m.group(1) or m.group(2)
+
 def parse_characteristics(text: str) -> dict:
     if not text:
         return {}
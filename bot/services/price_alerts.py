@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ..config import ANALYSIS_CONFIG
+from .price_history import history_db
+from .storage import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+TIME_CFG = ANALYSIS_CONFIG["time_analysis"]
+ALERT_CFG = ANALYSIS_CONFIG["price_alerts"]
+
+DAY = 86400
+
+# sku = '*' — подписка на все отслеживаемые товары
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_subscriptions (
+    chat_id  INTEGER NOT NULL,
+    sku      TEXT    NOT NULL,
+    drop_pct REAL    NOT NULL,
+    PRIMARY KEY (chat_id, sku)
+);
+-- отправленные за день алерты: повторный парсинг того же дня их не дублирует
+CREATE TABLE IF NOT EXISTS alerts_sent (
+    chat_id INTEGER NOT NULL,
+    sku     TEXT    NOT NULL,
+    day     INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, sku, day)
+);
+"""
+
+
+def _db():
+    history_db()
+    return ensure_schema("price_alerts", _SCHEMA)
+
+
+def subscribe(chat_id: int, sku: str = "*", drop_pct: float | None = None):
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO alert_subscriptions (chat_id, sku, drop_pct) VALUES (?, ?, ?)",
+            (chat_id, sku, drop_pct if drop_pct is not None else ALERT_CFG["drop_pct"]),
+        )
+
+
+def unsubscribe(chat_id: int) -> int:
+    conn = _db()
+    with conn:
+        return conn.execute("DELETE FROM alert_subscriptions WHERE chat_id = ?", (chat_id,)).rowcount
+
+
+def _load_windows(since: int, now: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Дневные цены (last) товаров, обновлённых с момента since, матрицей
+    [n_sku x (rolling_window + 1)]: последний столбец — текущий день.
+    """
+    width = TIME_CFG["rolling_window"] + 1
+    today = now // DAY * DAY
+    first = today - (width - 1) * DAY
+    rows = pd.read_sql_query(
+        """
+        SELECT r.sku, r.bucket, r.last_price
+        FROM price_rollups r
+        WHERE r.level = 'day' AND r.bucket >= ? AND r.sku IN (
+            SELECT sku FROM price_rollups WHERE level = 'day' AND bucket >= ? AND last_ts >= ?
+        )
+        """,
+        _db(),
+        params=(first, since // DAY * DAY, since),
+    )
+    codes, skus = pd.factorize(rows["sku"])
+    cols = ((rows["bucket"].to_numpy() - first) // DAY).astype(np.int64)
+    mat = np.full((len(skus), width), np.nan)
+    mat[codes, cols] = rows["last_price"].to_numpy()
+    return np.asarray(skus), mat
+
+
+def detect_price_anomalies(since: int, now: int | None = None) -> pd.DataFrame:
+    """
+    Векторный проход по всем товарам, обновлённым с момента since.
+    Алерт, если цена упала к предыдущему наблюдению больше чем на drop_pct %
+    или отклонилась от скользящего среднего за rolling_window дней больше чем
+    на zscore сигм. Возвращает sku, price, prev_price, baseline, drop_pct, zscore.
+    """
+    now = int(now or time.time())
+    skus, mat = _load_windows(since, now)
+    if not len(skus):
+        return pd.DataFrame(columns=["sku", "price", "prev_price", "baseline", "drop_pct", "zscore"])
+
+    # протягиваем последнее известное значение вперёд (дни без наблюдений)
+    filled = pd.DataFrame(mat).ffill(axis=1).to_numpy()
+    price = filled[:, -1]
+    prev = filled[:, -2]
+
+    history = mat[:, :-1]
+    enough = np.count_nonzero(~np.isnan(history), axis=1) >= TIME_CFG["min_periods"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        baseline = np.nanmean(history, axis=1)
+        std = np.nanstd(history, axis=1)
+        drop_pct = (prev - price) / prev * 100
+        zscore = np.where(std > 0, (price - baseline) / std, 0.0)
+
+    drop_pct = np.nan_to_num(drop_pct, nan=0.0)
+    zscore = np.where(enough, np.nan_to_num(zscore, nan=0.0), 0.0)
+    hit = (drop_pct > 0) | (np.abs(zscore) >= ALERT_CFG["zscore"])
+    return pd.DataFrame({
+        "sku": skus[hit],
+        "price": price[hit],
+        "prev_price": prev[hit],
+        "baseline": baseline[hit],
+        "drop_pct": drop_pct[hit],
+        "zscore": zscore[hit],
+    })
+
+
+def _route_alerts(alerts: pd.DataFrame, now: int | None = None) -> dict[int, list[str]]:
+    """
+    Сопоставляет алерты с подписками: chat_id -> строки сообщения.
+    Товар, о котором чат уже получил алерт сегодня, пропускается; новые — запоминаются.
+    """
+    conn = _db()
+    subs = pd.read_sql_query("SELECT chat_id, sku, drop_pct AS threshold FROM alert_subscriptions", conn)
+    if subs.empty or alerts.empty:
+        return {}
+    direct = alerts.merge(subs[subs["sku"] != "*"], on="sku")
+    wildcard = alerts.merge(subs[subs["sku"] == "*"].drop(columns="sku"), how="cross")
+    routed = pd.concat([direct, wildcard], ignore_index=True)
+    routed = routed[
+        (routed["drop_pct"] >= routed["threshold"]) | (routed["zscore"].abs() >= ALERT_CFG["zscore"])
+    ].drop_duplicates(["chat_id", "sku"])
+
+    day = int(now or time.time()) // DAY * DAY
+    sent = set(conn.execute("SELECT chat_id, sku FROM alerts_sent WHERE day = ?", (day,)).fetchall())
+    fresh = [(int(c), s) not in sent for c, s in zip(routed["chat_id"], routed["sku"])]
+    routed = routed[fresh]
+    with conn:
+        conn.execute("DELETE FROM alerts_sent WHERE day < ?", (day,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO alerts_sent (chat_id, sku, day) VALUES (?, ?, ?)",
+            [(int(c), s, day) for c, s in zip(routed["chat_id"], routed["sku"])],
+        )
+    if routed.empty:
+        return {}
+
+    routed["line"] = (
+        "• " + routed["sku"] + ": " + routed["prev_price"].round(0).astype("Int64").astype(str)
+        + " → " + routed["price"].round(0).astype("Int64").astype(str)
+        + " (" + (-routed["drop_pct"]).round(1).astype(str) + " %, z="
+        + routed["zscore"].round(1).astype(str) + ")"
+    )
+    return routed.groupby("chat_id")["line"].apply(list).to_dict()
+
+
+async def notify_price_alerts(bot, alerts: pd.DataFrame):
+    """Рассылает алерты подписчикам: по сообщению на пачку строк, отправки пачками."""
+    routed = await asyncio.to_thread(_route_alerts, alerts)
+    per_msg = ALERT_CFG["lines_per_message"]
+    messages = [
+        (chat_id, "🔔 Изменения цен:\n\n" + "\n".join(lines[i:i + per_msg]))
+        for chat_id, lines in routed.items()
+        for i in range(0, len(lines), per_msg)
+    ]
+    batch = ALERT_CFG["send_batch"]
+    for i in range(0, len(messages), batch):
+        results = await asyncio.gather(
+            *(bot.send_message(chat_id, text) for chat_id, text in messages[i:i + batch]),
+            return_exceptions=True,
+        )
+        for res in results:
+            if isinstance(res, Exception):
+                logger.warning(f"Не удалось отправить алерт: {res}")
+        if i + batch < len(messages):
+            await asyncio.sleep(ALERT_CFG["send_pause"])
+    return len(messages)
+
+
+async def check_price_alerts(bot, since: int) -> int:
+    """Запускается после каждой пачки мониторинга: детект + рассылка."""
+    alerts = await asyncio.to_thread(detect_price_anomalies, since)
+    if alerts.empty:
+        return 0
+    logger.info(f"Найдено ценовых аномалий: {len(alerts)}")
+    return await notify_price_alerts(bot, alerts)
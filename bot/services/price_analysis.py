@@ -1,39 +1,53 @@
 import os
 from datetime import datetime
 
-import matplotlib.pyplot as plt
 import pandas as pd
-from aiogram import types
+from aiogram import Bot
 
 from ..config import REPORTS_DIR
-
-async def create_price_analysis(message: types.Message, df: pd.DataFrame, category: str):
+from .charts import render_chart
+from .file_ids import send_file_to
+from .sampling import SampleEstimate
+from .sketches import PriceSketch
+
+async def create_price_analysis(bot: Bot, chat_id: int, df: pd.DataFrame, category: str,
+                                sketch: PriceSketch | None = None,
+                                estimate: SampleEstimate | None = None):
     os.makedirs(REPORTS_DIR, exist_ok=True)
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     fn = f"price_analysis_{category}_{ts}.png"
     path = os.path.join(REPORTS_DIR, fn)
 
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 12))
-    ax1.hist(df["price_clean"], bins=30, alpha=0.7)
-    ax1.set(title="Распределение цен", xlabel="Цена", ylabel="Кол‑во")
-    ax1.grid(alpha=0.3)
-
-    stats = (
-        f"Min: {df['price_clean'].min():.2f}\n"
-        f"Max: {df['price_clean'].max():.2f}\n"
-        f"Mean: {df['price_clean'].mean():.2f}\n"
-        f"Median: {df['price_clean'].median():.2f}"
-    )
-    ax1.text(0.95, 0.95, stats,
-             transform=ax1.transAxes, va="top", ha="right",
-             bbox=dict(boxstyle="round", facecolor="white", alpha=0.8))
-
-    ax2.scatter(df["rating"], df["price_clean"], alpha=0.5)
-    ax2.set(title="Цена vs Рейтинг", xlabel="Рейтинг", ylabel="Цена")
-    ax2.grid(alpha=0.3)
-
-    plt.tight_layout()
-    plt.savefig(path, dpi=300, bbox_inches="tight")
-    plt.close()
-
-    await message.reply_document(path, caption="📈 Анализ цен в категории")
+    if estimate is not None:
+        # выборка: оценки по категории с доверительными интервалами,
+        # гистограмма в оценённом числе товаров
+        counts, edges = estimate.histogram(bins=30)
+        stats = estimate.summary()
+        caption = "📈 Анализ цен в категории (по выборке)"
+    else:
+        # статистика и гистограмма — из сливаемого скетча, а не по всей колонке
+        if sketch is None:
+            sketch = PriceSketch().update(df["price_clean"].to_numpy())
+        counts, edges = sketch.histogram(bins=30)
+        stats = (
+            f"Min: {sketch.min:.2f}\n"
+            f"Max: {sketch.max:.2f}\n"
+            f"Mean: {sketch.mean:.2f}\n"
+            f"Median: {sketch.median:.2f}"
+        )
+        caption = "📈 Анализ цен в категории"
+    rating = pd.to_numeric(df["rating"], errors="coerce") if "rating" in df else pd.Series(float("nan"), index=df.index)
+    png = await render_chart({
+        "figsize": (12, 12),
+        "dpi": 300,
+        "panels": [
+            {"kind": "bars", "counts": counts, "edges": edges, "alpha": 0.7, "text": stats,
+             "title": "Распределение цен", "xlabel": "Цена", "ylabel": "Кол‑во"},
+            {"kind": "scatter", "x": rating.to_numpy(), "y": df["price_clean"].to_numpy(),
+             "alpha": 0.5, "title": "Цена vs Рейтинг", "xlabel": "Рейтинг", "ylabel": "Цена"},
+        ],
+    })
+    with open(path, "wb") as f:
+        f.write(png)
+
+    await send_file_to(bot, chat_id, "document", data=png, filename=fn, caption=caption)
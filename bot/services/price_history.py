@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import time
+
+import pandas as pd
+
+from ..config import ANALYSIS_CONFIG
+from .parsers import SKU_RE
+from .storage import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+TIME_CFG = ANALYSIS_CONFIG["time_analysis"]
+
+# Уровни агрегации: имя -> шаг в секундах (от мелкого к крупному)
+ROLLUP_LEVELS = {
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+}
+# 1970-01-01 — четверг, сдвиг выравнивает недели на понедельник
+_WEEK_OFFSET = 3 * 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_points (
+    sku         TEXT    NOT NULL,
+    marketplace TEXT    NOT NULL,
+    ts          INTEGER NOT NULL,
+    price       REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_price_points_sku_ts ON price_points (sku, ts);
+CREATE INDEX IF NOT EXISTS idx_price_points_ts ON price_points (ts);
+
+CREATE TABLE IF NOT EXISTS price_rollups (
+    level      TEXT    NOT NULL,
+    sku        TEXT    NOT NULL,
+    bucket     INTEGER NOT NULL,
+    min_price  REAL    NOT NULL,
+    max_price  REAL    NOT NULL,
+    sum_price  REAL    NOT NULL,
+    cnt        INTEGER NOT NULL,
+    last_price REAL    NOT NULL,
+    last_ts    INTEGER NOT NULL,
+    PRIMARY KEY (level, sku, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_price_rollups_bucket ON price_rollups (level, bucket);
+"""
+
+_UPSERT_ROLLUP = """
+INSERT INTO price_rollups
+    (level, sku, bucket, min_price, max_price, sum_price, cnt, last_price, last_ts)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (level, sku, bucket) DO UPDATE SET
+    min_price  = MIN(min_price, excluded.min_price),
+    max_price  = MAX(max_price, excluded.max_price),
+    sum_price  = sum_price + excluded.sum_price,
+    cnt        = cnt + excluded.cnt,
+    last_price = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_price ELSE last_price END,
+    last_ts    = MAX(last_ts, excluded.last_ts)
+"""
+
+
+def history_db():
+    return ensure_schema("price_history", _SCHEMA)
+
+
+def _bucket(ts: pd.Series, level: str) -> pd.Series:
+    step = ROLLUP_LEVELS[level]
+    if level == "week":
+        return (ts + _WEEK_OFFSET) // step * step - _WEEK_OFFSET
+    return ts // step * step
+
+
+def record_prices(points: pd.DataFrame) -> int:
+    """
+    Сохраняет наблюдения (колонки sku, marketplace, ts, price) и инкрементально
+    обновляет часовые/дневные/недельные агрегаты. Возвращает число точек.
+    """
+    points = points.dropna(subset=["sku", "price"])
+    points = points[(points["sku"] != "") & (points["price"] > 0)]
+    if points.empty:
+        return 0
+    points = points.astype({"ts": "int64", "price": "float64"}).sort_values("ts")
+
+    conn = history_db()
+    with conn:
+        conn.executemany(
+            "INSERT INTO price_points (sku, marketplace, ts, price) VALUES (?, ?, ?, ?)",
+            points[["sku", "marketplace", "ts", "price"]].itertuples(index=False, name=None),
+        )
+        # Пачку сначала сворачиваем в pandas, в БД уходит по строке на бакет
+        for level in ROLLUP_LEVELS:
+            agg = (
+                points.assign(bucket=_bucket(points["ts"], level))
+                .groupby(["sku", "bucket"], sort=False)
+                .agg(
+                    min_price=("price", "min"),
+                    max_price=("price", "max"),
+                    sum_price=("price", "sum"),
+                    cnt=("price", "size"),
+                    last_price=("price", "last"),
+                    last_ts=("ts", "max"),
+                )
+                .reset_index()
+            )
+            agg.insert(0, "level", level)
+            conn.executemany(
+                _UPSERT_ROLLUP,
+                (
+                    (r.level, r.sku, int(r.bucket), r.min_price, r.max_price,
+                     r.sum_price, int(r.cnt), r.last_price, int(r.last_ts))
+                    for r in agg.itertuples(index=False)
+                ),
+            )
+    return len(points)
+
+
+def record_observations(df: pd.DataFrame, marketplace: str) -> int:
+    """Берёт из результата парсинга артикул (по url) и price_clean и пишет в историю."""
+    if df is None or "url" not in df or "price_clean" not in df:
+        return 0
+    sku = df["url"].astype(str).str.extract(SKU_RE)
+    now = int(time.time())
+    if "parsed_at" in df:
+        ts = pd.to_datetime(df["parsed_at"], errors="coerce")
+        ts = (ts.view("int64") // 10**9).where(ts.notna(), now)
+    else:
+        ts = now
+    points = pd.DataFrame({
+        "sku": sku[0].fillna(sku[1]),
+        "marketplace": marketplace,
+        "ts": ts,
+        "price": pd.to_numeric(df["price_clean"], errors="coerce"),
+    })
+    n = record_prices(points)
+    logger.info(f"В историю цен записано {n} наблюдений ({marketplace})")
+    return n
+
+
+def pick_resolution(start: int, end: int, max_points: int | None = None) -> str:
+    """
+    Самое крупное разрешение, которого хватает: первое (от мелкого) разрешение,
+    дающее не больше max_points точек и ещё не удалённое политикой хранения.
+    """
+    max_points = max_points or TIME_CFG["max_points"]
+    now = time.time()
+    span = max(end - start, 1)
+    # сырые наблюдения приходят не чаще раза в минуту
+    if start >= now - TIME_CFG["raw_retention_days"] * 86400 and span <= max_points * 60:
+        return "raw"
+    for level, step in ROLLUP_LEVELS.items():
+        if level == "hour" and start < now - TIME_CFG["hourly_retention_days"] * 86400:
+            continue
+        if span / step <= max_points:
+            return level
+    return "week"
+
+
+def get_price_history(skus, start: int | None = None, end: int | None = None,
+                      max_points: int | None = None) -> pd.DataFrame:
+    """
+    История цен по одному или нескольким артикулам за [start, end].
+    Окно по умолчанию — TIME_CFG["default_range_days"]. Колонки:
+    sku, ts, min, max, mean, last, resolution.
+    """
+    if isinstance(skus, str):
+        skus = [skus]
+    skus = list(skus)
+    end = int(end or time.time())
+    start = int(start or end - TIME_CFG["default_range_days"] * 86400)
+    level = pick_resolution(start, end, max_points)
+    marks = ",".join("?" * len(skus))
+    if level == "raw":
+        sql = (
+            f"SELECT sku, ts, price AS min, price AS max, price AS mean, price AS last "
+            f"FROM price_points WHERE sku IN ({marks}) AND ts BETWEEN ? AND ? ORDER BY sku, ts"
+        )
+        params = [*skus, start, end]
+    else:
+        sql = (
+            f"SELECT sku, bucket AS ts, min_price AS min, max_price AS max, "
+            f"sum_price / cnt AS mean, last_price AS last "
+            f"FROM price_rollups WHERE level = ? AND sku IN ({marks}) AND bucket BETWEEN ? AND ? "
+            f"ORDER BY sku, bucket"
+        )
+        params = [level, *skus, int(_bucket(pd.Series([start]), level)[0]), end]
+    df = pd.read_sql_query(sql, history_db(), params=params)
+    df["resolution"] = level
+    return df
+
+
+def apply_retention(now: int | None = None) -> dict:
+    """Удаляет сырые точки и часовые агрегаты старше настроенного срока."""
+    now = int(now or time.time())
+    raw_cutoff = now - TIME_CFG["raw_retention_days"] * 86400
+    hour_cutoff = now - TIME_CFG["hourly_retention_days"] * 86400
+    conn = history_db()
+    with conn:
+        raw = conn.execute("DELETE FROM price_points WHERE ts < ?", (raw_cutoff,)).rowcount
+        hourly = conn.execute(
+            "DELETE FROM price_rollups WHERE level = 'hour' AND bucket < ?", (hour_cutoff,)
+        ).rowcount
+    return {"raw": raw, "hour": hourly}
+
+
+async def price_history_maintenance():
+    """Фоновая задача: периодически применяет политику хранения."""
+    while True:
+        try:
+            removed = await asyncio.to_thread(apply_retention)
+            if any(removed.values()):
+                logger.info(f"Очистка истории цен: {removed}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки истории цен: {e}")
+        await asyncio.sleep(TIME_CFG["retention_interval"])
@@ -0,0 +1,67 @@
+import pandas as pd
+
+# Колонки с ценами, которые парсеры отдают строками вида "1 299 ₽"
+PRICE_COLUMNS = ("price", "final_price", "wallet_price", "old_price")
+
+# Разделители разрядов: \s в str-шаблонах ловит и неразрывный (U+00A0),
+# и узкий (U+202F), и тонкий (U+2009) пробелы; плюс апостроф
+_THOUSANDS_RE = r"[\s']"
+_NUMBER_RE = r"(\d+(?:\.\d+)?)"
+# Цена с символом валюты внутри произвольного текста ("от 1 000 ₽ до 1 500 ₽")
+_CURRENCY_PRICE_RE = r"(\d[\d\s]*(?:[.,]\d+)?)\s*(?:₽|руб)"
+
+
+def parse_price_series(s: pd.Series) -> pd.Series:
+    """
+    Векторно переводит строки цен в float: "1 299 ₽" -> 1299.0,
+    "1 299,50 ₽" -> 1299.5. Пустые и нечисловые значения — NaN.
+    """
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype("float64")
+    txt = s.astype("string").str.replace(_THOUSANDS_RE, "", regex=True)
+    # в рублёвых ценах запятая — десятичный разделитель
+    txt = txt.str.replace(",", ".", regex=False)
+    num = txt.str.extract(_NUMBER_RE, expand=False)
+    return pd.to_numeric(num, errors="coerce").astype("float64")
+
+
+def parse_price_range(s: pd.Series) -> pd.DataFrame:
+    """
+    Из текста истории цены (dict {"current", "range"} или его строковое
+    представление из Excel) достаёт минимальную и максимальную цену.
+    """
+    # пустая колонка из файла читается как float — у неё нет .str
+    s = s.astype(object)
+    ranges = s.str.get("range").where(s.map(type) == dict, s).astype("string")
+    found = ranges.str.extractall(_CURRENCY_PRICE_RE)[0]
+    values = parse_price_series(found).groupby(level=0)
+    return pd.DataFrame({"min": values.min(), "max": values.max()}).reindex(s.index)
+
+
+def normalize_prices(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Единый этап нормализации цен: все ценовые колонки становятся числовыми,
+    price_clean заполняется из price (или final_price), из price_history
+    выделяются price_history_min / price_history_max. Повторный вызов ничего не делает.
+    """
+    if df.attrs.get("prices_normalized"):
+        return df
+    df = df.copy()
+    for col in PRICE_COLUMNS:
+        if col in df:
+            df[col] = parse_price_series(df[col])
+
+    clean = parse_price_series(df["price_clean"]) if "price_clean" in df else None
+    for col in ("price", "final_price"):
+        if col in df:
+            clean = df[col] if clean is None else clean.where(clean > 0, df[col])
+    if clean is not None:
+        df["price_clean"] = clean
+
+    if "price_history" in df and "price_history_min" not in df:
+        rng = parse_price_range(df["price_history"])
+        df["price_history_min"] = rng["min"]
+        df["price_history_max"] = rng["max"]
+
+    df.attrs["prices_normalized"] = True
+    return df
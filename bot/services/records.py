@@ -0,0 +1,136 @@
+"""
+Компактные записи товаров для парсинга категорий.
+
+Вместо словаря на товар (десятки ключей плюс вложенные копии
+характеристик) — объект со __slots__. Характеристики хранятся как кортежи
+номеров ключей из общих таблиц и значений, DataFrame и длинная таблица
+характеристик собираются сразу по колонкам.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .characteristics import LONG_COLUMNS
+from .parsers import extract_sku
+
+
+class KeyTable:
+    """Общая таблица интернированных ключей: строка -> номер, один экземпляр строки."""
+
+    def __init__(self):
+        self.keys: list[str] = []
+        self._ids: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def intern(self, key: str) -> int:
+        key_id = self._ids.get(key)
+        if key_id is None:
+            with self._lock:
+                key_id = self._ids.setdefault(key, len(self.keys))
+                if key_id == len(self.keys):
+                    self.keys.append(key)
+        return key_id
+
+
+# Таблицы общие для всех парсингов процесса: ключи в категориях повторяются.
+# Ключи характеристик и параметров — в одной таблице.
+KEYS = KeyTable()
+GROUPS = KeyTable()
+
+
+def _value(v) -> str:
+    return "; ".join(map(str, v)) if isinstance(v, list) else str(v)
+
+
+class ProductRecord:
+    """Товар из выдачи категории, дополненный данными со страницы товара."""
+
+    # Скалярные поля = колонки DataFrame, в порядке выгрузки
+    FIELDS = (
+        "sku", "title", "price", "url", "full_title", "final_price", "wallet_price",
+        "old_price", "price_history", "description", "detail_images",
+    )
+    __slots__ = FIELDS + ("char_ids", "char_values", "param_groups", "param_ids", "param_values")
+
+    def __init__(self, title: str = "", price: str = "", url: str = ""):
+        self.sku = extract_sku(url)
+        self.title = title
+        self.price = price
+        self.url = url
+        self.full_title = self.final_price = self.wallet_price = self.old_price = None
+        self.price_history = self.description = self.detail_images = None
+        self.char_ids = self.char_values = ()
+        self.param_groups = self.param_ids = self.param_values = ()
+
+    def update(self, info: dict):
+        """
+        Переносит поля из словаря get_full_product_info. Характеристики и
+        параметры становятся номерами ключей; их плоские копии
+        (extracted_*, сырой текст characteristics) не сохраняются.
+        """
+        for name in self.FIELDS:
+            if name in info:
+                setattr(self, name, info[name])
+        chars = info.get("characteristics_parsed") or {}
+        self.char_ids = tuple(KEYS.intern(k) for k in chars)
+        self.char_values = tuple(_value(v) for v in chars.values())
+        groups, ids = [], []
+        for k in info.get("parameters") or {}:
+            group, key = k.split(".", 1) if "." in k else ("", k)
+            groups.append(GROUPS.intern(group))
+            ids.append(KEYS.intern(key))
+        self.param_groups, self.param_ids = tuple(groups), tuple(ids)
+        self.param_values = tuple(_value(v) for v in (info.get("parameters") or {}).values())
+
+    def characteristics(self) -> dict:
+        return dict(zip((KEYS.keys[i] for i in self.char_ids), self.char_values))
+
+
+def record_key(record: ProductRecord) -> str:
+    """Ключ товара для дедупликации: артикул, а без него ссылка."""
+    return record.sku or record.url
+
+
+def _skus(records: list[ProductRecord]) -> list[str]:
+    # без артикула в ссылке товар опознаётся по номеру в выдаче
+    return [r.sku or str(n) for n, r in enumerate(records)]
+
+
+def records_to_frame(records: list[ProductRecord]) -> pd.DataFrame:
+    """DataFrame по колонкам: один список на поле, без промежуточных словарей."""
+    columns = {name: [getattr(r, name) for r in records] for name in ProductRecord.FIELDS}
+    columns["sku"] = _skus(records)
+    return pd.DataFrame(columns, columns=list(ProductRecord.FIELDS))
+
+
+def _codes(records, attr: str) -> np.ndarray:
+    return np.fromiter((i for r in records for i in getattr(r, attr)), dtype=np.int32)
+
+
+def records_characteristics(records: list[ProductRecord]) -> pd.DataFrame:
+    """
+    Длинная таблица (sku, group, key, value) из записей: категориальные
+    колонки строятся прямо из номеров общих таблиц (from_codes), без строк.
+    """
+    skus = _skus(records)
+    char_counts = [len(r.char_ids) for r in records]
+    param_counts = [len(r.param_ids) for r in records]
+    sku_cat = pd.Categorical(skus)
+    sku_codes = np.concatenate([
+        np.repeat(sku_cat.codes, char_counts),
+        np.repeat(sku_cat.codes, param_counts),
+    ])
+    key_codes = np.concatenate([_codes(records, "char_ids"), _codes(records, "param_ids")])
+    group_codes = np.concatenate([
+        np.full(sum(char_counts), GROUPS.intern(""), dtype=np.int32),
+        _codes(records, "param_groups"),
+    ])
+    values = [v for r in records for v in r.char_values] + [v for r in records for v in r.param_values]
+    # снимки таблиц берём после кодов: параллельный парсинг может их дополнять
+    return pd.DataFrame({
+        "sku": pd.Categorical.from_codes(sku_codes, categories=sku_cat.categories),
+        "group": pd.Categorical.from_codes(group_codes, categories=list(GROUPS.keys)),
+        "key": pd.Categorical.from_codes(key_codes, categories=list(KEYS.keys)),
+        "value": pd.array(values, dtype="string"),
+    }, columns=LONG_COLUMNS)
@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from ..config import ANALYSIS_CONFIG, REPORT_CACHE, REPORTS_DIR
+from .charts import render_chart
+
+logger = logging.getLogger(__name__)
+
+
+class NoReportData(Exception):
+    """Для отчёта нет нужных данных; текст исключения — ответ пользователю."""
+
+
+def report_key(dataset_hash: str, command: str, params: dict | None = None,
+               style: dict | None = None) -> str:
+    """Ключ отчёта: (хэш датасета, команда, параметры, стиль графиков)."""
+    payload = json.dumps(
+        [dataset_hash, command, params or {}, style or ANALYSIS_CONFIG["charts"]],
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _paths(command: str, key: str) -> tuple[Path, Path]:
+    png = Path(REPORTS_DIR) / f"{command}_{key[:24]}.png"
+    return png, png.with_suffix(".json")
+
+
+def lookup(command: str, key: str) -> tuple[Path, str] | None:
+    png, meta = _paths(command, key)
+    if not png.exists():
+        return None
+    caption = ""
+    if meta.exists():
+        caption = json.loads(meta.read_text(encoding="utf-8")).get("caption", "")
+    # mtime — метка последнего использования для вытеснения
+    os.utime(png)
+    return png, caption
+
+
+def store(command: str, key: str, png_bytes: bytes, caption: str = "") -> Path:
+    png, meta = _paths(command, key)
+    os.makedirs(png.parent, exist_ok=True)
+    tmp = png.with_suffix(".tmp")
+    tmp.write_bytes(png_bytes)
+    os.replace(tmp, png)
+    meta.write_text(json.dumps({"caption": caption}, ensure_ascii=False), encoding="utf-8")
+    evict()
+    return png
+
+
+def evict(max_bytes: int | None = None) -> int:
+    """Удаляет давно не использованные отчёты, пока кэш не влезет в лимит."""
+    max_bytes = max_bytes or REPORT_CACHE["max_bytes"]
+    files = sorted(Path(REPORTS_DIR).glob("*.png"), key=lambda f: f.stat().st_mtime)
+    total = sum(f.stat().st_size for f in files)
+    removed = 0
+    for f in files:
+        if total <= max_bytes:
+            break
+        total -= f.stat().st_size
+        f.unlink(missing_ok=True)
+        f.with_suffix(".json").unlink(missing_ok=True)
+        removed += 1
+    if removed:
+        logger.info(f"Из кэша отчётов удалено файлов: {removed}")
+    return removed
+
+
+async def cached_report(dataset_hash: str, command: str, params: dict | None,
+                        build: Callable[[], Awaitable[tuple[dict, str]]]) -> tuple[Path, str]:
+    """
+    Готовый отчёт из кэша или новый: build() возвращает (спецификация графика,
+    подпись) и вызывается только при промахе. Путь уникален для ключа, поэтому
+    одновременные запросы разных пользователей не перетирают файлы друг друга.
+    """
+    key = report_key(dataset_hash, command, params)
+    hit = await asyncio.to_thread(lookup, command, key)
+    if hit:
+        return hit
+    spec, caption = await build()
+    png = await render_chart(spec)
+    path = await asyncio.to_thread(store, command, key, png, caption)
+    return path, caption
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from ..config import RETENTION
+
+logger = logging.getLogger(__name__)
+
+
+def _units(directory: Path) -> list[tuple[float, int, list[Path]]]:
+    """
+    Файлы папки, сгруппированные по имени без расширения: PNG отчёта и его
+    .json с подписью, HTML-дамп и его метаданные удаляются вместе.
+    Возвращает (последнее изменение, общий размер, файлы), старые первыми.
+    """
+    groups = defaultdict(list)
+    for f in directory.iterdir():
+        if f.is_file() and not f.name.endswith(".part"):
+            groups[f.stem].append(f)
+    units = []
+    for files in groups.values():
+        stats = [f.stat() for f in files]
+        units.append((max(s.st_mtime for s in stats), sum(s.st_size for s in stats), files))
+    units.sort(key=lambda u: u[0])
+    return units
+
+
+def _sweep_parts(directory: Path) -> int:
+    """Недокачанные загрузки: .part, который давно не пишется, уже не допишется."""
+    cutoff = time.time() - RETENTION["part_grace"]
+    removed = 0
+    for f in directory.glob("*.part"):
+        if f.is_file() and f.stat().st_mtime < cutoff:
+            f.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def sweep_dir(directory: str | Path, max_age_days: float | None = None,
+              max_bytes: int | None = None) -> int:
+    """Удаляет файлы старше max_age_days, затем самые старые сверх max_bytes."""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return 0
+    removed = _sweep_parts(directory)
+    units = _units(directory)
+    total = sum(size for _, size, _ in units)
+    cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+    for mtime, size, files in units:
+        too_old = cutoff is not None and mtime < cutoff
+        too_big = max_bytes is not None and total > max_bytes
+        if not (too_old or too_big):
+            break
+        for f in files:
+            f.unlink(missing_ok=True)
+        total -= size
+        removed += len(files)
+    return removed
+
+
+def apply_retention() -> dict[str, int]:
+    """Один проход очистки по всем папкам из RETENTION["dirs"]."""
+    return {
+        str(directory): sweep_dir(directory, **limits)
+        for directory, limits in RETENTION["dirs"].items()
+    }
+
+
+async def retention_loop():
+    """Фоновая задача: периодически чистит папки с данными."""
+    while True:
+        try:
+            removed = await asyncio.to_thread(apply_retention)
+            if any(removed.values()):
+                logger.info(f"Очистка файлов: {removed}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки файлов: {e}")
+        await asyncio.sleep(RETENTION["interval"])
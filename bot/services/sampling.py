@@ -0,0 +1,311 @@
+"""
+Выборочный парсинг категории для быстрой картины цен.
+
+Вместо всей выдачи читаются несколько случайных страниц из каждой страты —
+равного диапазона страниц пагинации (и, по настройке, ценового диапазона
+через фильтр маркетплейса). Страница — кластер товаров: оценки средней и
+квантилей цены строятся по стратифицированной кластерной выборке с весами
+страт M_h / ΣM (M_h — число страниц страты), доверительные интервалы —
+аналитически для среднего и стратифицированным бутстрепом по страницам
+для квантилей. Детали собираются только для случайного подмножества,
+распределённого по стратам пропорционально их весу.
+"""
+import logging
+import math
+import random
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+from ..config import CRAWL_SAMPLE
+from .cancellation import check_cancelled
+from .job_queue import set_progress
+from .records import ProductRecord
+from .selenium_utils import get_webdriver
+
+logger = logging.getLogger(__name__)
+
+
+def with_query(url: str, **params) -> str:
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({k: str(v) for k, v in params.items()})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def listing_pages(driver, base: str, read_page):
+    """
+    cards(page) -> записи страницы выдачи base, каждая страница читается один
+    раз. За последней страницей маркетплейс может отдать первую — такая
+    страница считается пустой.
+    """
+    cache: dict[int, list[ProductRecord]] = {}
+
+    def cards(page: int) -> list[ProductRecord]:
+        if page not in cache:
+            check_cancelled()
+            cache[page] = read_page(driver, with_query(base, page=page))
+            if page > 1 and cache[page] and 1 in cache and cache[1] \
+                    and cache[page][0].url == cache[1][0].url:
+                cache[page] = []
+        return cache[page]
+
+    return cards
+
+
+# -------------------------------------------------------------------
+# План выборки
+# -------------------------------------------------------------------
+def find_last_page(has_cards, max_pages: int) -> int:
+    """Последняя непустая страница выдачи бинарным поиском (≈log2(max_pages) загрузок)."""
+    if not has_cards(1):
+        return 0
+    if has_cards(max_pages):
+        return max_pages
+    lo, hi = 1, max_pages
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if has_cards(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def plan_pages(last_page: int, strata: int, per_stratum: int,
+               rng: random.Random) -> list[tuple[int, list[int]]]:
+    """Делит страницы 1..last_page на равные диапазоны: [(страниц в страте, выбранные)]."""
+    strata = max(1, min(strata, last_page))
+    bounds = np.linspace(1, last_page + 1, strata + 1).round().astype(int)
+    plan = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        pages = list(range(lo, hi))
+        if pages:
+            plan.append((len(pages), sorted(rng.sample(pages, min(per_stratum, len(pages))))))
+    return plan
+
+
+def allocate(weights: list[float], total: int) -> list[int]:
+    """Пропорциональное распределение total по стратам (метод наибольших остатков)."""
+    if not weights or total <= 0:
+        return [0] * len(weights)
+    shares = [w / sum(weights) * total for w in weights]
+    counts = [math.floor(s) for s in shares]
+    for i in sorted(range(len(shares)), key=lambda i: counts[i] - shares[i])[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+# -------------------------------------------------------------------
+# Выборка и оценки
+# -------------------------------------------------------------------
+class CategorySample:
+    """Товары выборки с номером страты и страницы у каждого."""
+
+    def __init__(self):
+        self.records: list[ProductRecord] = []
+        self.stratum: list[int] = []
+        self.page: list[int] = []
+        self.pages_total: list[int] = []
+        self.pages_sampled: list[int] = []
+        self.detailed = 0
+
+    def add_stratum(self, pages_total: int, pages_sampled: int) -> int:
+        self.pages_total.append(pages_total)
+        self.pages_sampled.append(pages_sampled)
+        return len(self.pages_total) - 1
+
+    def add(self, record: ProductRecord, stratum: int, page: int):
+        self.records.append(record)
+        self.stratum.append(stratum)
+        self.page.append(page)
+
+    def weights(self) -> np.ndarray:
+        total = np.asarray(self.pages_total, dtype=float)
+        return total / total.sum()
+
+    def pick_details(self, size: int, rng: random.Random) -> list[int]:
+        """Индексы записей для сбора деталей: случайно внутри страт, пропорционально весам."""
+        by_stratum: dict[int, list[int]] = {}
+        for i, (h, r) in enumerate(zip(self.stratum, self.records)):
+            if r.url:
+                by_stratum.setdefault(h, []).append(i)
+        strata = sorted(by_stratum)
+        counts = allocate([self.pages_total[h] for h in strata], size)
+        chosen = []
+        for h, n in zip(strata, counts):
+            chosen += rng.sample(by_stratum[h], min(n, len(by_stratum[h])))
+        return sorted(chosen)
+
+    def estimate(self, prices: np.ndarray) -> "SampleEstimate":
+        return SampleEstimate(self, prices)
+
+
+def _weighted_quantile(values: np.ndarray, weights: np.ndarray, q: float) -> float:
+    if not len(values):
+        return math.nan
+    order = np.argsort(values)
+    cum = np.cumsum(weights[order])
+    return float(values[order][np.searchsorted(cum, q * cum[-1])])
+
+
+def _t_quantile(df: int, z: float = 1.96) -> float:
+    """Квантиль 0.975 распределения Стьюдента (разложение Корниша — Фишера)."""
+    return z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+
+
+class SampleEstimate:
+    """Оценки цен категории по выборке и их 95% доверительные интервалы."""
+
+    def __init__(self, sample: CategorySample, prices: np.ndarray):
+        prices = np.asarray(prices, dtype=float)
+        ok = np.isfinite(prices)
+        self.sample = sample
+        self.prices = prices[ok]
+        self.stratum = np.asarray(sample.stratum)[ok]
+        self.page = np.asarray(sample.page)[ok]
+        self.W = sample.weights()
+        # товар с одной из m_h выбранных страниц представляет M_h / m_h страниц
+        expand = np.asarray(sample.pages_total) / np.asarray(sample.pages_sampled)
+        self.item_weights = expand[self.stratum]
+        # страница -> индексы её товаров, по стратам
+        self.clusters: list[list[np.ndarray]] = []
+        for h in range(len(sample.pages_total)):
+            in_h = np.flatnonzero(self.stratum == h)
+            pages = np.unique(self.page[in_h])
+            self.clusters.append([in_h[self.page[in_h] == p] for p in pages])
+
+    @property
+    def empty(self) -> bool:
+        """Ни одна цена выборки не разобралась: оценивать нечего."""
+        return not len(self.prices)
+
+    def mean(self) -> tuple[float, float]:
+        """Среднее и полуширина интервала (nan, если в страте меньше двух страниц)."""
+        if self.empty:
+            return math.nan, math.nan
+        est, var = 0.0, 0.0
+        for h, pages in enumerate(self.clusters):
+            if not pages:
+                continue
+            y = np.array([self.prices[idx].sum() for idx in pages])
+            n = np.array([len(idx) for idx in pages], dtype=float)
+            ratio = y.sum() / n.sum()
+            est += self.W[h] * ratio
+            m, f = len(pages), len(pages) / self.sample.pages_total[h]
+            if m < 2:
+                var = math.nan
+                continue
+            # дисперсия отношения для кластерной выборки страниц
+            resid = y - ratio * n
+            var += self.W[h] ** 2 * (1 - f) * resid.var(ddof=1) / (m * n.mean() ** 2)
+        if var != var:
+            return est, math.nan
+        # страниц в выборке мало: интервал по Стьюденту с Σ(m_h - 1) степенями свободы
+        df = sum(len(pages) - 1 for pages in self.clusters if pages)
+        if not df:
+            return est, math.nan
+        return est, _t_quantile(df) * math.sqrt(var)
+
+    def quantile(self, q: float, rng: random.Random, rounds: int | None = None) -> tuple[float, float, float]:
+        """
+        Квантиль и интервал стратифицированным бутстрепом по страницам
+        (Рао — Ву: m_h - 1 страниц из m_h, иначе при двух страницах на страту
+        разброс занижается вдвое).
+        """
+        if self.empty:
+            return math.nan, math.nan, math.nan
+        point = _weighted_quantile(self.prices, self.item_weights, q)
+        rounds = rounds or CRAWL_SAMPLE["bootstrap"]
+        boot = []
+        for _ in range(rounds):
+            idx, w = [], []
+            for h, pages in enumerate(self.clusters):
+                if not pages:
+                    continue
+                picked = [pages[rng.randrange(len(pages))] for _ in range(max(1, len(pages) - 1))]
+                items = np.concatenate(picked)
+                idx.append(items)
+                w.append(np.full(len(items), self.W[h] / len(items)))
+            idx, w = np.concatenate(idx), np.concatenate(w)
+            boot.append(_weighted_quantile(self.prices[idx], w, q))
+        lo, hi = np.percentile(boot, [2.5, 97.5])
+        return point, float(lo), float(hi)
+
+    def histogram(self, bins: int = 30) -> tuple[np.ndarray, np.ndarray]:
+        """Гистограмма с весами выборки: оценка числа товаров категории в каждой корзине."""
+        return np.histogram(self.prices, bins=bins, weights=self.item_weights)
+
+    def category_size(self) -> float:
+        return float(self.item_weights.sum())
+
+    def summary(self, rng: random.Random | None = None) -> str:
+        if self.empty:
+            return f"Выборка: {len(self.sample.records)} товаров, цены не разобраны"
+        rng = rng or random.Random(0)
+        mean, half = self.mean()
+        median = self.quantile(0.5, rng)
+        q25, q75 = self.quantile(0.25, rng), self.quantile(0.75, rng)
+        pages = sum(self.sample.pages_sampled)
+        mean_txt = f"{mean:.0f} ± {half:.0f}" if half == half else f"{mean:.0f}"
+        return (
+            f"Выборка: {len(self.prices)} товаров, {pages} из {sum(self.sample.pages_total)} стр.\n"
+            f"В категории ~{self.category_size():.0f} товаров\n"
+            f"Mean: {mean_txt}\n"
+            f"Median: {median[0]:.0f} [{median[1]:.0f}; {median[2]:.0f}]\n"
+            f"Q25: {q25[0]:.0f} [{q25[1]:.0f}; {q25[2]:.0f}]\n"
+            f"Q75: {q75[0]:.0f} [{q75[1]:.0f}; {q75[2]:.0f}]\n"
+            f"(95% интервалы)"
+        )
+
+
+# -------------------------------------------------------------------
+# Обход
+# -------------------------------------------------------------------
+def _base_urls(category_url: str, marketplace: str) -> list[str]:
+    """Сортировка из настроек и, если заданы, ценовые диапазоны — отдельные страты."""
+    params = CRAWL_SAMPLE["params"][marketplace]
+    if CRAWL_SAMPLE["sort"].get(marketplace):
+        category_url = with_query(category_url, **{params["sort"]: CRAWL_SAMPLE["sort"][marketplace]})
+    bands = CRAWL_SAMPLE["price_bands"]
+    if not bands:
+        return [category_url]
+    scale = params["price_scale"]
+    return [with_query(category_url, **{params["price"]: f"{lo * scale};{hi * scale}"}) for lo, hi in bands]
+
+
+def crawl_sample(category_url: str, marketplace: str, detail_size: int, read_page, fetch_details,
+                 job_id: int | None = None) -> CategorySample:
+    """
+    Выборка категории: read_page(driver, url) -> записи страницы выдачи,
+    fetch_details(url) -> словарь деталей товара (см. парсеры маркетплейсов).
+    """
+    rng = random.Random()
+    sample = CategorySample()
+    driver = get_webdriver()
+    try:
+        for base in _base_urls(category_url, marketplace):
+            cards = listing_pages(driver, base, read_page)
+            last = find_last_page(lambda p: bool(cards(p)), CRAWL_SAMPLE["max_pages"])
+            logger.info(f"Выборка {base}: страниц {last}")
+            plan = plan_pages(last, CRAWL_SAMPLE["strata"], CRAWL_SAMPLE["pages_per_stratum"], rng)
+            for pages_total, pages in plan:
+                h = sample.add_stratum(pages_total, len(pages))
+                for page in pages:
+                    for record in cards(page):
+                        sample.add(record, h, page)
+                if job_id:
+                    set_progress(job_id, "listing", len(sample.records), 0)
+    finally:
+        driver.quit()
+
+    chosen = sample.pick_details(detail_size, rng)
+    for n, i in enumerate(chosen, 1):
+        check_cancelled()
+        info = fetch_details(sample.records[i].url)
+        check_cancelled()
+        sample.records[i].update(info)
+        sample.detailed = n
+        if job_id:
+            set_progress(job_id, "details", n, len(chosen))
+    return sample
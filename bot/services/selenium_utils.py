@@ -4,6 +4,7 @@ import logging
 import os
 import time
 import random
+import threading
 from datetime import datetime
 
 from selenium import webdriver
@@ -13,7 +14,8 @@ from selenium.webdriver.common.by import By
 from webdriver_manager.chrome import ChromeDriverManager
 from bs4 import BeautifulSoup
 
-from ..config import get_selenium_config, get_marketplace_config
+from ..config import CRAWL_SCROLL, get_selenium_config, get_marketplace_config
+from .cancellation import register_driver
 
 logger = logging.getLogger(__name__)
 
@@ -38,7 +40,50 @@ def get_webdriver():
         options=opts
     )
     driver.set_page_load_timeout(cfg.get("page_load_timeout", 30))
-    return driver
+    # внутри задачи парсинга отмена закроет этот браузер сразу
+    return register_driver(driver)
+
+class DriverPool:
+    """
+    Браузеры для параллельного чтения страниц: по одному на поток пула,
+    создаются при первой странице потока, закрываются все в close().
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            driver = self._local.driver = get_webdriver()
+            with self._lock:
+                self._drivers.append(driver)
+        return driver
+
+    def discard(self):
+        """Закрывает браузер текущего потока (например, после сбоя); следующий get() откроет новый."""
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            return
+        self._local.driver = None
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.debug(f"Браузер уже закрыт: {e}")
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.debug(f"Браузер уже закрыт: {e}")
 
 def capture_screenshot(driver, name: str) -> str:
     screenshots_dir = get_selenium_config().get("screenshots_dir", "screenshots")
@@ -101,6 +146,69 @@ async def scroll_page(driver, max_scrolls=5):
             break
         last = cur
 
+# Прокрутка с MutationObserver: новые карточки замечаются по изменениям DOM,
+# а не опросом с паузами; страница листается дальше сразу после подгрузки.
+# Уникальность карточки — по ссылке без параметров.
+_LOAD_CARDS_JS = """
+const [cardSel, linkSel, target, idleMs, graceMs, timeoutMs, done] = arguments;
+const started = Date.now();
+const count = () => {
+    const keys = new Set();
+    for (const card of document.querySelectorAll(cardSel)) {
+        const a = linkSel ? card.querySelector(linkSel) : null;
+        keys.add(a && a.href ? a.href.split('?')[0] : card);
+    }
+    return keys.size;
+};
+let idle = null, deadline = null, finished = false;
+const observer = new MutationObserver(() => step());
+const finish = (reached) => {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(idle);
+    clearTimeout(deadline);
+    done([count(), reached]);
+};
+const step = () => {
+    if (finished) return;
+    if (target && count() >= target) return finish(true);
+    window.scrollBy(0, window.innerHeight);
+    clearTimeout(idle);
+    idle = setTimeout(() => {
+        const bottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 2;
+        // пока карточек нет, первую порцию ждём graceMs — дальше страница пустая
+        if (bottom && (count() > 0 || Date.now() - started >= graceMs)) return finish(false);
+        window.scrollTo(0, document.body.scrollHeight);
+        step();
+    }, idleMs);
+};
+observer.observe(document.body, {childList: true, subtree: true});
+deadline = setTimeout(() => finish(false), timeoutMs);
+step();
+"""
+
+
+def load_cards(driver, cfg: dict, target: int | None = None,
+               timeout: float | None = None) -> tuple[int, bool]:
+    """
+    Прокручивает выдачу, пока на странице не наберётся target уникальных
+    карточек (без target — пока выдача растёт). Возвращает (карточек, набрано ли).
+    """
+    idle = CRAWL_SCROLL["idle"]
+    timeout = CRAWL_SCROLL["timeout"] if timeout is None else min(timeout, CRAWL_SCROLL["timeout"])
+    driver.set_script_timeout(timeout + 10)
+    try:
+        count, reached = driver.execute_async_script(
+            _LOAD_CARDS_JS, cfg["product_card_selector"], cfg.get("link_selector", ""),
+            target or 0, int(idle * 1000), int(CRAWL_SCROLL["empty_grace"] * 1000), int(timeout * 1000),
+        )
+    except Exception as e:
+        logger.debug(f"Подгрузка карточек прервана: {e}")
+        return len(driver.find_elements(By.CSS_SELECTOR, cfg["product_card_selector"])), False
+    return count, reached
+
+
 async def check_selectors_validity():
     while True:
         for m in ("ozon", "wb"):
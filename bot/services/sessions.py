@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .datasets import file_hash
+from .storage import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних датасетов помнить на чат
+MAX_RECENT = 10
+
+# Индекс файлов пользователей: вместо сканирования CSV_DIR
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_datasets (
+    chat_id      INTEGER NOT NULL,
+    path         TEXT    NOT NULL,
+    name         TEXT    NOT NULL,
+    content_hash TEXT    NOT NULL,
+    added_at     REAL    NOT NULL,
+    PRIMARY KEY (chat_id, path)
+);
+CREATE INDEX IF NOT EXISTS idx_user_datasets_chat ON user_datasets (chat_id, added_at);
+"""
+
+
+def _db():
+    return ensure_schema("sessions", _SCHEMA)
+
+
+@dataclass
+class DatasetEntry:
+    path: Path
+    name: str
+    content_hash: str
+    added_at: float
+
+
+@dataclass
+class DatasetSession:
+    """Датасеты одного чата: активный и недавние (новые первыми)."""
+    chat_id: int
+    recent: list[DatasetEntry] = field(default_factory=list)
+    active: DatasetEntry | None = None
+
+
+_sessions: dict[int, DatasetSession] = {}
+_lock = threading.Lock()
+
+
+def _load_session(chat_id: int) -> DatasetSession:
+    rows = _db().execute(
+        "SELECT path, name, content_hash, added_at FROM user_datasets "
+        "WHERE chat_id = ? ORDER BY added_at DESC LIMIT ?",
+        (chat_id, MAX_RECENT),
+    ).fetchall()
+    recent = [DatasetEntry(Path(p), n, h, t) for p, n, h, t in rows]
+    return DatasetSession(chat_id, recent, recent[0] if recent else None)
+
+
+def get_session(chat_id: int) -> DatasetSession:
+    with _lock:
+        session = _sessions.get(chat_id)
+        if session is None:
+            session = _sessions[chat_id] = _load_session(chat_id)
+        return session
+
+
+def add_dataset(chat_id: int, path: Path, name: str | None = None) -> DatasetEntry:
+    """Добавляет файл в индекс чата и делает его активным."""
+    path = Path(path)
+    entry = DatasetEntry(path, name or path.name, file_hash(path), time.time())
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO user_datasets (chat_id, path, name, content_hash, added_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (chat_id, str(path), entry.name, entry.content_hash, entry.added_at),
+        )
+    session = get_session(chat_id)
+    with _lock:
+        session.recent = [entry] + [e for e in session.recent if e.path != path]
+        del session.recent[MAX_RECENT:]
+        session.active = entry
+    return entry
+
+
+def use_dataset(chat_id: int, index: int) -> DatasetEntry | None:
+    """Делает активным датасет с номером index (с 1) из списка недавних."""
+    session = get_session(chat_id)
+    with _lock:
+        if not 1 <= index <= len(session.recent):
+            return None
+        session.active = session.recent[index - 1]
+        return session.active
+
+
+def active_dataset(chat_id: int) -> Path | None:
+    """Путь к активному датасету чата; удалённые файлы пропускаются."""
+    session = get_session(chat_id)
+    with _lock:
+        candidates = ([session.active] if session.active else []) + session.recent
+        for entry in candidates:
+            if entry.path.exists():
+                session.active = entry
+                return entry.path
+    return None
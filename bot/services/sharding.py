@@ -0,0 +1,128 @@
+"""
+Разбиение большой категории на шарды по цене.
+
+Пагинация маркетплейса отдаёт не больше page_cap страниц, а один обход
+страниц занимает один браузер. Категория делится фильтром цены на
+непересекающиеся диапазоны; диапазон, в котором страница page_cap ещё не
+пуста, делится пополам (по геометрической середине — цены распределены
+скорее логарифмически), пока каждый не влезет в пагинацию. Каждый шард —
+отдельная задача очереди со своим браузером. Сначала шарды оценивают
+размер своей выдачи, и target задачи делится между ними пропорционально;
+затем каждый собирает свою долю, а задача-родитель объединяет их товары
+с дедупликацией по артикулу (см. crawl_jobs).
+"""
+import logging
+import math
+
+import pandas as pd
+
+from ..config import CRAWL_SAMPLE, CRAWL_SHARD
+from .cancellation import check_cancelled
+from .prices import parse_price_series
+from .records import ProductRecord, record_key
+from .sampling import allocate, find_last_page, listing_pages, with_query
+from .selenium_utils import get_webdriver
+
+logger = logging.getLogger(__name__)
+
+
+def _price_bound(records: list[ProductRecord], lowest: bool) -> int | None:
+    prices = parse_price_series(pd.Series([r.price for r in records], dtype="object")).dropna()
+    if prices.empty:
+        return None
+    return math.floor(prices.min()) if lowest else math.ceil(prices.max())
+
+
+def shard_url(category_url: str, marketplace: str, lo: int, hi: int) -> str:
+    params = CRAWL_SAMPLE["params"][marketplace]
+    scale = params["price_scale"]
+    return with_query(category_url, **{params["price"]: f"{lo * scale};{hi * scale}"})
+
+
+def plan_price_shards(category_url: str, marketplace: str, read_page) -> list[str]:
+    """
+    Ссылки шардов категории. read_page(driver, url) -> записи страницы выдачи.
+    Границы цен берутся с первых страниц сортировок по возрастанию и убыванию цены.
+    """
+    params = CRAWL_SAMPLE["params"][marketplace]
+    cap, limit = CRAWL_SHARD["page_cap"], CRAWL_SHARD["max_shards"]
+    driver = get_webdriver()
+    try:
+        def page(url: str, n: int) -> list[ProductRecord]:
+            check_cancelled()
+            return read_page(driver, with_query(url, page=n))
+
+        sort_param, (asc, desc) = params["sort"], CRAWL_SHARD["price_sorts"][marketplace]
+        lo = _price_bound(page(with_query(category_url, **{sort_param: asc}), 1), lowest=True)
+        hi = _price_bound(page(with_query(category_url, **{sort_param: desc}), 1), lowest=False)
+        if lo is None or hi is None:
+            logger.warning(f"Не удалось определить диапазон цен {category_url}, без шардов")
+            return [category_url]
+
+        leaves, stack = [], [(lo, hi)]
+        while stack:
+            a, b = stack.pop()
+            url = shard_url(category_url, marketplace, a, b)
+            last = page(url, cap)
+            # за последней страницей маркетплейс может снова отдать первую
+            overflow = bool(last) and last[0].url != (page(url, 1) or [ProductRecord()])[0].url
+            if not overflow or len(leaves) + len(stack) + 2 > limit:
+                leaves.append((a, b))
+                continue
+            if a >= b:
+                logger.warning(f"Цена {a}: товаров больше, чем {cap} страниц, шард будет неполным")
+                leaves.append((a, b))
+                continue
+            mid = max(a, min(b - 1, int(math.sqrt(max(a, 1) * b))))
+            stack += [(mid + 1, b), (a, mid)]
+    finally:
+        driver.quit()
+    leaves.sort()
+    logger.info(f"Категория {category_url}: шардов {len(leaves)} — {leaves}")
+    return [shard_url(category_url, marketplace, a, b) for a, b in leaves]
+
+
+def estimate_listing_size(url: str, read_page) -> int:
+    """Товаров в выдаче шарда: последняя страница бинарным поиском (≈log2(page_cap) загрузок)."""
+    driver = get_webdriver()
+    try:
+        cards = listing_pages(driver, url, read_page)
+        last = find_last_page(lambda p: bool(cards(p)), CRAWL_SHARD["page_cap"])
+        return (last - 1) * len(cards(1)) + len(cards(last)) if last else 0
+    finally:
+        driver.quit()
+
+
+def shard_targets(sizes: list[int], target: int) -> list[int]:
+    """
+    Сколько товаров собирать каждому шарду. Если шарды вместе больше target —
+    доли пропорциональны размерам, чтобы ценовые диапазоны были представлены
+    как в категории; иначе каждый собирает всё (оценка размера могла занизить).
+    """
+    if sum(sizes) > target:
+        return allocate(sizes, target)
+    return [target if size else 0 for size in sizes]
+
+
+def merge_shards(parts: list[list[ProductRecord]], target: int) -> tuple[list[ProductRecord], int]:
+    """
+    Товары шардов без повторов по артикулу (или ссылке); (записи, дубликатов).
+    Если их больше target (отмена до раздела долей, заниженная оценка) —
+    у каждого шарда берётся пропорциональная доля, а не первые по порядку цен.
+    """
+    seen: set[str] = set()
+    unique, duplicates = [], 0
+    for records in parts:
+        kept = []
+        for r in records:
+            key = record_key(r)
+            if key and key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            kept.append(r)
+        unique.append(kept)
+    counts = [len(kept) for kept in unique]
+    if sum(counts) > target:
+        counts = allocate(counts, target)
+    return [r for kept, n in zip(unique, counts) for r in kept[:n]], duplicates
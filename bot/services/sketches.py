@@ -0,0 +1,178 @@
+import numpy as np
+
+
+class AdaptiveHistogram:
+    """
+    Гистограмма с фиксированным числом корзин и растущим диапазоном.
+    Когда значения выходят за границы, диапазон расширяется с запасом,
+    а накопленные счётчики перераспределяются по новым корзинам.
+    Сливается с другой такой же гистограммой.
+    """
+
+    def __init__(self, bins: int = 512):
+        self.bins = bins
+        self.lo = self.hi = None
+        self.counts = np.zeros(bins)
+
+    @property
+    def edges(self) -> np.ndarray:
+        return np.linspace(self.lo, self.hi, self.bins + 1)
+
+    def _rebin(self, lo: float, hi: float):
+        if self.lo is not None and self.counts.any():
+            old = self.edges
+            centers = (old[:-1] + old[1:]) / 2
+            self.counts, _ = np.histogram(centers, bins=np.linspace(lo, hi, self.bins + 1), weights=self.counts)
+        self.lo, self.hi = lo, hi
+
+    def _cover(self, vmin: float, vmax: float):
+        if self.lo is None:
+            # пустая гистограмма: берём диапазон данных с небольшим запасом
+            pad = (vmax - vmin) * 0.05 or max(abs(vmin) * 0.05, 1.0)
+            self._rebin(vmin - pad, vmax + pad)
+        elif vmin < self.lo or vmax > self.hi:
+            # расширяем минимум вдвое, чтобы перестроения были редкими
+            lo, hi = min(self.lo, vmin), max(self.hi, vmax)
+            span = hi - lo
+            grow = max(span, 2 * (self.hi - self.lo)) - span
+            if vmin < self.lo:
+                lo -= grow / 2 if vmax > self.hi else grow
+            if vmax > self.hi:
+                hi += grow / 2 if vmin < self.lo else grow
+            self._rebin(lo, hi)
+
+    def update(self, values: np.ndarray) -> "AdaptiveHistogram":
+        values = values[np.isfinite(values)]
+        if values.size:
+            self._cover(values.min(), values.max())
+            counts, _ = np.histogram(values, bins=self.edges)
+            self.counts += counts
+        return self
+
+    def merge(self, other: "AdaptiveHistogram") -> "AdaptiveHistogram":
+        if other.lo is None:
+            return self
+        self._cover(other.lo, other.hi)
+        centers = (other.edges[:-1] + other.edges[1:]) / 2
+        counts, _ = np.histogram(centers, bins=self.edges, weights=other.counts)
+        self.counts += counts
+        return self
+
+    def histogram(self, bins: int, lo: float, hi: float) -> tuple[np.ndarray, np.ndarray]:
+        """Свёртка в bins корзин на [lo, hi] — для графиков."""
+        edges = np.linspace(lo, hi, bins + 1)
+        if self.lo is None:
+            return np.zeros(bins), edges
+        centers = (self.edges[:-1] + self.edges[1:]) / 2
+        counts, _ = np.histogram(np.clip(centers, lo, hi), bins=edges, weights=self.counts)
+        return counts, edges
+
+
+class KLLSketch:
+    """
+    Квантильный скетч KLL: уровни-компакторы, элемент уровня h весит 2**h.
+    Переполненный уровень сортируется, и в следующий уходит каждый второй
+    элемент со случайным сдвигом. Ошибка ранга ~1/k, память O(k).
+    """
+
+    def __init__(self, k: int = 400, seed: int | None = None):
+        self.k = k
+        self.n = 0
+        self.levels: list[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(self.k * (2 / 3) ** depth), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # нечётный хвост остаётся на уровне, остальное прореживается
+                odd = items[-1:] if len(items) % 2 else items[:0]
+                even = items[:len(items) - len(odd)]
+                promoted = even[self._rng.integers(2)::2]
+                self.levels[level] = odd
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values: np.ndarray) -> "KLLSketch":
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if values.size:
+            self.n += values.size
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantiles(self, qs) -> np.ndarray:
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        if not self.n:
+            return np.full(qs.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lv), 2.0 ** h) for h, lv in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, cum = items[order], np.cumsum(weights[order])
+        idx = np.searchsorted(cum, qs * cum[-1], side="left")
+        return items[np.minimum(idx, len(items) - 1)]
+
+    def quantile(self, q: float) -> float:
+        return float(self.quantiles([q])[0])
+
+
+class PriceSketch:
+    """Точные min/max/сумма/число + гистограмма и KLL — всё сливаемое."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.hist = AdaptiveHistogram()
+        self.kll = KLLSketch()
+
+    def update(self, values) -> "PriceSketch":
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if values.size:
+            self.count += values.size
+            self.total += float(values.sum())
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+            self.hist.update(values)
+            self.kll.update(values)
+        return self
+
+    def merge(self, other: "PriceSketch") -> "PriceSketch":
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.hist.merge(other.hist)
+        self.kll.merge(other.kll)
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else float("nan")
+
+    @property
+    def median(self) -> float:
+        return self.kll.quantile(0.5)
+
+    def histogram(self, bins: int = 30) -> tuple[np.ndarray, np.ndarray]:
+        return self.hist.histogram(bins, self.min, self.max)
@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+
+from ..config import DB_PATH
+
+# Одно соединение на поток: sqlite3 не любит делить соединение между потоками,
+# а парсеры работают через asyncio.to_thread.
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Возвращает SQLite-соединение текущего потока (WAL, autocommit по `with`)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.schemas = set()
+    return conn
+
+
+def ensure_schema(name: str, ddl: str,
+                  columns: dict[str, dict[str, str]] | None = None) -> sqlite3.Connection:
+    """
+    Один раз на соединение выполняет DDL модуля и возвращает соединение.
+    columns — {таблица: {колонка: объявление}}, добавленные после первой версии схемы.
+    """
+    conn = get_connection()
+    if name not in _local.schemas:
+        conn.executescript(ddl)
+        for table, cols in (columns or {}).items():
+            ensure_columns(conn, table, cols)
+        _local.schemas.add(name)
+    return conn
+
+
+def ensure_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]):
+    """Досоздаёт недостающие колонки таблицы (для баз, созданных прежней версией схемы)."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    with conn:
+        for name, decl in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
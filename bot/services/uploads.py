@@ -0,0 +1,65 @@
+import logging
+import os
+import time
+from pathlib import Path
+
+from .datasets import file_hash
+from .storage import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Загруженные пользователями файлы: file_unique_id Telegram -> файл по хэшу
+# содержимого. Один и тот же файл не скачивается и не хранится дважды.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    file_unique_id TEXT PRIMARY KEY,
+    content_hash   TEXT NOT NULL,
+    path           TEXT NOT NULL,
+    created_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_hash ON uploads (content_hash);
+"""
+
+
+def _db():
+    return ensure_schema("uploads", _SCHEMA)
+
+
+def known_upload(file_unique_id: str) -> Path | None:
+    """Путь к уже сохранённому файлу; записи об удалённых очисткой файлах стираются."""
+    conn = _db()
+    row = conn.execute(
+        "SELECT path FROM uploads WHERE file_unique_id = ?", (file_unique_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    path = Path(row[0])
+    if path.exists():
+        return path
+    with conn:
+        conn.execute("DELETE FROM uploads WHERE file_unique_id = ?", (file_unique_id,))
+    return None
+
+
+def store_upload(tmp_path: Path, file_unique_id: str, upload_dir: Path, ext: str) -> Path:
+    """
+    Переносит скачанный файл в upload_dir/<хэш><ext>. Если такое
+    содержимое уже есть (тот же файл под другим file_unique_id), копия удаляется.
+    """
+    tmp_path = Path(tmp_path)
+    content_hash = file_hash(tmp_path)
+    dest = Path(upload_dir) / f"{content_hash}{ext}"
+    if dest.exists():
+        tmp_path.unlink()
+        # файл снова в ходу — не отдаём его очистке по возрасту
+        os.utime(dest)
+    else:
+        os.replace(tmp_path, dest)
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO uploads (file_unique_id, content_hash, path, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (file_unique_id, content_hash, str(dest), time.time()),
+        )
+    return dest
@@ -0,0 +1,52 @@
+"""
+Отдельные процессы-воркеры очереди парсинга:
+
+    python -m bot.worker [--processes N]
+
+Каждый процесс запускает CRAWL_QUEUE["workers_per_process"] воркеров и
+своего Bot для отправки результатов; задачи берутся из общей SQLite-очереди.
+Вместе с ними можно выставить CRAWL_BOT_WORKERS=0, чтобы процесс бота только
+принимал команды.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+
+from aiogram import Bot
+
+from .config import CRAWL_QUEUE, TG_BOT_TOKEN
+from .services.crawl_jobs import start_workers
+
+logger = logging.getLogger(__name__)
+
+
+async def _serve():
+    bot = Bot(token=TG_BOT_TOKEN)
+    try:
+        await asyncio.gather(*start_workers(bot, CRAWL_QUEUE["workers_per_process"], "worker"))
+    finally:
+        await bot.session.close()
+
+
+def run_process():
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркеры очереди парсинга")
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+    if args.processes <= 1:
+        return run_process()
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=run_process, daemon=False) for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
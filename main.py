@@ -28,8 +28,8 @@ def run_health_server():
     server = HTTPServer(("0.0.0.0", port), HealthHandler)
     server.serve_forever()
 
-# Запускаем HTTP-сервер в демон-потоке
-Thread(target=run_health_server, daemon=True).start()
-
 if __name__ == "__main__":
+    # Запускаем HTTP-сервер в демон-потоке (только в главном процессе:
+    # воркеры отрисовки графиков стартуют через spawn и импортируют этот модуль)
+    Thread(target=run_health_server, daemon=True).start()
     asyncio.run(dp.start_polling(bot))